@@ -79,7 +79,7 @@ async def get_devices(): # reutrn list of strings
             OnyeshaDevice(nDeviceID = '156950', strSpecialID = '301434060552790', dtCreated = datetime(2024, 11, 6, 9, 1, 51, 223000), strSatellite = 'Iridium')]
 
 
-async def get_positions():
+async def get_positions(device_id: str = None, start: datetime = None, end: datetime = None):
     return [OnyeshaPosition(Latitude = '-22.688246', Longitude = '-72.432657', RecDateTime = datetime(2023, 1, 3, 16, 5, 56, 120000), DeviceID = '156950'),
             OnyeshaPosition(Latitude = '-11.553351', Longitude = '-22.765566', RecDateTime = datetime(2023, 1, 3, 16, 5, 56, 120000), DeviceID = '156639'),
             OnyeshaPosition(Latitude = '-51.445334', Longitude = '-34.667656', RecDateTime = datetime(2023, 1, 3, 16, 5, 56, 120000), DeviceID = '155890'),
@@ -1,5 +1,14 @@
+from datetime import datetime
+from typing import Optional
+from app import settings
 from app.actions.client import OnyeshaDevice
-from .core import InternalActionConfiguration, PullActionConfiguration, AuthActionConfiguration
+from .core import (
+    InternalActionConfiguration,
+    PullActionConfiguration,
+    AuthActionConfiguration,
+    GenericActionConfiguration,
+    ExecutableActionMixin,
+)
 import pydantic
 
 class AuthenticateConfig(AuthActionConfiguration):
@@ -9,8 +18,89 @@ class AuthenticateConfig(AuthActionConfiguration):
                                 format="password")
 
 
+class PositionFilters(pydantic.BaseModel):
+    """Quality checks applied to the positions before sending them to Gundi. Failing positions are dropped."""
+    drop_zero_coordinates: bool = pydantic.Field(
+        True, title="Drop Zero Coordinates", description="Drop positions at latitude 0 and longitude 0"
+    )
+    drop_crc_errors: bool = pydantic.Field(
+        True, title="Drop CRC Errors", description="Drop positions with a non-zero CRC"
+    )
+    drop_rx_errors: bool = pydantic.Field(
+        True, title="Drop Reception Errors", description="Drop positions with a non-zero RxStatus"
+    )
+    max_pdop: Optional[pydantic.PositiveFloat] = pydantic.Field(
+        settings.POSITIONS_MAX_PDOP,
+        title="Max PDOP",
+        description="Drop positions with a higher PDOP (dilution of precision). Leave empty to keep them all"
+    )
+    drop_no_fix: bool = pydantic.Field(
+        True, title="Drop Positions Without Fix", description="Drop positions with FixType 0"
+    )
+    drop_duplicates: bool = pydantic.Field(
+        True, title="Drop Duplicates", description="Drop repeated positions of a device, with the same RecDateTime"
+    )
+
+
 class PullObservationsConfig(PullActionConfiguration):
     endpoint: str = "mobile/vehicles"
+    filters: PositionFilters = pydantic.Field(
+        PositionFilters(),
+        title="Position Filters",
+        description="Quality checks applied to the positions before sending them to Gundi"
+    )
 
 class PullObservationsFromDeviceBatch(InternalActionConfiguration):
-    devices: list[OnyeshaDevice]
\ No newline at end of file
+    devices: list[OnyeshaDevice]
+    filters: PositionFilters = PositionFilters()
+    max_concurrency: pydantic.PositiveInt = pydantic.Field(
+        settings.DEVICES_MAX_CONCURRENCY,
+        description="Max number of devices pulled at the same time"
+    )
+    fleet_wide_fetch: bool = pydantic.Field(
+        settings.PULL_FLEET_WIDE_FETCH,
+        description="Fetch the positions of all the devices once per time window, instead of once per device"
+    )
+
+
+class BackfillObservationsConfig(GenericActionConfiguration, ExecutableActionMixin):
+    start: datetime = pydantic.Field(..., title="Start", description="Start of the period to backfill")
+    end: datetime = pydantic.Field(..., title="End", description="End of the period to backfill")
+    device_ids: list[str] = pydantic.Field(
+        [], title="Devices", description="IDs of the devices to backfill. All the devices if empty"
+    )
+    shard_days: pydantic.PositiveInt = pydantic.Field(
+        settings.BACKFILL_SHARD_DAYS,
+        title="Shard Days",
+        description="The period is split in shards of this many days, each one pulled by a sub-action"
+    )
+    max_concurrent_shards: pydantic.PositiveInt = pydantic.Field(
+        settings.BACKFILL_MAX_CONCURRENT_SHARDS,
+        title="Max Concurrent Shards",
+        description="Max number of shards pulled at the same time. Limits the load added to live pulls"
+    )
+    filters: PositionFilters = pydantic.Field(
+        PositionFilters(),
+        title="Position Filters",
+        description="Quality checks applied to the positions before sending them to Gundi"
+    )
+
+    @pydantic.validator("end")
+    def validate_end(cls, v, values):
+        if (start := values.get("start")) and v <= start:
+            raise ValueError("end must be after start")
+        return v
+
+
+class BackfillObservationsShard(InternalActionConfiguration):
+    backfill_id: str
+    devices: list[OnyeshaDevice]
+    start: datetime  # Start of the whole backfill
+    end: datetime
+    shard_days: pydantic.PositiveInt
+    shard_index: int
+    shards_step: pydantic.PositiveInt  # Shards are chained. The next shard to pull is shard_index + shards_step
+    filters: PositionFilters = PositionFilters()
+    rerun_device_ids: list[str] = []  # Devices pulled when the shard runs again. All the devices if empty
+    device_retries: dict[str, int] = {}  # Runs of this shard retried so far after errors, per device ID
+    failed_devices: list[str] = []  # Device IDs given up in previous runs of this shard
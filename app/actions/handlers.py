@@ -1,18 +1,32 @@
+import asyncio
+import math
+import uuid
+from collections import Counter, defaultdict, deque
+from contextlib import AsyncExitStack
+from functools import partial
 from datetime import datetime, timedelta, timezone
 import logging
 
 import httpx
 from app import settings
-from app.services.action_scheduler import trigger_action
-from app.services.utils import generate_batches
+from app.services.action_scheduler import trigger_actions
+from app.services.utils import generate_batches, get_remaining_time
 import pydantic
 
 import app.services.gundi as gundi_tools
-from app.actions import client
-from app.actions.configurations import AuthenticateConfig, PullObservationsConfig, PullObservationsFromDeviceBatch
+from app.actions import client, transformers
+from app.actions.configurations import (
+    AuthenticateConfig,
+    PullObservationsConfig,
+    PullObservationsFromDeviceBatch,
+    PositionFilters,
+    BackfillObservationsConfig,
+    BackfillObservationsShard,
+)
 from app.services.activity_logger import activity_logger, log_action_activity
 from .state import IntegrationState
 from app.services.state import IntegrationStateManager
+from gundi_core.commands import RunIntegrationAction
 from gundi_core.schemas.v2.gundi import LogLevel
 
 
@@ -72,42 +86,320 @@ async def action_fetch_samples(integration, action_config: PullObservationsConfi
         return {"valid_credentials": False}
     
 
-def filter_and_transform_positions(positions):
-    valid_positions = []
+def filter_and_transform_positions(positions, filters: PositionFilters = None) -> tuple:
+    # Positions are filtered and transformed in bulk, as columns
+    return transformers.transform_positions(positions, filters)
 
+
+def ensure_timezone_aware(val: datetime, default_tz: timezone = timezone.utc) -> datetime:
+    if not val.tzinfo:
+        val = val.replace(tzinfo=default_tz)
+    return val
+
+
+def _is_time_budget_exhausted() -> bool:
+    remaining_time = get_remaining_time()
+    return remaining_time is not None and remaining_time < settings.ACTION_TIME_BUDGET_MARGIN
+
+
+def _plan_windows(lower_date: datetime, upper_date: datetime, positions_per_day: float = None) -> list:
+    """
+    Splits [lower_date, upper_date) in time windows expected to have about WINDOW_TARGET_POSITIONS positions each,
+    based on the position density seen in previous runs. Uses the largest window if the density is unknown.
+    """
+    max_window = timedelta(days=settings.WINDOW_MAX_DAYS)
+    if positions_per_day:
+        window = timedelta(days=settings.WINDOW_TARGET_POSITIONS / positions_per_day)
+        window = min(max_window, max(timedelta(hours=settings.WINDOW_MIN_HOURS), window))
+    else:
+        window = max_window
+    windows = []
+    while lower_date < upper_date:
+        window_end = min(upper_date, lower_date + window)
+        windows.append((lower_date, window_end))
+        lower_date = window_end
+    return windows
+
+
+async def _fetch_positions(
+        fetch_window, windows: list, positions_queue: asyncio.Queue, max_concurrency: int, source_name: str
+) -> tuple:
+    """
+    Pipeline stage 1: Fetches positions from Onyesha with the async `fetch_window(start=, end=)` callable,
+    several windows at a time, and passes them on in order so that progress is saved in order.
+    Stops early if the action is running out of time.
+    Returns the end of the last window fetched and the number of positions fetched.
+    """
+    windows = deque(windows)
+    in_flight = deque()  # (window_end, fetch task), in window order
+    fetched_until = windows[0][0] if windows else None
+    positions_fetched = 0
+
+    def _start_fetches():
+        while windows and len(in_flight) < max_concurrency:
+            if _is_time_budget_exhausted():
+                logger.info(f"Running out of time. Pull for {source_name} will continue later.")
+                windows.clear()
+                return
+            lower_date, upper_date = windows.popleft()
+            fetch = asyncio.create_task(fetch_window(start=lower_date, end=upper_date))
+            in_flight.append((lower_date, upper_date, fetch))
+
+    try:
+        _start_fetches()
+        while in_flight:
+            lower_date, upper_date, fetch = in_flight.popleft()
+            positions = await fetch
+            logger.info(
+                f"Extracted {len(positions)} obs from Onyesha for {source_name} between {lower_date} and {upper_date}.")
+            _start_fetches()
+            await positions_queue.put((positions, upper_date))  # Blocks while the next stages are busy
+            fetched_until = upper_date
+            positions_fetched += len(positions)
+    finally:
+        for _, _, fetch in in_flight:
+            fetch.cancel()
+    await positions_queue.put(None)  # Signal the end of the stream
+    return fetched_until, positions_fetched
+
+
+async def _transform_positions(
+        positions_queue: asyncio.Queue, batches_queue: asyncio.Queue, filters: PositionFilters = None,
+        dropped: Counter = None
+):
+    """
+    Pipeline stage 2: Filters and transforms positions and groups them in batches of observations.
+    Batches are paired with the end of the window they complete, if any, so that progress can be saved.
+    The positions dropped by the filters are counted per reason in `dropped`.
+    """
+    batch = []
+    while (item := await positions_queue.get()) is not None:
+        positions, window_end = item
+        cdip_positions, positions_dropped = filter_and_transform_positions(positions, filters)
+        if dropped is not None:
+            dropped.update(positions_dropped)
+        logger.debug(f"Transformed {len(cdip_positions)} of {len(positions)} points. Dropped: {dict(positions_dropped)}")
+        for cdip_position in cdip_positions:
+            batch.append(cdip_position)
+            if len(batch) >= settings.OBSERVATIONS_BATCH_SIZE:
+                await batches_queue.put((batch, None))
+                batch = []
+        # Flush at the end of each window, so it's checkpointed once delivered
+        await batches_queue.put((batch, window_end))
+        batch = []
+    await batches_queue.put(None)
+
+
+async def _send_observations(integration, batches_queue: asyncio.Queue, checkpoint=None) -> int:
+    """
+    Pipeline stage 3: Sends batches of observations to Gundi as soon as they are ready.
+    The async `checkpoint` callable is awaited with the end of each window once it's delivered, to save progress.
+    """
+    observations_sent = 0
+    while (item := await batches_queue.get()) is not None:
+        batch, window_end = item
+        if batch:
+            await gundi_tools.send_observations_to_gundi(observations=batch, integration_id=integration.id)
+            observations_sent += len(batch)
+        if window_end and checkpoint:
+            await checkpoint(window_end)
+    return observations_sent
+
+
+async def _run_pull_pipeline(
+        integration, fetch_window, windows: list, checkpoint=None, max_concurrent_windows: int = None,
+        source_name: str = "", filters: PositionFilters = None, dropped: Counter = None
+) -> tuple:
+    """
+    Pulls positions in the given time windows with `fetch_window` and sends them to Gundi as observations.
+    Positions not passing the quality `filters` are dropped, and counted per reason in `dropped`.
+    Returns the number of observations sent, the end of the last window fetched, and the number of positions fetched.
+    """
+    # Fetch, transform and send run as concurrent stages joined by bounded queues,
+    # so memory usage is capped and a slow Gundi API slows down fetching (backpressure)
+    positions_queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+    batches_queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+    max_concurrent_windows = max_concurrent_windows or settings.WINDOWS_MAX_CONCURRENCY
+    stages = [
+        asyncio.create_task(
+            _fetch_positions(fetch_window, windows, positions_queue, max_concurrent_windows, source_name)
+        ),
+        asyncio.create_task(_transform_positions(positions_queue, batches_queue, filters, dropped)),
+        asyncio.create_task(_send_observations(integration, batches_queue, checkpoint)),
+    ]
+    try:
+        (fetched_until, positions_fetched), _, observations_sent = await asyncio.gather(*stages)
+    except Exception:
+        for stage in stages:  # Don't leave other stages blocked on a queue
+            stage.cancel()
+        raise
+    return observations_sent, fetched_until, positions_fetched
+
+
+async def _pull_observations_from_device(
+        integration, device: client.OnyeshaDevice, state: IntegrationState, present_time: datetime,
+        filters: PositionFilters = None, dropped: Counter = None
+) -> tuple:
+    """
+    Pulls observations from a device from the last run until present_time.
+    Returns the number of observations sent, and the new state of the device if it was pulled completely.
+    """
+    lower_date = max(present_time - timedelta(days=settings.PULL_MAX_LOOKBACK_DAYS), state.last_run)
+    windows = _plan_windows(lower_date, present_time, state.positions_per_day)
+
+    async def _checkpoint(window_end: datetime):
+        if window_end < present_time:  # The final state is saved for all the devices together
+            await state_manager.set_state(
+                integration_id=str(integration.id),
+                action_id="pull_observations",
+                state={**state.dict(), "last_run": window_end},
+                source_id=str(device.nDeviceID)
+            )
+
+    observations_extracted, fetched_until, positions_fetched = await _run_pull_pipeline(
+        integration,
+        fetch_window=partial(client.get_positions, device_id=device.nDeviceID),
+        windows=windows,
+        checkpoint=_checkpoint,
+        source_name=f"device: {device.nDeviceID}",
+        filters=filters,
+        dropped=dropped
+    )
+
+    if observations_extracted:
+        logger.info(
+            f"Observations pulled successfully for integration ID: {integration.id}, Device: {device.nDeviceID}"
+        )
+    else:
+        message = f"No positions fetched for device {device.nDeviceID} integration ID: {integration.id}."
+        logger.info(message)
+        await log_action_activity(
+            integration_id=str(integration.id),
+            action_id="pull_observations",
+            title=message,
+            level=LogLevel.DEBUG
+        )
+    if fetched_until is not None and fetched_until < present_time:  # Progress was saved after each window
+        return observations_extracted, None
+    # Remember the position density of the device to size the windows of the next run
+    positions_per_day = state.positions_per_day
+    days_pulled = (present_time - lower_date) / timedelta(days=1)
+    if days_pulled * 24 >= settings.WINDOW_MIN_HOURS:  # Too short periods aren't a good estimate
+        positions_per_day = positions_fetched / days_pulled
+    return observations_extracted, {"last_run": present_time, "positions_per_day": positions_per_day}
+
+
+def _index_positions_by_device(positions: list) -> dict:
+    positions_by_device = defaultdict(list)
     for position in positions:
-        cdip_pos = transform(position)
-        valid_positions.append(cdip_pos)
+        positions_by_device[str(position.DeviceID)].append(position)
+    return positions_by_device
 
-    return valid_positions
 
+async def _pull_observations_from_fleet(
+        integration, devices: list, states: dict, present_time: datetime,
+        filters: PositionFilters = None, dropped: Counter = None
+) -> tuple:
+    """
+    Pulls observations from many devices at once, fetching the positions of all the devices once per time window
+    and taking the positions of each device from an index by DeviceID.
+    Returns the number of observations sent, and a result per device like _pull_observations_from_device,
+    or None for devices being pulled by another run. If the pull fails, the result of the devices pulled is the error.
+    Devices whose lease can't be acquired fail alone, with the lease error as their result.
+    """
+    async with AsyncExitStack() as stack:
+        # A lease per device prevents overlapping runs from pulling the same device twice
+        leases = await asyncio.gather(
+            *[
+                stack.enter_async_context(state_manager.lease(
+                    integration_id=str(integration.id), action_id="pull_observations", source_id=str(device.nDeviceID)
+                ))
+                for device in devices
+            ],
+            return_exceptions=True  # Wait for all of them, so that the leases acquired are released on errors
+        )
+        lower_dates = {}  # Device ID -> start of the positions to pull
+        lease_errors = {}  # Device ID -> error acquiring its lease
+        for device, acquired in zip(devices, leases):
+            device_id = str(device.nDeviceID)
+            if isinstance(acquired, Exception):
+                lease_errors[device_id] = acquired
+            elif acquired:
+                lower_dates[device_id] = max(
+                    present_time - timedelta(days=settings.PULL_MAX_LOOKBACK_DAYS), states[device_id].last_run
+                )
+            else:
+                logger.info(f"Device {device_id} is being pulled by another run. Skipping.")
+        if not lower_dates:
+            return 0, [lease_errors.get(str(device.nDeviceID)) for device in devices]
 
-def transform(p: client.OnyeshaPosition):
-    data = {
-        "source": p.DeviceID,
-        "source_name": p.DeviceID,
-        'type': 'tracking-device',
-        "recorded_at": ensure_timezone_aware(p.RecDateTime).isoformat(),
-        "location": {
-            "lat": p.Latitude,
-            "lon": p.Longitude
-        },
-        "additional": p.dict(exclude={'DeviceID', 'Latitude', 'Longitude', 'RecDateTime'})
-    }
-    return data
+        fleet_lower_date = min(lower_dates.values())
+        # The positions per window of the fleet is the sum of the positions of its devices
+        positions_per_day = sum(states[device_id].positions_per_day or 0 for device_id in lower_dates) or None
+        windows = _plan_windows(fleet_lower_date, present_time, positions_per_day)
+        positions_fetched = Counter()  # Device ID -> positions fetched
 
+        async def _fetch_window(start: datetime, end: datetime) -> list:
+            positions_by_device = _index_positions_by_device(await client.get_positions(start=start, end=end))
+            positions = []
+            for device_id, lower_date in lower_dates.items():  # Positions of other devices are never transformed
+                device_positions = [
+                    position for position in positions_by_device.get(device_id, [])
+                    if ensure_timezone_aware(position.RecDateTime) >= lower_date  # Sent in a previous run
+                ]
+                positions_fetched[device_id] += len(device_positions)
+                positions.extend(device_positions)
+            return positions
 
-def ensure_timezone_aware(val: datetime, default_tz: timezone = timezone.utc) -> datetime:
-    if not val.tzinfo:
-        val = val.replace(tzinfo=default_tz)
-    return val
+        async def _checkpoint(window_end: datetime):
+            if window_end < present_time:  # The final state is saved for all the devices together
+                await state_manager.set_states(
+                    integration_id=str(integration.id),
+                    action_id="pull_observations",
+                    states={
+                        device_id: {**states[device_id].dict(), "last_run": window_end}
+                        for device_id, lower_date in lower_dates.items() if lower_date < window_end
+                    }
+                )
+
+        try:
+            observations_extracted, fetched_until, _ = await _run_pull_pipeline(
+                integration,
+                fetch_window=_fetch_window,
+                windows=windows,
+                checkpoint=_checkpoint,
+                source_name=f"{len(lower_dates)} devices",
+                filters=filters,
+                dropped=dropped
+            )
+        except Exception as e:  # The devices share the fetches, so they fail together
+            return 0, [
+                e if str(device.nDeviceID) in lower_dates else lease_errors.get(str(device.nDeviceID))
+                for device in devices
+            ]
+
+    results = []
+    for device in devices:
+        device_id = str(device.nDeviceID)
+        if device_id not in lower_dates:
+            results.append(lease_errors.get(device_id))
+        elif fetched_until is not None and fetched_until < present_time:  # Progress was saved after each window
+            results.append((0, None))
+        else:
+            state = states[device_id]
+            days_pulled = (present_time - lower_dates[device_id]) / timedelta(days=1)
+            if days_pulled * 24 >= settings.WINDOW_MIN_HOURS:  # Too short periods aren't a good estimate
+                positions_per_day = positions_fetched[device_id] / days_pulled
+            else:
+                positions_per_day = state.positions_per_day
+            results.append((0, {"last_run": present_time, "positions_per_day": positions_per_day}))
+    return observations_extracted, results
 
 
 @activity_logger()
 async def action_pull_observations_from_device_batch(integration, action_config: PullObservationsFromDeviceBatch):
     logger.info(f"Executing pull_observations_by_date action with integration {integration} and action_config {action_config}...")
     device_list = action_config.devices or []
-    observations_extracted = 0
 
     present_time = datetime.now(tz=timezone.utc)
 
@@ -116,63 +408,333 @@ async def action_pull_observations_from_device_batch(integration, action_config:
         f"Running Onyesha integration for integration '{integration.name}({integration.id})'. Devices: {device_ids}"
     )
 
-    for device in device_list:
-        cdip_positions = []
+    # Load the state of all the devices in one round trip
+    saved_states = await state_manager.get_states(
+        integration_id=str(integration.id), action_id="pull_observations", source_ids=device_ids
+    )
+
+    states = {}
+    for device_id in device_ids:
         try:
-            saved_state = await state_manager.get_state(
-                integration_id=str(integration.id), action_id="pull_observations", source_id=str(device.nDeviceID)
-            )
-            state = IntegrationState.parse_obj({"last_run": saved_state})
+            states[device_id] = IntegrationState.parse_obj(saved_states.get(device_id, {}))
         except pydantic.ValidationError as e:
-            state = IntegrationState()
-        lower_date = max(present_time - timedelta(days=7), state.last_run)
-        upper_date = min(present_time, lower_date + timedelta(days=7))
-        while lower_date < present_time:
-            positions = await client.get_positions()
-            logger.info(
-                f"Extracted {len(positions)} obs from Onyesha for device: {device.nDeviceID} between {lower_date} and {upper_date}.")
-            cdip_positions = filter_and_transform_positions(positions)
-            logger.debug(
-                f"Extracted {len(cdip_positions)} of {len(positions)} points between {lower_date} and {upper_date}.")
-            lower_date = upper_date
+            states[device_id] = IntegrationState()
 
-        if cdip_positions:
-            logger.info(
-                f"Observations pulled successfully for integration ID: {integration.id}, Device: {device.nDeviceID}"
-            )
-            for batch in enumerate(generate_batches(cdip_positions, settings.OBSERVATIONS_BATCH_SIZE)):
-                await gundi_tools.send_observations_to_gundi(observations=batch, integration_id=integration.id)
-                observations_extracted += len(cdip_positions)
+    dropped = Counter()  # Positions dropped by the quality filters, per reason
+
+    # Pull devices concurrently, with at most max_concurrency devices in flight at any time
+    semaphore = asyncio.Semaphore(action_config.max_concurrency)
+
+    async def _pull_with_limit(device):
+        state = states[str(device.nDeviceID)]
+        async with semaphore:
+            # A lease per device prevents overlapping runs from pulling the same device twice
+            async with state_manager.lease(
+                integration_id=str(integration.id), action_id="pull_observations", source_id=str(device.nDeviceID)
+            ) as acquired:
+                if not acquired:
+                    logger.info(f"Device {device.nDeviceID} is being pulled by another run. Skipping.")
+                    return None
+                if _is_time_budget_exhausted():  # Leave it for the continuation
+                    return 0, None
+                return await _pull_observations_from_device(
+                    integration, device, state, present_time, action_config.filters, dropped
+                )
+
+    if action_config.fleet_wide_fetch:  # Fetch positions for all the devices together
+        observations_extracted, results = await _pull_observations_from_fleet(
+            integration, device_list, states, present_time, action_config.filters, dropped
+        )
+    else:
+        observations_extracted = 0
+        results = await asyncio.gather(
+            *[_pull_with_limit(device) for device in device_list],
+            return_exceptions=True
+        )
+
+    # Errors are isolated per device, so one failing device doesn't affect the others
+    failed_devices = []
+    skipped_devices = []
+    unfinished_devices = []
+    new_states = {}
+    errors = defaultdict(list)  # Error -> IDs of the devices that failed with it
+    for device, result in zip(device_list, results):
+        if isinstance(result, Exception):
+            errors[result].append(str(device.nDeviceID))
+            failed_devices.append(str(device.nDeviceID))
+        elif result is None:
+            skipped_devices.append(str(device.nDeviceID))
         else:
-            message = f"No positions fetched for device {device.nDeviceID} integration ID: {integration.id}."
-            logger.info(message)
-            await log_action_activity(
-                integration_id=str(integration.id),
-                action_id="pull_observations",
-                title=message,
-                level=LogLevel.DEBUG
-            )
-        await state_manager.set_state(
+            observations_sent, new_state = result
+            observations_extracted += observations_sent
+            if new_state:
+                new_states[str(device.nDeviceID)] = new_state
+            else:  # Progress was saved after each window
+                unfinished_devices.append(device)
+    for error, error_device_ids in errors.items():  # Devices pulled together fail with the same error, logged once
+        devices_str = f"device {error_device_ids[0]}" if len(error_device_ids) == 1 else f"devices {error_device_ids}"
+        message = f"Error pulling observations for {devices_str} integration ID: {integration.id}: {type(error).__name__}: {error}"
+        logger.error(message)
+        await log_action_activity(
             integration_id=str(integration.id),
             action_id="pull_observations",
-            source_id=str(device.nDeviceID),
-            state={"last_run": upper_date}
+            title=message,
+            level=LogLevel.ERROR
+        )
+    # Save the state of the devices pulled successfully in one round trip
+    await state_manager.set_states(
+        integration_id=str(integration.id), action_id="pull_observations", states=new_states
+    )
+    if unfinished_devices:  # Continue in a new action, from the last checkpoint of each device
+        logger.info(
+            f"Time budget exhausted for integration {integration.id}. "
+            f"Triggering continuation for devices: {[str(device.nDeviceID) for device in unfinished_devices]}"
         )
-    return {'observations_extracted': observations_extracted}
+        await trigger_actions([
+            RunIntegrationAction(
+                integration_id=integration.id,
+                action_id="pull_observations_from_device_batch",
+                config_overrides=action_config.copy(update={"devices": unfinished_devices}).dict()
+            )
+        ])
+    return {
+        'observations_extracted': observations_extracted,
+        'failed_devices': failed_devices,
+        'skipped_devices': skipped_devices,
+        'continued_devices': [str(device.nDeviceID) for device in unfinished_devices],
+        'dropped_positions': dict(dropped)
+    }
 
 
 @activity_logger()
 async def action_pull_observations(integration, action_config: PullObservationsConfig):
     logger.info(f"Executing pull_observations action with integration {integration} and action_config {action_config}...")
+    async with state_manager.lease(integration_id=str(integration.id), action_id="pull_observations") as acquired:
+        if not acquired:
+            logger.info(f"A previous run of pull_observations for integration {integration.id} is in progress. Skipping.")
+            return {"subactions_triggered": 0, "skipped": True}
+        device_list = await client.get_devices()
+        logger.info(f"Extracted {len(device_list)} devices from Onyesha for inbound: {integration.id}")
+        # With fleet-wide fetch, one sub-action pulls the positions of the whole account
+        batch_size = max(len(device_list), 1) if settings.PULL_FLEET_WIDE_FETCH else settings.DEVICES_BATCH_SIZE
+        commands = [
+            RunIntegrationAction(
+                integration_id=integration.id,
+                action_id="pull_observations_from_device_batch",
+                config_overrides=PullObservationsFromDeviceBatch(
+                    devices=device_batch, filters=action_config.filters
+                ).dict()
+            )
+            for device_batch in generate_batches(device_list, batch_size)
+        ]
+        await trigger_actions(commands)
+
+    return {"subactions_triggered": len(commands)}
+
+
+def _get_backfill_shard_period(shard_config: BackfillObservationsShard) -> tuple:
+    shard_start = shard_config.start + timedelta(days=shard_config.shard_days * shard_config.shard_index)
+    return shard_start, min(shard_config.end, shard_start + timedelta(days=shard_config.shard_days))
+
+
+@activity_logger()
+async def action_backfill_observations(integration, action_config: BackfillObservationsConfig):
+    logger.info(f"Executing backfill_observations action with integration {integration} and action_config {action_config}...")
     device_list = await client.get_devices()
-    logger.info(f"Extracted {len(device_list)} devices from Onyesha for inbound: {integration.id}")
-    subactions_triggered = 0
-    for device_batch in generate_batches(device_list, settings.DEVICES_BATCH_SIZE):
-        await trigger_action(
+    unknown_device_ids = set()
+    if action_config.device_ids:
+        device_list = [device for device in device_list if str(device.nDeviceID) in action_config.device_ids]
+        unknown_device_ids = set(action_config.device_ids) - {str(device.nDeviceID) for device in device_list}
+        if unknown_device_ids:  # Not owned by the integration's account
+            message = f"Devices not found in Onyesha for integration ID: {integration.id}. Skipping: {sorted(unknown_device_ids)}"
+            logger.warning(message)
+            await log_action_activity(
+                integration_id=str(integration.id),
+                action_id="backfill_observations",
+                title=message,
+                level=LogLevel.WARNING
+            )
+    if not device_list:
+        logger.warning(f"No devices to backfill for integration ID: {integration.id}.")
+        return {
+            "backfill_id": None,
+            "shards": 0,
+            "subactions_triggered": 0,
+            "unknown_device_ids": sorted(unknown_device_ids),
+        }
+    start = ensure_timezone_aware(action_config.start)
+    end = ensure_timezone_aware(action_config.end)
+    shards = math.ceil((end - start) / timedelta(days=action_config.shard_days))
+    backfill_id = str(uuid.uuid4())
+    # Backfills have their own state namespace, so they don't interfere with live pulls
+    await state_manager.set_state(
+        integration_id=str(integration.id),
+        action_id="backfill_observations",
+        state={
+            "start": start,
+            "end": end,
+            "shards": shards,
+            "device_ids": [str(device.nDeviceID) for device in device_list],
+            "created_at": datetime.now(tz=timezone.utc),
+        },
+        source_id=backfill_id,
+        ttl=settings.BACKFILL_STATE_TTL
+    )
+    # Start up to max_concurrent_shards chains of shards. Each shard triggers the next one of its chain when done
+    shards_step = min(action_config.max_concurrent_shards, shards)
+    commands = [
+        RunIntegrationAction(
             integration_id=integration.id,
-            action_id="pull_observations_from_device_batch",
-            config=PullObservationsFromDeviceBatch(devices=device_batch)
+            action_id="backfill_observations_shard",
+            config_overrides=BackfillObservationsShard(
+                backfill_id=backfill_id,
+                devices=device_list,
+                start=start,
+                end=end,
+                shard_days=action_config.shard_days,
+                shard_index=shard_index,
+                shards_step=shards_step,
+                filters=action_config.filters
+            ).dict()
         )
-        subactions_triggered += 1
+        for shard_index in range(shards_step)
+    ]
+    await trigger_actions(commands)
+    return {
+        "backfill_id": backfill_id,
+        "shards": shards,
+        "subactions_triggered": len(commands),
+        "unknown_device_ids": sorted(unknown_device_ids),
+    }
+
+
+@activity_logger()
+async def action_backfill_observations_shard(integration, action_config: BackfillObservationsShard):
+    logger.info(f"Executing backfill_observations_shard action with integration {integration} and action_config {action_config}...")
+    shard_start, shard_end = _get_backfill_shard_period(action_config)
+    shard_id = f"{action_config.backfill_id}.{action_config.shard_index}"
+    # Re-runs of the shard pull only the devices left unfinished or failed by the previous run
+    device_list = [
+        device for device in action_config.devices
+        if not action_config.rerun_device_ids or str(device.nDeviceID) in action_config.rerun_device_ids
+    ]
+    source_ids = {str(device.nDeviceID): f"{shard_id}.{device.nDeviceID}" for device in device_list}
+    # Resume from the progress saved by a previous run of this shard, if any
+    saved_states = await state_manager.get_states(
+        integration_id=str(integration.id), action_id="backfill_observations", source_ids=list(source_ids.values())
+    )
+    semaphore = asyncio.Semaphore(settings.BACKFILL_DEVICES_MAX_CONCURRENCY)
+    dropped = Counter()  # Positions dropped by the quality filters, per reason
 
-    return {"subactions_triggered": subactions_triggered}
+    async def _backfill_device(device):
+        source_id = source_ids[str(device.nDeviceID)]
+        lower_date = shard_start
+        if saved_state := saved_states.get(source_id):
+            lower_date = max(shard_start, IntegrationState.parse_obj(saved_state).last_run)
+
+        async def _checkpoint(window_end: datetime):
+            await state_manager.set_state(
+                integration_id=str(integration.id),
+                action_id="backfill_observations",
+                state={"last_run": window_end},
+                source_id=source_id,
+                ttl=settings.BACKFILL_STATE_TTL
+            )
+
+        async with semaphore:
+            if _is_time_budget_exhausted():  # Leave it for the continuation
+                return 0, False
+            observations_sent, fetched_until, _ = await _run_pull_pipeline(
+                integration,
+                fetch_window=partial(client.get_positions, device_id=device.nDeviceID),
+                windows=_plan_windows(lower_date, shard_end),
+                checkpoint=_checkpoint,
+                max_concurrent_windows=settings.BACKFILL_WINDOWS_MAX_CONCURRENCY,
+                source_name=f"device: {device.nDeviceID}",
+                filters=action_config.filters,
+                dropped=dropped
+            )
+            return observations_sent, fetched_until is None or fetched_until >= shard_end
+
+    results = await asyncio.gather(
+        *[_backfill_device(device) for device in device_list],
+        return_exceptions=True
+    )
+
+    observations_extracted = 0
+    failed_devices = list(action_config.failed_devices)  # Given up in previous runs of this shard
+    device_retries = dict(action_config.device_retries)
+    unfinished_devices = []
+    retried_devices = []
+    rerun_device_ids = []  # In the order of the shard's devices
+    for device, result in zip(device_list, results):
+        device_id = str(device.nDeviceID)
+        if isinstance(result, Exception):
+            retries = device_retries.get(device_id, 0)
+            message = f"Error backfilling observations for device {device.nDeviceID} integration ID: {integration.id}: {type(result).__name__}: {result}"
+            if retries < settings.BACKFILL_DEVICE_MAX_RETRIES:
+                message += f" Retrying ({retries + 1}/{settings.BACKFILL_DEVICE_MAX_RETRIES})."
+                device_retries[device_id] = retries + 1
+                retried_devices.append(device)
+                rerun_device_ids.append(device_id)
+            else:
+                message += " Giving up."
+                failed_devices.append(device_id)
+            logger.error(message)
+            await log_action_activity(
+                integration_id=str(integration.id),
+                action_id="backfill_observations",
+                title=message,
+                level=LogLevel.ERROR
+            )
+        else:
+            observations_sent, completed = result
+            observations_extracted += observations_sent
+            if not completed:
+                unfinished_devices.append(device)
+                rerun_device_ids.append(device_id)
+
+    if rerun_device_ids:  # Run the shard again for the unfinished and failed devices, from their last checkpoint
+        next_shard = action_config.copy(update={
+            "rerun_device_ids": rerun_device_ids,
+            "device_retries": device_retries,
+            "failed_devices": failed_devices,
+        })
+    else:  # Save the shard as done, and continue with the next shard of the chain
+        await state_manager.set_state(
+            integration_id=str(integration.id),
+            action_id="backfill_observations",
+            state={
+                "completed_at": datetime.now(tz=timezone.utc),
+                "observations_extracted": observations_extracted,
+                "failed_devices": failed_devices,
+                "dropped_positions": dict(dropped),
+            },
+            source_id=shard_id,
+            ttl=settings.BACKFILL_STATE_TTL
+        )
+        next_shard = action_config.copy(update={
+            "shard_index": action_config.shard_index + action_config.shards_step,
+            "rerun_device_ids": [],
+            "device_retries": {},
+            "failed_devices": [],
+        })
+        if _get_backfill_shard_period(next_shard)[0] >= next_shard.end:
+            next_shard = None  # The chain is done
+    if next_shard:
+        await trigger_actions([
+            RunIntegrationAction(
+                integration_id=integration.id,
+                action_id="backfill_observations_shard",
+                config_overrides=next_shard.dict()
+            )
+        ])
+    return {
+        "backfill_id": action_config.backfill_id,
+        "shard_index": action_config.shard_index,
+        "observations_extracted": observations_extracted,
+        "failed_devices": failed_devices,
+        "continued_devices": [str(device.nDeviceID) for device in unfinished_devices],
+        "retried_devices": [str(device.nDeviceID) for device in retried_devices],
+        "dropped_positions": dict(dropped),
+    }
@@ -1,13 +1,15 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import pydantic
+from app import settings
 
 def default_last_run():
-    '''Default for a new configuration is to pretend the last run was 7 days ago'''
-    return datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=7)
+    '''Default for a new configuration is to pretend the last run was PULL_MAX_LOOKBACK_DAYS (7) days ago'''
+    return datetime.now(tz=timezone.utc) - timedelta(days=settings.PULL_MAX_LOOKBACK_DAYS)
 
 class IntegrationState(pydantic.BaseModel):
     last_run: datetime = pydantic.Field(default_factory=default_last_run, alias='last_run')
     error: str = None
+    positions_per_day: float = None  # Seen in the last run, used to size the time windows
 
     @pydantic.validator("last_run")
     def clean_last_run(cls, v):
@@ -0,0 +1,650 @@
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+import redis
+from gundi_core.schemas.v2.gundi import LogLevel
+
+from app import settings
+from app.actions.configurations import (
+    BackfillObservationsConfig,
+    BackfillObservationsShard,
+    PositionFilters,
+    PullObservationsConfig,
+    PullObservationsFromDeviceBatch,
+)
+from app.actions.handlers import (
+    _plan_windows,
+    _run_pull_pipeline,
+    action_backfill_observations,
+    action_backfill_observations_shard,
+    action_pull_observations,
+    action_pull_observations_from_device_batch,
+)
+from app.conftest import AsyncMock, make_onyesha_position
+
+
+@pytest.fixture
+def mock_handlers_dependencies(mocker, mock_publish_event, mock_state_manager_in_memory):
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.actions.handlers.state_manager", mock_state_manager_in_memory)
+    mock_log_action_activity = AsyncMock()
+    mocker.patch("app.actions.handlers.log_action_activity", mock_log_action_activity)
+    mock_trigger_actions = AsyncMock()
+    mocker.patch("app.actions.handlers.trigger_actions", mock_trigger_actions)
+    mock_send_observations = AsyncMock()
+    mocker.patch("app.services.gundi.send_observations_to_gundi", mock_send_observations)
+    return mock_log_action_activity, mock_trigger_actions, mock_send_observations
+
+
+@pytest.fixture
+def mock_get_positions(mocker):
+    """Returns an hourly position for each device requested, within the time window requested."""
+    async def get_positions(device_id=None, start=None, end=None):
+        device_ids = [device_id] if device_id else ["89222", "150167"]
+        positions = []
+        recorded_at = start
+        while recorded_at < end:
+            positions.extend(make_onyesha_position(device_id, recorded_at) for device_id in device_ids)
+            recorded_at += datetime.timedelta(hours=1)
+        return positions
+
+    return mocker.patch("app.actions.client.get_positions", side_effect=get_positions)
+
+
+def set_last_run(mock_state_manager, device_ids: list, last_run: datetime.datetime):
+    for device_id in device_ids:
+        mock_state_manager.saved_states[("pull_observations", device_id)] = {"last_run": last_run.isoformat()}
+
+
+def get_observations_sent(mock_send_observations) -> list:
+    return [
+        observation
+        for call in mock_send_observations.call_args_list
+        for observation in call.kwargs["observations"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_backfill_observations_starts_shard_chains(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    mock_log_action_activity, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.client.get_devices", AsyncMock(return_value=onyesha_devices))
+    action_config = BackfillObservationsConfig(
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 22, tzinfo=datetime.timezone.utc),
+        device_ids=["89222", "999999"],
+        shard_days=7,
+        max_concurrent_shards=2,
+    )
+
+    result = await action_backfill_observations(integration=integration_v2, action_config=action_config)
+
+    assert result["shards"] == 3
+    assert result["subactions_triggered"] == 2
+    # Devices that aren't in the integration's account are reported
+    assert result["unknown_device_ids"] == ["999999"]
+    assert mock_log_action_activity.call_args.kwargs["level"] == LogLevel.WARNING
+    assert "999999" in mock_log_action_activity.call_args.kwargs["title"]
+    # One chain of shards per concurrent shard, for the known devices only
+    commands = mock_trigger_actions.call_args.args[0]
+    shards = [BackfillObservationsShard.parse_obj(command.config_overrides) for command in commands]
+    assert [shard.shard_index for shard in shards] == [0, 1]
+    assert all(shard.shards_step == 2 for shard in shards)
+    assert all([str(device.nDeviceID) for device in shard.devices] == ["89222"] for shard in shards)
+    # The backfill state expires
+    backfill_id = result["backfill_id"]
+    assert mock_state_manager_in_memory.saved_states[("backfill_observations", backfill_id)]["shards"] == 3
+    assert mock_state_manager_in_memory.state_ttls[("backfill_observations", backfill_id)] == settings.BACKFILL_STATE_TTL
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_sends_observations_and_chains_next_shard(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    _, mock_trigger_actions, mock_send_observations = mock_handlers_dependencies
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices,
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=0,
+        shards_step=2,
+    )
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    # One observation per hour of the first day, for each device
+    assert result["observations_extracted"] == 48
+    assert len(get_observations_sent(mock_send_observations)) == 48
+    assert not result["failed_devices"]
+    assert not result["continued_devices"]
+    # The shard is saved as done, and the next shard of the chain is triggered
+    shard_state = mock_state_manager_in_memory.saved_states[("backfill_observations", "backfill-1.0")]
+    assert shard_state["observations_extracted"] == 48
+    assert mock_state_manager_in_memory.state_ttls[("backfill_observations", "backfill-1.0")] == settings.BACKFILL_STATE_TTL
+    command = mock_trigger_actions.call_args.args[0][0]
+    assert command.action_id == "backfill_observations_shard"
+    assert BackfillObservationsShard.parse_obj(command.config_overrides).shard_index == 2
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_ends_the_chain_after_the_last_shard(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices,
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=2,
+        shards_step=2,
+    )
+
+    await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    assert ("backfill_observations", "backfill-1.2") in mock_state_manager_in_memory.saved_states
+    assert not mock_trigger_actions.called
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_resumes_from_saved_progress(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    resume_from = datetime.datetime(2024, 1, 1, 18, tzinfo=datetime.timezone.utc)
+    mock_state_manager_in_memory.saved_states[("backfill_observations", "backfill-1.0.89222")] = {
+        "last_run": resume_from.isoformat()
+    }
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices[:1],
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=0,
+        shards_step=1,
+    )
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    # Only the hours after the last checkpoint are pulled again
+    assert mock_get_positions.call_args_list[0].kwargs["start"] == resume_from
+    assert result["observations_extracted"] == 6
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_is_continued_when_time_budget_is_exhausted(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory,
+        mock_get_positions
+):
+    _, mock_trigger_actions, mock_send_observations = mock_handlers_dependencies
+    mocker.patch("app.actions.handlers.get_remaining_time", return_value=0)
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices,
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=0,
+        shards_step=2,
+    )
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    # The same shard runs again for the unfinished devices, and it isn't saved as done yet
+    assert result["continued_devices"] == ["89222", "150167"]
+    assert not mock_send_observations.called
+    assert ("backfill_observations", "backfill-1.0") not in mock_state_manager_in_memory.saved_states
+    next_shard = BackfillObservationsShard.parse_obj(mock_trigger_actions.call_args.args[0][0].config_overrides)
+    assert next_shard.shard_index == 0
+    assert next_shard.rerun_device_ids == ["89222", "150167"]
+
+
+@pytest.mark.asyncio
+async def test_backfill_observations_without_known_devices(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.client.get_devices", AsyncMock(return_value=onyesha_devices))
+    action_config = BackfillObservationsConfig(
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 22, tzinfo=datetime.timezone.utc),
+        device_ids=["999999"],
+    )
+
+    result = await action_backfill_observations(integration=integration_v2, action_config=action_config)
+
+    # No shard chain is started with an empty device list
+    assert result["unknown_device_ids"] == ["999999"]
+    assert result["subactions_triggered"] == 0
+    assert not mock_trigger_actions.called
+    assert not mock_state_manager_in_memory.saved_states
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_retries_failed_devices(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory,
+        mock_get_positions
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    get_positions = mock_get_positions.side_effect
+    failures = {"150167": 1}  # The device fails once
+
+    async def get_positions_or_fail(device_id=None, start=None, end=None):
+        if failures.get(device_id):
+            failures[device_id] -= 1
+            raise httpx.ConnectTimeout("Onyesha is unreachable")
+        return await get_positions(device_id=device_id, start=start, end=end)
+
+    mock_get_positions.side_effect = get_positions_or_fail
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices,
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=0,
+        shards_step=2,
+    )
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    # The shard runs again for the failed device, and it isn't saved as done yet
+    assert result["retried_devices"] == ["150167"]
+    assert not result["failed_devices"]
+    assert ("backfill_observations", "backfill-1.0") not in mock_state_manager_in_memory.saved_states
+    retry_shard = BackfillObservationsShard.parse_obj(mock_trigger_actions.call_args.args[0][0].config_overrides)
+    assert retry_shard.shard_index == 0
+    assert retry_shard.rerun_device_ids == ["150167"]
+    assert retry_shard.device_retries == {"150167": 1}
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=retry_shard)
+
+    # The retry succeeds, so the shard is done and the chain moves on
+    assert result["observations_extracted"] == 24
+    assert not result["retried_devices"]
+    assert not result["failed_devices"]
+    assert ("backfill_observations", "backfill-1.0") in mock_state_manager_in_memory.saved_states
+    next_shard = BackfillObservationsShard.parse_obj(mock_trigger_actions.call_args.args[0][0].config_overrides)
+    # All the devices are pulled in the next shard
+    assert next_shard.shard_index == 2
+    assert [str(device.nDeviceID) for device in next_shard.devices] == ["89222", "150167"]
+    assert not next_shard.rerun_device_ids
+    assert not next_shard.device_retries
+
+
+@pytest.mark.asyncio
+async def test_backfill_shard_gives_up_on_devices_out_of_retries(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.client.get_positions", side_effect=httpx.ConnectTimeout("Onyesha is unreachable"))
+    action_config = BackfillObservationsShard(
+        backfill_id="backfill-1",
+        devices=onyesha_devices[:1],
+        start=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        end=datetime.datetime(2024, 1, 4, tzinfo=datetime.timezone.utc),
+        shard_days=1,
+        shard_index=0,
+        shards_step=2,
+        device_retries={"89222": settings.BACKFILL_DEVICE_MAX_RETRIES},
+    )
+
+    result = await action_backfill_observations_shard(integration=integration_v2, action_config=action_config)
+
+    # The shard is saved as done with the failed device, and the chain moves on
+    assert result["failed_devices"] == ["89222"]
+    assert not result["retried_devices"]
+    shard_state = mock_state_manager_in_memory.saved_states[("backfill_observations", "backfill-1.0")]
+    assert shard_state["failed_devices"] == ["89222"]
+    next_shard = BackfillObservationsShard.parse_obj(mock_trigger_actions.call_args.args[0][0].config_overrides)
+    assert next_shard.shard_index == 2
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_fleet_wide(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    _, mock_trigger_actions, mock_send_observations = mock_handlers_dependencies
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2, minutes=59)
+    set_last_run(mock_state_manager_in_memory, ["89222", "150167"], last_run)
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=True)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # The positions of all the devices are fetched once per window
+    assert all(call.kwargs.get("device_id") is None for call in mock_get_positions.call_args_list)
+    assert result["observations_extracted"] == 6
+    assert {observation["source"] for observation in get_observations_sent(mock_send_observations)} == {89222, 150167}
+    assert not result["failed_devices"]
+    assert not result["skipped_devices"]
+    assert not mock_trigger_actions.called
+    # The state of each device is saved
+    for device_id in ["89222", "150167"]:
+        state = mock_state_manager_in_memory.saved_states[("pull_observations", device_id)]
+        assert datetime.datetime.fromisoformat(state["last_run"]) > last_run
+    # The leases are released
+    assert not mock_state_manager_in_memory.held_leases
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_fleet_wide_skips_devices_leased_elsewhere(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    _, _, mock_send_observations = mock_handlers_dependencies
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2, minutes=59)
+    set_last_run(mock_state_manager_in_memory, ["89222", "150167"], last_run)
+    mock_state_manager_in_memory.held_leases.add(("pull_observations", "150167"))  # Pulled by another run
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=True)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    assert result["skipped_devices"] == ["150167"]
+    assert result["observations_extracted"] == 3
+    # Positions of the skipped device aren't sent, and its state isn't changed
+    assert {observation["source"] for observation in get_observations_sent(mock_send_observations)} == {89222}
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "150167")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) == last_run
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_fleet_wide_error_fails_the_devices_pulled(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    mock_log_action_activity, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.client.get_positions", side_effect=httpx.ConnectTimeout("Onyesha is unreachable"))
+    mock_state_manager_in_memory.held_leases.add(("pull_observations", "150167"))  # Pulled by another run
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=True)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # Only the devices pulled by this run are failed, and the error is logged once
+    assert result["failed_devices"] == ["89222"]
+    assert result["skipped_devices"] == ["150167"]
+    assert mock_log_action_activity.call_count == 1
+    assert mock_log_action_activity.call_args.kwargs["level"] == LogLevel.ERROR
+    assert "Onyesha is unreachable" in mock_log_action_activity.call_args.kwargs["title"]
+    assert not mock_trigger_actions.called
+    assert mock_state_manager_in_memory.held_leases == {("pull_observations", "150167")}
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_fleet_wide_lease_error_fails_only_its_device(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    mock_log_action_activity, _, mock_send_observations = mock_handlers_dependencies
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2, minutes=59)
+    set_last_run(mock_state_manager_in_memory, ["89222", "150167"], last_run)
+    lease = mock_state_manager_in_memory.lease.side_effect
+
+    @asynccontextmanager
+    async def lease_or_fail(integration_id, action_id, source_id="no-source", ttl=None):
+        if source_id == "150167":
+            raise redis.exceptions.ConnectionError("Redis is unreachable")
+        async with lease(integration_id, action_id, source_id, ttl) as acquired:
+            yield acquired
+
+    mock_state_manager_in_memory.lease.side_effect = lease_or_fail
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=True)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # The other device is pulled and its state saved
+    assert result["failed_devices"] == ["150167"]
+    assert result["observations_extracted"] == 3
+    assert {observation["source"] for observation in get_observations_sent(mock_send_observations)} == {89222}
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "89222")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) > last_run
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "150167")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) == last_run
+    assert mock_log_action_activity.call_count == 1
+    assert "Redis is unreachable" in mock_log_action_activity.call_args.kwargs["title"]
+    assert not mock_state_manager_in_memory.held_leases
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_from_device_batch_limits_concurrent_devices(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2, minutes=59)
+    set_last_run(mock_state_manager_in_memory, ["89222", "150167"], last_run)
+    devices_in_flight = set()
+    max_devices_in_flight = 0
+
+    async def get_positions(device_id=None, start=None, end=None):
+        nonlocal max_devices_in_flight
+        devices_in_flight.add(device_id)
+        max_devices_in_flight = max(max_devices_in_flight, len(devices_in_flight))
+        await asyncio.sleep(0.01)
+        devices_in_flight.discard(device_id)
+        return [make_onyesha_position(device_id, start)]
+
+    mocker.patch("app.actions.client.get_positions", side_effect=get_positions)
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, max_concurrency=1, fleet_wide_fetch=False)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    assert max_devices_in_flight == 1
+    assert result["observations_extracted"] == 2
+    assert not result["failed_devices"]
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_from_device_batch_isolates_device_errors(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory
+):
+    mock_log_action_activity, _, mock_send_observations = mock_handlers_dependencies
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2, minutes=59)
+    set_last_run(mock_state_manager_in_memory, ["89222", "150167"], last_run)
+
+    async def get_positions(device_id=None, start=None, end=None):
+        if device_id == "150167":
+            raise httpx.ConnectTimeout("Onyesha is unreachable")
+        return [make_onyesha_position(device_id, start)]
+
+    mocker.patch("app.actions.client.get_positions", side_effect=get_positions)
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=False)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # The other device is pulled and its state saved
+    assert result["failed_devices"] == ["150167"]
+    assert result["observations_extracted"] == 1
+    assert {observation["source"] for observation in get_observations_sent(mock_send_observations)} == {89222}
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "89222")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) > last_run
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "150167")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) == last_run
+    assert mock_log_action_activity.call_count == 1
+    assert "150167" in mock_log_action_activity.call_args.kwargs["title"]
+
+
+@pytest.mark.asyncio
+async def test_pull_pipeline_saves_progress_in_window_order(integration_v2, mock_handlers_dependencies):
+    _, _, mock_send_observations = mock_handlers_dependencies
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    windows = [(start + datetime.timedelta(hours=i), start + datetime.timedelta(hours=i + 1)) for i in range(4)]
+    checkpoints = []
+
+    async def fetch_window(start, end):
+        await asyncio.sleep(0.01 if start == windows[0][0] else 0)  # The first window is the slowest
+        return [make_onyesha_position("89222", start)]
+
+    async def checkpoint(window_end):
+        checkpoints.append(window_end)
+
+    observations_sent, fetched_until, positions_fetched = await _run_pull_pipeline(
+        integration_v2, fetch_window=fetch_window, windows=windows, checkpoint=checkpoint, max_concurrent_windows=3
+    )
+
+    assert observations_sent == 4
+    assert positions_fetched == 4
+    assert fetched_until == windows[-1][1]
+    assert checkpoints == [window_end for _, window_end in windows]
+    observations_sent = get_observations_sent(mock_send_observations)
+    assert [datetime.datetime.fromisoformat(observation["recorded_at"]) for observation in observations_sent] == [
+        window_start for window_start, _ in windows
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pull_pipeline_cancels_all_stages_on_errors(integration_v2, mock_handlers_dependencies):
+    _, _, mock_send_observations = mock_handlers_dependencies
+    mock_send_observations.side_effect = httpx.ConnectTimeout("Gundi is unreachable")
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    windows = [(start + datetime.timedelta(hours=i), start + datetime.timedelta(hours=i + 1)) for i in range(10)]
+    cancelled_fetches = []
+
+    async def fetch_window(start, end):
+        if start > windows[0][0]:
+            try:
+                await asyncio.sleep(60)  # Still fetching when sending fails
+            except asyncio.CancelledError:
+                cancelled_fetches.append(start)
+                raise
+        return [make_onyesha_position("89222", start)]
+
+    tasks_before = asyncio.all_tasks()
+    with pytest.raises(httpx.ConnectTimeout):
+        await asyncio.wait_for(
+            _run_pull_pipeline(integration_v2, fetch_window=fetch_window, windows=windows, max_concurrent_windows=3),
+            timeout=5
+        )
+    await asyncio.sleep(0)  # Let the cancellations run
+
+    # No stage or fetch is left running or blocked on a queue
+    assert cancelled_fetches
+    assert asyncio.all_tasks() == tasks_before
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_checkpoints_and_continues_when_time_budget_is_exhausted(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory,
+        mock_get_positions
+):
+    _, mock_trigger_actions, mock_send_observations = mock_handlers_dependencies
+    mocker.patch.object(settings, "WINDOWS_MAX_CONCURRENCY", 1)
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=3)
+    # About one day of positions per window
+    mock_state_manager_in_memory.saved_states[("pull_observations", "89222")] = {
+        "last_run": last_run.isoformat(), "positions_per_day": settings.WINDOW_TARGET_POSITIONS
+    }
+    # There's time to start pulling the device and its first window only
+    remaining_times = iter([None, None])
+    mocker.patch("app.actions.handlers.get_remaining_time", side_effect=lambda: next(remaining_times, 0))
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices[:1], fleet_wide_fetch=False)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # The first window is sent and checkpointed
+    assert mock_get_positions.call_count == 1
+    assert len(get_observations_sent(mock_send_observations)) == 24
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "89222")]
+    assert datetime.datetime.fromisoformat(state["last_run"]) == last_run + datetime.timedelta(days=1)
+    # The pull continues in a new action, from the checkpoint
+    assert result["continued_devices"] == ["89222"]
+    command = mock_trigger_actions.call_args.args[0][0]
+    assert command.action_id == "pull_observations_from_device_batch"
+    continuation_config = PullObservationsFromDeviceBatch.parse_obj(command.config_overrides)
+    assert [str(device.nDeviceID) for device in continuation_config.devices] == ["89222"]
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_leaves_devices_for_the_continuation_when_out_of_time(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory,
+        mock_get_positions
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.handlers.get_remaining_time", return_value=0)
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices, fleet_wide_fetch=False)
+
+    result = await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    assert not mock_get_positions.called
+    assert result["continued_devices"] == ["89222", "150167"]
+    assert not mock_state_manager_in_memory.saved_states
+    continuation_config = PullObservationsFromDeviceBatch.parse_obj(
+        mock_trigger_actions.call_args.args[0][0].config_overrides
+    )
+    assert [str(device.nDeviceID) for device in continuation_config.devices] == ["89222", "150167"]
+
+
+def test_plan_windows_without_known_density():
+    lower_date = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    upper_date = lower_date + datetime.timedelta(days=settings.WINDOW_MAX_DAYS + 1)
+
+    windows = _plan_windows(lower_date, upper_date)
+
+    # The largest windows are used, and the last one ends at upper_date
+    assert windows == [
+        (lower_date, lower_date + datetime.timedelta(days=settings.WINDOW_MAX_DAYS)),
+        (lower_date + datetime.timedelta(days=settings.WINDOW_MAX_DAYS), upper_date),
+    ]
+
+
+def test_plan_windows_by_position_density():
+    lower_date = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    upper_date = lower_date + datetime.timedelta(days=2)
+
+    windows = _plan_windows(lower_date, upper_date, positions_per_day=settings.WINDOW_TARGET_POSITIONS * 4)
+
+    # Windows are sized to have about WINDOW_TARGET_POSITIONS positions each
+    assert len(windows) == 8
+    assert all(end - start == datetime.timedelta(hours=6) for start, end in windows)
+    assert windows[0][0] == lower_date
+    assert windows[-1][1] == upper_date
+    assert all(windows[i][1] == windows[i + 1][0] for i in range(len(windows) - 1))
+
+
+@pytest.mark.parametrize("positions_per_day,expected_window", [
+    (settings.WINDOW_TARGET_POSITIONS * 24 * 100, datetime.timedelta(hours=settings.WINDOW_MIN_HOURS)),
+    (0.001, datetime.timedelta(days=settings.WINDOW_MAX_DAYS)),
+])
+def test_plan_windows_limits_window_size(positions_per_day, expected_window):
+    lower_date = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    windows = _plan_windows(lower_date, lower_date + expected_window * 3, positions_per_day=positions_per_day)
+
+    assert [end - start for start, end in windows] == [expected_window] * 3
+
+
+def test_plan_windows_for_an_empty_period():
+    lower_date = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    assert _plan_windows(lower_date, lower_date) == []
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_saves_position_density(
+        integration_v2, onyesha_devices, mock_handlers_dependencies, mock_state_manager_in_memory, mock_get_positions
+):
+    last_run = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=2, minutes=-1)
+    set_last_run(mock_state_manager_in_memory, ["89222"], last_run)
+    action_config = PullObservationsFromDeviceBatch(devices=onyesha_devices[:1], fleet_wide_fetch=False)
+
+    await action_pull_observations_from_device_batch(integration=integration_v2, action_config=action_config)
+
+    # The density seen sizes the windows of the next run. The mock Onyesha API returns a position per hour
+    state = mock_state_manager_in_memory.saved_states[("pull_observations", "89222")]
+    assert state["positions_per_day"] == pytest.approx(24, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_pull_observations_passes_filters_to_device_batches(
+        mocker, integration_v2, onyesha_devices, mock_handlers_dependencies
+):
+    _, mock_trigger_actions, _ = mock_handlers_dependencies
+    mocker.patch("app.actions.client.get_devices", AsyncMock(return_value=onyesha_devices))
+    action_config = PullObservationsConfig.parse_obj({"filters": {"max_pdop": None, "drop_duplicates": False}})
+
+    await action_pull_observations(integration=integration_v2, action_config=action_config)
+
+    for command in mock_trigger_actions.call_args.args[0]:
+        batch_config = PullObservationsFromDeviceBatch.parse_obj(command.config_overrides)
+        assert batch_config.filters == PositionFilters(max_pdop=None, drop_duplicates=False)
@@ -0,0 +1,143 @@
+import datetime
+
+import pytest
+
+from app import settings
+from app.actions.configurations import PositionFilters
+from app.actions.transformers import transform_positions
+from app.conftest import make_onyesha_position
+
+
+RECORDED_AT = datetime.datetime(2024, 1, 1, 10, 0)
+
+
+def test_transform_positions():
+    position = make_onyesha_position(89222, RECORDED_AT)
+
+    observations, dropped = transform_positions([position])
+
+    assert observations == [
+        {
+            "source": 89222,
+            "source_name": 89222,
+            "type": "tracking-device",
+            "recorded_at": "2024-01-01T10:00:00.000000+00:00",
+            "location": {"lat": position.Latitude, "lon": position.Longitude},
+            "additional": position.dict(exclude={"DeviceID", "Latitude", "Longitude", "RecDateTime"}),
+        }
+    ]
+    assert not dropped
+
+
+def test_transform_positions_formats_recorded_at_in_utc():
+    positions = [
+        # Naive values are in UTC
+        make_onyesha_position(89222, datetime.datetime(2024, 1, 1, 10, 0, 0, 250)),
+        make_onyesha_position(
+            89222, datetime.datetime(2024, 1, 1, 12, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        ),
+    ]
+
+    observations, _ = transform_positions(positions)
+
+    assert [observation["recorded_at"] for observation in observations] == [
+        "2024-01-01T10:00:00.000250+00:00",
+        "2024-01-01T10:00:00.000000+00:00",
+    ]
+
+
+def test_transform_positions_without_positions():
+    observations, dropped = transform_positions([])
+
+    assert observations == []
+    assert not dropped
+
+
+@pytest.mark.parametrize("position_fields,expected_reason", [
+    ({"Latitude": 0.0, "Longitude": 0.0}, "zero_coordinates"),
+    ({"Latitude": 91.0}, "invalid_coordinates"),
+    ({"Longitude": -180.5}, "invalid_coordinates"),
+    ({"Latitude": float("nan")}, "invalid_coordinates"),
+    ({"Longitude": float("nan")}, "invalid_coordinates"),
+    ({"CRC": 1}, "crc_error"),
+    ({"RxStatus": 2}, "rx_error"),
+    ({"PDOP": settings.POSITIONS_MAX_PDOP + 0.1}, "high_pdop"),
+    ({"FixType": 0}, "no_fix"),
+])
+def test_transform_positions_drops_low_quality_positions(position_fields, expected_reason):
+    good_position = make_onyesha_position(89222, RECORDED_AT)
+    bad_position = make_onyesha_position(89222, RECORDED_AT + datetime.timedelta(minutes=1), **position_fields)
+
+    observations, dropped = transform_positions([good_position, bad_position], PositionFilters())
+
+    assert [observation["recorded_at"] for observation in observations] == ["2024-01-01T10:00:00.000000+00:00"]
+    assert dropped == {expected_reason: 1}
+
+
+def test_transform_positions_drops_duplicates():
+    positions = [
+        make_onyesha_position(89222, RECORDED_AT),
+        make_onyesha_position(89222, RECORDED_AT, Altitude=1000.0),
+        make_onyesha_position(150167, RECORDED_AT),  # Same time, another device
+    ]
+
+    observations, dropped = transform_positions(positions, PositionFilters())
+
+    # The first position of each device and time is kept
+    assert [(observation["source"], observation["additional"]["Altitude"]) for observation in observations] == [
+        (89222, positions[0].Altitude), (150167, positions[2].Altitude)
+    ]
+    assert dropped == {"duplicate": 1}
+
+
+def test_transform_positions_keeps_a_good_duplicate_of_a_bad_position():
+    positions = [
+        make_onyesha_position(89222, RECORDED_AT, CRC=1),
+        make_onyesha_position(89222, RECORDED_AT),
+    ]
+
+    observations, dropped = transform_positions(positions, PositionFilters())
+
+    assert len(observations) == 1
+    assert dropped == {"crc_error": 1}
+
+
+def test_transform_positions_without_max_pdop():
+    position = make_onyesha_position(89222, RECORDED_AT, PDOP=99.0)
+
+    observations, dropped = transform_positions([position], PositionFilters(max_pdop=None))
+
+    assert len(observations) == 1
+    assert not dropped
+
+
+def test_transform_positions_without_dropping_duplicates():
+    positions = [make_onyesha_position(89222, RECORDED_AT), make_onyesha_position(89222, RECORDED_AT)]
+
+    observations, dropped = transform_positions(positions, PositionFilters(drop_duplicates=False))
+
+    assert len(observations) == 2
+    assert not dropped
+
+
+def test_transform_positions_with_every_position_dropped():
+    positions = [
+        make_onyesha_position(89222, RECORDED_AT, Latitude=0.0, Longitude=0.0),
+        make_onyesha_position(89222, RECORDED_AT + datetime.timedelta(minutes=1), CRC=1),
+        make_onyesha_position(89222, RECORDED_AT + datetime.timedelta(minutes=2), FixType=0),
+    ]
+
+    observations, dropped = transform_positions(positions, PositionFilters())
+
+    assert observations == []
+    assert dropped == {"zero_coordinates": 1, "crc_error": 1, "no_fix": 1}
+
+
+def test_transform_positions_counts_each_position_once():
+    # A position failing several checks is counted under the first one
+    position = make_onyesha_position(89222, RECORDED_AT, CRC=1, RxStatus=1, FixType=0)
+
+    observations, dropped = transform_positions([position], PositionFilters())
+
+    assert observations == []
+    assert dropped == {"crc_error": 1}
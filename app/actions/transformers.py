@@ -0,0 +1,138 @@
+from collections import Counter
+from datetime import timezone
+from itertools import compress
+
+import numpy as np
+
+from app.actions.client import OnyeshaPosition
+
+
+# Fields mapped to the observation itself. The rest go in "additional"
+OBSERVATION_FIELDS = ("DeviceID", "Latitude", "Longitude", "RecDateTime")
+ADDITIONAL_FIELDS = [field for field in OnyeshaPosition.__fields__ if field not in OBSERVATION_FIELDS]
+# Other fields checked by the quality filters
+QUALITY_FIELDS = ("CRC", "RxStatus", "PDOP", "FixType")
+
+
+def positions_to_records(positions: list) -> list:
+    """Returns the field values of each position as a dict, without copying them (pydantic keeps them in __dict__)."""
+    return [position.__dict__ for position in positions]
+
+
+def records_to_columns(records: list, fields) -> dict:
+    """
+    Converts records into columns, one list of values per field.
+    RecDateTime is converted to a numpy array of UTC timestamps (naive values are assumed to be in UTC).
+    """
+    columns = {field: [record[field] for record in records] for field in fields}
+    if "RecDateTime" in columns:
+        columns["RecDateTime"] = _to_utc_timestamps(columns["RecDateTime"])
+    return columns
+
+
+def _to_utc_timestamps(values: list) -> np.ndarray:
+    if any(value.tzinfo is not None for value in values):
+        values = [
+            value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo is not None else value
+            for value in values
+        ]
+    return np.array(values, dtype="datetime64[us]")
+
+
+def _get_additional(record: dict) -> dict:
+    additional = record.copy()
+    for field in OBSERVATION_FIELDS:
+        del additional[field]
+    return additional
+
+
+def _get_duplicates(device_ids: np.ndarray, timestamps: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Flags the repeated (DeviceID, RecDateTime) pairs among the candidates. The first occurrence isn't flagged."""
+    indices = np.flatnonzero(candidates)
+    # lexsort is stable, so the first occurrence of each pair comes first
+    order = indices[np.lexsort((timestamps[indices], device_ids[indices]))]
+    repeated = (device_ids[order[1:]] == device_ids[order[:-1]]) & (timestamps[order[1:]] == timestamps[order[:-1]])
+    duplicates = np.zeros(len(candidates), dtype=bool)
+    duplicates[order[1:][repeated]] = True
+    return duplicates
+
+
+def get_quality_mask(columns: dict, filters) -> tuple:
+    """
+    Applies the quality filters (see PositionFilters) to all the positions at once.
+    Returns a boolean mask of the positions to keep, and the number of positions dropped per reason.
+    A position failing several checks is counted once, under the first reason.
+    """
+    latitudes = np.asarray(columns["Latitude"], dtype=float)
+    longitudes = np.asarray(columns["Longitude"], dtype=float)
+    checks = []
+    if filters.drop_zero_coordinates:
+        checks.append(("zero_coordinates", (latitudes == 0) & (longitudes == 0)))
+    # Comparisons are negated so that NaN values are dropped too
+    checks.append(("invalid_coordinates", ~((np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180))))
+    if filters.drop_crc_errors:
+        checks.append(("crc_error", np.asarray(columns["CRC"]) != 0))
+    if filters.drop_rx_errors:
+        checks.append(("rx_error", np.asarray(columns["RxStatus"]) != 0))
+    if filters.max_pdop is not None:
+        checks.append(("high_pdop", ~(np.asarray(columns["PDOP"], dtype=float) <= filters.max_pdop)))
+    if filters.drop_no_fix:
+        checks.append(("no_fix", np.asarray(columns["FixType"]) == 0))
+
+    keep = np.ones(len(latitudes), dtype=bool)
+    dropped = Counter()
+    for reason, failed in checks:
+        failed &= keep
+        if count := int(failed.sum()):
+            dropped[reason] = count
+            keep &= ~failed
+    if filters.drop_duplicates:  # Checked last, so a bad position doesn't hide a good one with the same time
+        duplicates = _get_duplicates(
+            np.asarray(columns["DeviceID"]), columns["RecDateTime"].view("int64"), candidates=keep
+        )
+        if count := int(duplicates.sum()):
+            dropped["duplicate"] = count
+            keep &= ~duplicates
+    return keep, dropped
+
+
+def transform_positions(positions: list, filters=None) -> tuple:
+    """
+    Transforms a batch of positions into observations, working on columns instead of record by record.
+    Positions that don't pass the quality `filters` (a PositionFilters) are dropped.
+    recorded_at is always in UTC and with microseconds (e.g. "2024-01-01T10:00:00.000000+00:00"),
+    whatever the timezone of RecDateTime. Naive values are assumed to be in UTC.
+    Returns the observations, and the number of positions dropped per reason.
+    """
+    if not positions:
+        return [], Counter()
+    records = positions_to_records(positions)
+    columns = records_to_columns(records, OBSERVATION_FIELDS + QUALITY_FIELDS if filters else OBSERVATION_FIELDS)
+    dropped = Counter()
+    if filters:
+        keep, dropped = get_quality_mask(columns, filters)
+        if dropped:
+            records = list(compress(records, keep))
+            columns = {
+                field: values[keep] if isinstance(values, np.ndarray) else list(compress(values, keep))
+                for field, values in columns.items()
+            }
+    # Format all the timestamps at once
+    recorded_at = np.char.add(np.datetime_as_string(columns["RecDateTime"], unit="us"), "+00:00").tolist()
+    observations = [
+        {
+            "source": device_id,
+            "source_name": device_id,
+            "type": "tracking-device",
+            "recorded_at": recorded_at_value,
+            "location": {
+                "lat": latitude,
+                "lon": longitude
+            },
+            "additional": _get_additional(record)
+        }
+        for device_id, recorded_at_value, latitude, longitude, record in zip(
+            columns["DeviceID"], recorded_at, columns["Latitude"], columns["Longitude"], records
+        )
+    ]
+    return observations, dropped
@@ -1,6 +1,7 @@
 import asyncio
 import datetime
 import json
+from contextlib import asynccontextmanager
 
 import httpx
 import pydantic
@@ -55,6 +56,53 @@ def async_return(result):
     return f
 
 
+def make_onyesha_position(device_id, recorded_at: datetime.datetime, **kwargs):
+    """Builds a good quality Onyesha position. Any field can be overridden with kwargs."""
+    from app.actions.client import OnyeshaPosition
+    fields = {
+        "ChannelStatus": "OK",
+        "UploadTimeStamp": recorded_at + datetime.timedelta(minutes=5),
+        "Latitude": -2.3828796,
+        "Longitude": 35.3380609,
+        "Altitude": 1520.0,
+        "ECEFx": 5058912,
+        "ECEFy": 3551392,
+        "ECEFz": -262786,
+        "RxStatus": 0,
+        "PDOP": 1.8,
+        "MainV": 3.6,
+        "BkUpV": 3.1,
+        "Temperature": 24.5,
+        "FixDuration": 32,
+        "bHasTempVoltage": True,
+        "DevName": f"Collar {device_id}",
+        "DeltaTime": 0,
+        "FixType": 3,
+        "CEPRadius": 5,
+        "CRC": 0,
+        "DeviceID": device_id,
+        "RecDateTime": recorded_at,
+    }
+    return OnyeshaPosition(**{**fields, **kwargs})
+
+
+@pytest.fixture(autouse=True)
+def clear_local_caches():
+    from app.services.gundi import _sensors_api_clients
+    from app.services.config_manager import _local_cache, _known_action_ids, _reloads_in_progress
+    from app.services.utils import _dynamic_models, _struct_hex_decoders, _struct_hex_decoders_by_id
+    from app.webhooks.core import _jq_programs
+    _sensors_api_clients.clear()
+    _local_cache.clear()
+    _known_action_ids.clear()
+    _reloads_in_progress.clear()
+    _dynamic_models.clear()
+    _struct_hex_decoders.clear()
+    _struct_hex_decoders_by_id.clear()
+    _jq_programs.clear()
+    yield
+
+
 @pytest.fixture
 def mock_integration_state():
     return {"last_execution": "2024-01-29T11:20:00+0200"}
@@ -68,6 +116,7 @@ def mock_redis(mocker, mock_integration_state):
     redis_client.get.return_value = async_return(
         json.dumps(mock_integration_state, default=str)
     )
+    redis_client.mget.side_effect = lambda keys: async_return([json.dumps(mock_integration_state, default=str)] * len(keys))
     redis_client.delete.return_value = async_return(MagicMock())
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
@@ -77,6 +126,8 @@ def mock_redis(mocker, mock_integration_state):
     redis_client.__aenter__.return_value = redis_client
     redis_client.__aexit__.return_value = None
     redis_client.pipeline.return_value = redis_client
+    redis_client.lock.return_value.acquire.return_value = async_return(True)
+    redis_client.lock.return_value.release.return_value = async_return(None)
     redis.Redis.return_value = redis_client
     return redis
 
@@ -87,6 +138,7 @@ def mock_redis_empty(mocker, mock_integration_state):
     redis_client = mocker.MagicMock()
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(None)
+    redis_client.mget.side_effect = lambda keys: async_return([None] * len(keys))
     redis_client.delete.return_value = async_return(MagicMock())
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
@@ -96,6 +148,8 @@ def mock_redis_empty(mocker, mock_integration_state):
     redis_client.__aenter__.return_value = redis_client
     redis_client.__aexit__.return_value = None
     redis_client.pipeline.return_value = redis_client
+    redis_client.lock.return_value.acquire.return_value = async_return(True)
+    redis_client.lock.return_value.release.return_value = async_return(None)
     redis.Redis.return_value = redis_client
     return redis
 
@@ -106,6 +160,7 @@ def mock_redis_with_integration_config(mocker, integration_v2_as_json):
     redis_client = mocker.MagicMock()
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(integration_v2_as_json)
+    redis_client.mget.side_effect = lambda keys: async_return([integration_v2_as_json] * len(keys))
     redis_client.delete.return_value = async_return(MagicMock())
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
@@ -115,6 +170,8 @@ def mock_redis_with_integration_config(mocker, integration_v2_as_json):
     redis_client.__aenter__.return_value = redis_client
     redis_client.__aexit__.return_value = None
     redis_client.pipeline.return_value = redis_client
+    redis_client.lock.return_value.acquire.return_value = async_return(True)
+    redis_client.lock.return_value.release.return_value = async_return(None)
     redis.Redis.return_value = redis_client
     return redis
 
@@ -125,6 +182,7 @@ def mock_redis_with_action_config(mocker, pull_observations_config_as_json):
     redis_client = mocker.MagicMock()
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(pull_observations_config_as_json)
+    redis_client.mget.side_effect = lambda keys: async_return([pull_observations_config_as_json] * len(keys))
     redis_client.delete.return_value = async_return(MagicMock())
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
@@ -134,6 +192,8 @@ def mock_redis_with_action_config(mocker, pull_observations_config_as_json):
     redis_client.__aenter__.return_value = redis_client
     redis_client.__aexit__.return_value = None
     redis_client.pipeline.return_value = redis_client
+    redis_client.lock.return_value.acquire.return_value = async_return(True)
+    redis_client.lock.return_value.release.return_value = async_return(None)
     redis.Redis.return_value = redis_client
     return redis
 
@@ -751,35 +811,17 @@ def mock_gundi_client_v2(mocker, integration_v2, mock_get_gundi_api_key):
 
 
 @pytest.fixture
-def mock_gundi_client_v2_for_webhooks(
-    mocker, integration_v2_with_webhook, mock_get_gundi_api_key
-):
-    mock_client = mocker.MagicMock()
-    mock_client.get_integration_api_key.return_value = (
-        async_return(mock_get_gundi_api_key),
-    )
-    mock_client.get_integration_details.return_value = async_return(
-        integration_v2_with_webhook
-    )
-    mock_client.register_integration_type = AsyncMock()
-    mock_client.__aenter__.return_value = mock_client
-    return mock_client
+def mock_config_manager_for_webhooks(mocker, integration_v2_with_webhook):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook)
+    return mock_config_manager
 
 
 @pytest.fixture
-def mock_gundi_client_v2_for_webhooks_generic(
-    mocker, integration_v2_with_webhook_generic, mock_get_gundi_api_key
-):
-    mock_client = mocker.MagicMock()
-    mock_client.get_integration_api_key.return_value = (
-        async_return(mock_get_gundi_api_key),
-    )
-    mock_client.get_integration_details.return_value = async_return(
-        integration_v2_with_webhook_generic
-    )
-    mock_client.register_integration_type = AsyncMock()
-    mock_client.__aenter__.return_value = mock_client
-    return mock_client
+def mock_config_manager_for_webhooks_generic(mocker, integration_v2_with_webhook_generic):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook_generic)
+    return mock_config_manager
 
 
 @pytest.fixture
@@ -881,6 +923,7 @@ def mock_config_manager(mocker, integration_v2):
     mock_config_manager.set_action_configuration.return_value = async_return(None)
     mock_config_manager.delete_integration.return_value = async_return(None)
     mock_config_manager.delete_action_configuration.return_value = async_return(None)
+    mock_config_manager.delete_webhook_configuration.return_value = async_return(None)
     return mock_config_manager
 
 
@@ -2079,3 +2122,59 @@ def mock_webhook_request_payload_for_fixed_schema():
         "lat": -2.3828796,
         "lon": 35.3380609,
     }
+
+
+@pytest.fixture
+def onyesha_devices():
+    from app.actions.client import OnyeshaDevice
+    return [
+        OnyeshaDevice(
+            nDeviceID="89222", strSpecialID="300434066112120",
+            dtCreated=datetime.datetime(2023, 1, 3, 16, 5, 56), strSatellite="Iridium"
+        ),
+        OnyeshaDevice(
+            nDeviceID="150167", strSpecialID="300434063388110",
+            dtCreated=datetime.datetime(2022, 2, 23, 11, 49, 37), strSatellite="Iridium"
+        ),
+    ]
+
+
+@pytest.fixture
+def mock_state_manager_in_memory(mocker):
+    """A state manager keeping states and leases in memory. States are saved as JSON, like in redis."""
+    mock_state_manager = mocker.MagicMock()
+    mock_state_manager.saved_states = {}  # (action_id, source_id) -> state
+    mock_state_manager.state_ttls = {}  # (action_id, source_id) -> ttl
+    mock_state_manager.held_leases = set()  # (action_id, source_id)
+
+    async def get_state(integration_id, action_id, source_id="no-source"):
+        return mock_state_manager.saved_states.get((action_id, source_id), {})
+
+    async def set_state(integration_id, action_id, state, source_id="no-source", ttl=None):
+        mock_state_manager.saved_states[(action_id, source_id)] = json.loads(json.dumps(state, default=str))
+        mock_state_manager.state_ttls[(action_id, source_id)] = ttl
+
+    async def get_states(integration_id, action_id, source_ids):
+        return {source_id: await get_state(integration_id, action_id, source_id) for source_id in source_ids}
+
+    async def set_states(integration_id, action_id, states, ttl=None):
+        for source_id, state in states.items():
+            await set_state(integration_id, action_id, state, source_id, ttl)
+
+    @asynccontextmanager
+    async def lease(integration_id, action_id, source_id="no-source", ttl=None):
+        if (action_id, source_id) in mock_state_manager.held_leases:
+            yield False
+            return
+        mock_state_manager.held_leases.add((action_id, source_id))
+        try:
+            yield True
+        finally:
+            mock_state_manager.held_leases.discard((action_id, source_id))
+
+    mock_state_manager.get_state.side_effect = get_state
+    mock_state_manager.set_state.side_effect = set_state
+    mock_state_manager.get_states.side_effect = get_states
+    mock_state_manager.set_states.side_effect = set_states
+    mock_state_manager.lease.side_effect = lease
+    return mock_state_manager
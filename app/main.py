@@ -12,7 +12,14 @@ import app.settings as settings
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.services.action_runner import execute_action, _portal
+from app.services.gundi import close_sensors_api_clients
+from app.services.activity_logger import event_publisher
+from app.services.redis_connections import close_connection_pools
+from app.services.executor import background_executor, run_in_background
+from app.services.errors import BackgroundQueueFull
+from app.services.deduplication import message_deduplicator, MESSAGE_IN_PROGRESS
 from app.services.self_registration import register_integration_in_gundi
+from app.services.utils import get_dynamic_models_stats
 
 
 # For running behind a proxy, we'll want to configure the root path for OpenAPI browser.
@@ -22,12 +29,18 @@ root_path = os.environ.get("ROOT_PATH", "")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup Hook
+    await event_publisher.start()
+    await background_executor.start()
     if settings.REGISTER_ON_START:
         await register_integration_in_gundi(gundi_client=_portal)
         # ToDo: set env var to false in GCP after registration
     yield
     # Shotdown Hook
+    await background_executor.stop()  # Finish pending actions
     await _portal.close()
+    await close_sensors_api_clients()
+    await event_publisher.stop()  # Flush pending events
+    await close_connection_pools()
 
 
 app = FastAPI(
@@ -61,7 +74,37 @@ logger = logging.getLogger(__name__)
 def read_root(
     request: Request,
 ):
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "background_executor": background_executor.stats,
+        "dynamic_models": get_dynamic_models_stats(),
+    }
+
+
+def _get_redelivery_response(message_id: str, earlier_delivery: str):
+    if earlier_delivery == MESSAGE_IN_PROGRESS:
+        logger.info(f"Message {message_id} is still being processed. Asking for a redelivery later.")
+        # PubSub push backs off and redelivers the message, which is processed then if the original delivery failed
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"detail": f"Message {message_id} is still being processed"},
+        )
+    logger.info(f"Message {message_id} was delivered before. Skipping.")
+    return {}
+
+
+async def _execute_action_from_message(message_id: str, **kwargs):
+    """Runs the action of a PubSub message, and records whether it was processed successfully."""
+    try:
+        result = await execute_action(**kwargs)
+    except Exception:  # The message will be redelivered
+        await message_deduplicator.forget(message_id)
+        raise
+    if isinstance(result, JSONResponse) and result.status_code >= 400:
+        await message_deduplicator.forget(message_id)
+    else:
+        await message_deduplicator.mark_done(message_id)
+    return result
 
 
 @app.post(
@@ -77,15 +120,27 @@ async def execute(
     payload = base64.b64decode(json_data["message"]["data"]).decode("utf-8").strip()
     json_payload = json.loads(payload)
     logger.debug(f"JSON Payload: {json_payload}")
+    message_id = json_data["message"].get("messageId")
+    earlier_delivery = await message_deduplicator.claim(message_id)
+    if earlier_delivery:
+        return _get_redelivery_response(message_id, earlier_delivery)
     if settings.PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND:
-        background_tasks.add_task(
-            execute_action,
-            integration_id=json_payload.get("integration_id"),
-            action_id=json_payload.get("action_id"),
-            config_overrides=json_payload.get("config_overrides"),
-        )
+        try:
+            run_in_background(
+                background_tasks,
+                _execute_action_from_message,
+                message_id,
+                key=json_payload.get("integration_id"),
+                integration_id=json_payload.get("integration_id"),
+                action_id=json_payload.get("action_id"),
+                config_overrides=json_payload.get("config_overrides"),
+            )
+        except Exception:  # The message will be redelivered
+            await message_deduplicator.forget(message_id)
+            raise
     else:
-        await execute_action(
+        await _execute_action_from_message(
+            message_id,
             integration_id=json_payload.get("integration_id"),
             action_id=json_payload.get("action_id"),
             config_overrides=json_payload.get("config_overrides"),
@@ -113,7 +168,12 @@ async def push_data(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Missing required attribute: 'destination_id'"
         )
-    return await execute_action(
+    message_id = json_body["message"].get("messageId")
+    earlier_delivery = await message_deduplicator.claim(message_id)
+    if earlier_delivery:
+        return _get_redelivery_response(message_id, earlier_delivery)
+    return await _execute_action_from_message(
+        message_id,
         integration_id=destination_id,
         data=json_payload,
         metadata=attributes
@@ -130,6 +190,16 @@ app.include_router(
 )
 
 
+@app.exception_handler(BackgroundQueueFull)
+async def background_queue_full_exception_handler(request: Request, exc: BackgroundQueueFull):
+    logger.warning(f"Rejecting request to {request.url.path}: {exc}")
+    # PubSub push backs off and redelivers the message later
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+    )
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
 
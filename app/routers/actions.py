@@ -4,6 +4,7 @@ import app.settings
 from fastapi import APIRouter, BackgroundTasks
 from app.actions import get_actions
 from app.services.action_runner import execute_action
+from app.services.executor import run_in_background
 from app.api_schemas import ActionRequest
 
 logger = logging.getLogger(__name__)
@@ -28,8 +29,10 @@ async def execute(
     background_tasks: BackgroundTasks
 ):
     if request.run_in_background:
-        background_tasks.add_task(
+        run_in_background(
+            background_tasks,
             execute_action,
+            key=request.integration_id,
             integration_id=request.integration_id,
             action_id=request.action_id,
             config_overrides=request.config_overrides
@@ -17,7 +17,7 @@ from fastapi.responses import JSONResponse
 from gundi_core.events import IntegrationActionFailed, ActionExecutionFailed
 
 from .config_manager import IntegrationConfigurationManager
-from .utils import find_config_for_action
+from .utils import find_config_for_action, set_action_deadline, reset_action_deadline
 from .activity_logger import publish_event
 
 _portal = GundiClient()
@@ -122,7 +122,7 @@ async def execute_action(
         )
 
     try:  # Parse the action configuration
-        config_data = action_config.data if action_config else {}
+        config_data = dict(action_config.data) if action_config else {}  # Copy, as configs may be cached
         if config_overrides:
             config_data.update(config_overrides)
         parsed_config = config_model.parse_obj(config_data)
@@ -146,10 +146,15 @@ async def execute_action(
             handler_kwargs["data"] = parsed_data
         if metadata:
             handler_kwargs["metadata"] = metadata
-        result = await asyncio.wait_for(
-            handler(**handler_kwargs),
-            timeout=settings.MAX_ACTION_EXECUTION_TIME
-        )
+        # Handlers can check the remaining time with get_remaining_time() to save progress before timing out
+        deadline_token = set_action_deadline(settings.MAX_ACTION_EXECUTION_TIME)
+        try:
+            result = await asyncio.wait_for(
+                handler(**handler_kwargs),
+                timeout=settings.MAX_ACTION_EXECUTION_TIME
+            )
+        finally:
+            reset_action_deadline(deadline_token)
     except asyncio.TimeoutError:
         return await _handle_error(
             asyncio.TimeoutError(f"Action '{action_id}' timed out"),
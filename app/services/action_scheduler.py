@@ -5,7 +5,7 @@ from pydantic.class_validators import validator
 from typing import Any, Dict, Optional, Union, List, Annotated
 from gundi_core.commands import RunIntegrationAction
 from app import settings
-from .activity_logger import publish_event
+from .activity_logger import publish_event, publish_events
 
 
 async def trigger_action(integration_id: str, action_id: str, config=None):
@@ -36,6 +36,31 @@ async def trigger_action(integration_id: str, action_id: str, config=None):
         return await publish_event(run_action_command, settings.INTEGRATION_COMMANDS_TOPIC)
 
 
+async def trigger_actions(commands: List[RunIntegrationAction]):
+    """
+    Publishes many commands in the actions topic at once, to trigger actions in bulk.
+    Commands are grouped in as few PubSub requests as message size limits allow.
+    Use this function instead of calling trigger_action() in a loop to fan out sub-actions.
+    :param commands: list of RunIntegrationAction commands
+    :return: list of responses
+    """
+    if settings.TRIGGER_ACTIONS_ALWAYS_SYNC:  # For testing or local development
+        from .action_runner import execute_action
+        return [
+            await execute_action(
+                integration_id=str(command.integration_id),
+                action_id=command.action_id,
+                config_overrides=command.config_overrides
+            )
+            for command in commands
+        ]
+    else:
+        if not settings.INTEGRATION_COMMANDS_TOPIC:
+            error_msg = "Please set INTEGRATION_COMMANDS_TOPIC in the environment to trigger actions from the integration."
+            raise ValueError(error_msg)
+        return await publish_events(commands, settings.INTEGRATION_COMMANDS_TOPIC)
+
+
 class CrontabSchedule(BaseModel):
     minute: str = Field(
         "*",
@@ -1,9 +1,12 @@
 import asyncio
 import json
 import logging
+import math
+from typing import List
 
 import aiohttp
 import stamina
+from contextlib import AsyncExitStack
 from functools import wraps
 from gcloud.aio import pubsub
 from gundi_core.events import (
@@ -31,7 +34,95 @@ from app import settings
 logger = logging.getLogger(__name__)
 
 
-# Publish events for other services or system components
+class EventPublisher:
+    """
+    Long-lived PubSub publisher sharing one HTTP session across events.
+    Messages are buffered per topic and published in a single request once
+    `max_batch_size` messages or `max_batch_bytes` are buffered, or after `max_latency` seconds.
+    """
+
+    def __init__(self, max_batch_size: int = None, max_batch_bytes: int = None, max_latency: float = None):
+        self.max_batch_size = max_batch_size or settings.PUBSUB_PUBLISH_MAX_BATCH_SIZE
+        self.max_batch_bytes = max_batch_bytes or settings.PUBSUB_PUBLISH_MAX_BATCH_BYTES
+        self.max_latency = max_latency if max_latency is not None else settings.PUBSUB_PUBLISH_MAX_LATENCY
+        self._session = None
+        self._client = None
+        self._buffers = {}  # topic_name -> [(message, size, future)]
+        self._flush_tasks = {}  # topic_name -> asyncio.Task
+        self._running_tasks = set()
+
+    @property
+    def is_running(self) -> bool:
+        return self._client is not None
+
+    @property
+    def client(self) -> pubsub.PublisherClient:
+        return self._client
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(
+            raise_for_status=True, timeout=aiohttp.ClientTimeout(total=20.0)
+        )
+        self._client = pubsub.PublisherClient(session=self._session)
+
+    async def stop(self):
+        await self.flush()
+        await asyncio.gather(*self._running_tasks, return_exceptions=True)
+        if self._session:
+            await self._session.close()
+        self._session = None
+        self._client = None
+
+    async def publish(self, message: pubsub.PubsubMessage, topic_name: str) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        buffer = self._buffers.setdefault(topic_name, [])
+        buffer.append((message, len(message.data), future))
+        if len(buffer) >= self.max_batch_size or sum(size for _, size, _ in buffer) >= self.max_batch_bytes:
+            self._schedule_flush(topic_name, delay=0)
+        elif topic_name not in self._flush_tasks:
+            self._schedule_flush(topic_name, delay=self.max_latency)
+        return await future
+
+    def _schedule_flush(self, topic_name: str, delay: float):
+        if flush_task := self._flush_tasks.pop(topic_name, None):
+            flush_task.cancel()
+        flush_task = asyncio.create_task(self._flush_later(topic_name, delay))
+        self._flush_tasks[topic_name] = flush_task
+        self._running_tasks.add(flush_task)
+        flush_task.add_done_callback(self._running_tasks.discard)
+
+    async def _flush_later(self, topic_name: str, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush(topic_name)
+
+    async def flush(self, topic_name: str = None):
+        """Publishes buffered messages for the given topic, or for all topics if no topic is given."""
+        topics = [topic_name] if topic_name else list(self._buffers.keys())
+        for topic in topics:
+            flush_task = self._flush_tasks.pop(topic, None)
+            if flush_task and flush_task is not asyncio.current_task():
+                flush_task.cancel()
+            pending = self._buffers.pop(topic, [])
+            if not pending:
+                continue
+            try:
+                response = await _publish_messages(
+                    messages=[message for message, _, _ in pending], topic_name=topic, client=self._client
+                )
+            except Exception as e:
+                for _, _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                message_ids = (response or {}).get("messageIds", [])
+                for i, (_, _, future) in enumerate(pending):
+                    if not future.done():  # Each caller gets the id of its own message
+                        future.set_result({"messageIds": message_ids[i:i + 1]} if len(message_ids) == len(pending) else response)
+
+
+event_publisher = EventPublisher()
+
+
 @stamina.retry(
     on=(aiohttp.ClientError, asyncio.TimeoutError),
     attempts=5,
@@ -39,31 +130,79 @@ logger = logging.getLogger(__name__)
     wait_max=60,
     wait_jitter=5.0
 )
-async def publish_event(event: SystemEventBaseModel, topic_name: str):
-    timeout_settings = aiohttp.ClientTimeout(total=20.0)
-    async with aiohttp.ClientSession(
-        raise_for_status=True, timeout=timeout_settings
-    ) as session:
-        client = pubsub.PublisherClient(session=session)
+async def _publish_messages(messages: list, topic_name: str, client: pubsub.PublisherClient = None):
+    async with AsyncExitStack() as stack:
+        if client is None:  # Use a short-lived session when the long-lived publisher isn't running
+            timeout_settings = aiohttp.ClientTimeout(total=20.0)
+            session = await stack.enter_async_context(
+                aiohttp.ClientSession(raise_for_status=True, timeout=timeout_settings)
+            )
+            client = pubsub.PublisherClient(session=session)
         # Get the topic
         topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
-        # Prepare the payload
-        binary_payload = json.dumps(event.dict(), default=str).encode("utf-8")
-        messages = [pubsub.PubsubMessage(binary_payload)]
-        logger.debug(f"Sending event {event} to PubSub topic {topic_name}..")
         try:  # Send to pubsub
             response = await client.publish(topic, messages)
         except Exception as e:
             logger.exception(
-                f"Error publishing system event to topic {topic_name}: {e}. This will be retried."
+                f"Error publishing {len(messages)} message(s) to topic {topic_name}: {e}. This will be retried."
             )
             raise e
         else:
-            logger.debug(f"System event {event} published successfully.")
+            logger.debug(f"{len(messages)} message(s) published successfully to topic {topic_name}.")
             logger.debug(f"GCP PubSub response: {response}")
             return response
 
 
+# Publish events for other services or system components
+async def publish_event(event: SystemEventBaseModel, topic_name: str):
+    # Prepare the payload
+    binary_payload = json.dumps(event.dict(), default=str).encode("utf-8")
+    message = pubsub.PubsubMessage(binary_payload)
+    logger.debug(f"Sending event {event} to PubSub topic {topic_name}..")
+    if event_publisher.is_running:  # Buffered and published in batches
+        return await event_publisher.publish(message=message, topic_name=topic_name)
+    return await _publish_messages(messages=[message], topic_name=topic_name)
+
+
+def _split_in_publish_requests(messages: list) -> list:
+    """Groups messages in as few requests as PubSub limits allow (number of messages and request size)"""
+    requests, current_request, current_size = [], [], 0
+    for message in messages:
+        # Message data is sent base64-encoded, plus some overhead per message in the request body
+        message_size = 4 * math.ceil(len(message.data) / 3) + 100
+        if current_request and (
+            len(current_request) >= settings.PUBSUB_MAX_MESSAGES_PER_REQUEST
+            or current_size + message_size > settings.PUBSUB_MAX_REQUEST_BYTES
+        ):
+            requests.append(current_request)
+            current_request, current_size = [], 0
+        current_request.append(message)
+        current_size += message_size
+    if current_request:
+        requests.append(current_request)
+    return requests
+
+
+async def publish_events(events: List[SystemEventBaseModel], topic_name: str) -> list:
+    """
+    Publishes many events at once, in as few PubSub requests as possible.
+    :param events: list of events or commands to publish
+    :param topic_name: name of the PubSub topic
+    :return: list with the PubSub response of each request
+    """
+    messages = [
+        pubsub.PubsubMessage(json.dumps(event.dict(), default=str).encode("utf-8"))
+        for event in events
+    ]
+    logger.debug(f"Sending {len(messages)} events to PubSub topic {topic_name}..")
+    return await asyncio.gather(
+        *[
+            _publish_messages(messages=request, topic_name=topic_name, client=event_publisher.client)
+            for request in _split_in_publish_requests(messages)
+        ]
+    )
+
+
 async def log_activity(integration_id: str, action_id: str, title: str, level="INFO", config_data: dict = None, data: dict = None):
     # Show a deprecation warning in favor of using either log_action_activity or log_webhook_activity
     logger.warning("log_activity is deprecated. Please use log_action_activity or log_webhook_activity instead.")
@@ -24,7 +24,12 @@ async def handle_integration_created_event(event: IntegrationCreated):
 
 async def handle_integration_updated_event(event: IntegrationUpdated):
     event_data = event.payload
+    # Apply changes on top of the shared config (Redis) rather than on a local copy which may be outdated
+    config_manager.invalidate_local_cache(integration_id=str(event_data.id))
+    # Webhook configurations have no events of their own. Reload it from Gundi when it's needed again
+    await config_manager.delete_webhook_configuration(integration_id=str(event_data.id))
     integration = await config_manager.get_integration(integration_id=event_data.id)
+    integration = integration.copy()  # Cached objects must not be modified in place
     for key, value in event_data.changes.items():
         if hasattr(integration, key):
             setattr(integration, key, value)
@@ -37,6 +42,7 @@ async def handle_integration_deleted_event(event: IntegrationDeleted):
 
 async def handle_action_config_created_event(event: ActionConfigCreated):
     action_config = event.payload
+    # Overwrites any negative cache entry saved while the action had no configuration
     await config_manager.set_action_configuration(
         integration_id=action_config.integration,
         action_id=action_config.action.value,
@@ -48,10 +54,12 @@ async def handle_action_config_updated_event(event: ActionConfigUpdated):
     event_data = event.payload
     integration_id = event_data.integration_id
     action_id = event_data.alt_id
+    config_manager.invalidate_local_cache(integration_id=str(integration_id), action_id=action_id)
     action_config = await config_manager.get_action_configuration(
         integration_id=integration_id,
         action_id=action_id
     )
+    action_config = action_config.copy()  # Cached objects must not be modified in place
     for key, value in event_data.changes.items():
         setattr(action_config, key, value)
     await config_manager.set_action_configuration(
@@ -1,20 +1,54 @@
+import asyncio
 import json
+import logging
+from typing import Optional
 import stamina
 import httpx
 import redis.asyncio as redis
+import redis.exceptions as redis_exceptions
 from gundi_core.schemas.v2 import Integration, IntegrationSummary, IntegrationActionConfiguration
+from gundi_core.schemas.v2.gundi import WebhookConfiguration
 from gundi_client_v2 import GundiClient
 from app import settings
+from app.services.utils import TTLCache
+from app.services.redis_connections import get_connection_pool
+
+
+logger = logging.getLogger(__name__)
+
+# In-process cache of parsed configurations, shared by all the managers in the process.
+# Objects in this cache are shared, so they must not be modified in place.
+_local_cache = TTLCache(maxsize=settings.CONFIGS_LOCAL_CACHE_SIZE, ttl=settings.CONFIGS_LOCAL_CACHE_TTL)
+# Actions seen in integration types, used to prefetch action configurations along with the integration
+_known_action_ids = set()
+# Reloads from Gundi in progress in this process, by integration id
+_reloads_in_progress = {}
+# Stored instead of a configuration to remember that an action has none (negative caching)
+MISSING_CONFIG_MARKER = b"__missing__"
+_MISSING_CONFIG = object()  # Local cache counterpart of the marker
+
+
+def _is_missing_config_marker(data) -> bool:
+    return data in (MISSING_CONFIG_MARKER, MISSING_CONFIG_MARKER.decode())
 
 
 class IntegrationConfigurationManager:
-    # ToDo: Add support for webhook configs
 
     def __init__(self, **kwargs):
         host = kwargs.get("host", settings.REDIS_HOST)
         port = kwargs.get("port", settings.REDIS_PORT)
         db = kwargs.get("db", settings.REDIS_CONFIGS_DB)
-        self.db_client = redis.Redis(host=host, port=port, db=db)
+        self._redis_params = {"host": host, "port": port, "db": db}
+        self._db_client = None
+        self.local_cache = _local_cache
+
+    @property
+    def db_client(self) -> redis.Redis:
+        # The shared pool is looked up on each use, so the client follows it if it's closed and created again
+        pool = get_connection_pool(**self._redis_params)
+        if self._db_client is None or self._db_client.connection_pool is not pool:
+            self._db_client = redis.Redis(connection_pool=pool)
+        return self._db_client
 
     def _get_integration_key(self, integration_id: str) -> str:
         return f"integration.{integration_id}"
@@ -22,7 +56,55 @@ class IntegrationConfigurationManager:
     def _get_integration_config_key(self, integration_id: str, action_id: str) -> str:
         return f"integrationconfig.{integration_id}.{action_id}"
 
+    def _get_webhook_config_key(self, integration_id: str) -> str:
+        return f"integrationwebhookconfig.{integration_id}"
+
+    def _get_integration_reload_lock_key(self, integration_id: str) -> str:
+        return f"integration_reload_lock.{integration_id}"
+
     async def _reload_integration_from_gundi(self, integration_id: str) -> Integration:
+        """
+        Reloads an integration from Gundi. Concurrent callers in this process share one reload in flight.
+        """
+        if not (reload := _reloads_in_progress.get(integration_id)):
+            reload = asyncio.create_task(self._reload_integration_with_lock(integration_id))
+            _reloads_in_progress[integration_id] = reload
+
+            def _on_reload_done(task):
+                if _reloads_in_progress.get(integration_id) is task:
+                    del _reloads_in_progress[integration_id]
+
+            reload.add_done_callback(_on_reload_done)
+        # Shielded so that a cancelled caller doesn't cancel the reload for the others
+        return await asyncio.shield(reload)
+
+    async def _reload_integration_with_lock(self, integration_id: str) -> Integration:
+        """
+        Holds a redis lock while reloading, so replicas reloading the same integration
+        wait for the first one and use the data it saves instead of calling Gundi again.
+        """
+        lock = self.db_client.lock(
+            self._get_integration_reload_lock_key(integration_id),
+            timeout=settings.CONFIGS_RELOAD_LOCK_TIMEOUT
+        )
+        acquired = await lock.acquire(blocking=False)
+        try:
+            if not acquired:
+                logger.debug(f"Integration {integration_id} is being reloaded by another replica. Waiting..")
+                acquired = await lock.acquire(blocking_timeout=settings.CONFIGS_RELOAD_LOCK_TIMEOUT)
+                if integration := await self._get_integration_details_from_redis(
+                        integration_id, include_webhook_configuration=True
+                ):
+                    return integration
+            return await self._fetch_integration_from_gundi(integration_id)
+        finally:
+            if acquired:
+                try:
+                    await lock.release()
+                except redis_exceptions.LockError:  # The lock expired
+                    pass
+
+    async def _fetch_integration_from_gundi(self, integration_id: str) -> Integration:
         key = self._get_integration_key(integration_id)
         async with GundiClient() as gundi:
             async for attempt in stamina.retry_context(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0,  wait_max=32.0):
@@ -30,43 +112,131 @@ class IntegrationConfigurationManager:
                     integration_details = await gundi.get_integration_details(integration_id)
             integration = IntegrationSummary.from_integration(integration_details)
             await self.db_client.set(key, integration.json())
+            self.local_cache.set(key, integration)
             # Save configurations for individual actions
             for config in integration_details.configurations:
                 config_key = self._get_integration_config_key(integration_id, config.action.value)
                 await self.db_client.set(config_key, config.json())
+                self.local_cache.set(config_key, config)
+            # Remember which actions have no configuration, so they don't cause a reload on every call
+            configured_actions = {config.action.value for config in integration_details.configurations}
+            for action in integration_details.type.actions:
+                if action.value not in configured_actions:
+                    await self._set_missing_action_configuration(integration_id, action.value)
+            await self._save_webhook_configuration(integration_id, integration_details.webhook_configuration)
             return integration_details
 
+    async def _set_missing_action_configuration(self, integration_id: str, action_id: str):
+        """
+        Saves a short-lived negative cache entry for an action without configuration.
+        It's overwritten when the configuration is created (ActionConfigCreated).
+        """
+        key = self._get_integration_config_key(integration_id, action_id)
+        await self.db_client.set(key, MISSING_CONFIG_MARKER, ex=settings.CONFIGS_NEGATIVE_CACHE_TTL)
+        self._cache_missing_config_locally(key)
+
+    def _cache_missing_config_locally(self, key: str):
+        ttl = min(settings.CONFIGS_NEGATIVE_CACHE_TTL, settings.CONFIGS_LOCAL_CACHE_TTL)
+        self.local_cache.set(key, _MISSING_CONFIG, ttl=ttl)
+
+    async def _save_webhook_configuration(self, integration_id: str, config: Optional[WebhookConfiguration]):
+        """Saves the webhook configuration, or a marker if the integration has none (negative caching)"""
+        key = self._get_webhook_config_key(integration_id)
+        if config:
+            await self.db_client.set(key, config.json(), ex=settings.WEBHOOK_CONFIGS_CACHE_TTL)
+            self.local_cache.set(key, config)
+        else:
+            await self.db_client.set(key, MISSING_CONFIG_MARKER, ex=settings.CONFIGS_NEGATIVE_CACHE_TTL)
+            self._cache_missing_config_locally(key)
+
+    def invalidate_local_cache(self, integration_id: str, action_id: str = None):
+        """
+        Removes an integration and its action configurations from the in-process cache.
+        If an action is given, only the configuration of that action is removed.
+        """
+        if action_id:
+            self.local_cache.pop(self._get_integration_config_key(integration_id, action_id))
+            return
+        self.local_cache.pop(self._get_integration_key(integration_id))
+        self.local_cache.pop(self._get_webhook_config_key(integration_id))
+        configs_prefix = self._get_integration_config_key(integration_id, "")
+        for key in self.local_cache.keys():
+            if key.startswith(configs_prefix):
+                self.local_cache.pop(key)
+
     async def get_action_configuration(self, integration_id: str, action_id: str) -> IntegrationActionConfiguration:
         key = self._get_integration_config_key(integration_id, action_id)
+        if config := self.local_cache.get(key):
+            return None if config is _MISSING_CONFIG else config
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 data = await self.db_client.get(key)
+        if _is_missing_config_marker(data):
+            self._cache_missing_config_locally(key)
+            return None
         if data:
-            return IntegrationActionConfiguration.parse_raw(data)
+            config = IntegrationActionConfiguration.parse_raw(data)
+            self.local_cache.set(key, config)
+            return config
         # If not found in the redis db, try reloading data from Gundi API
         integration_details = await self._reload_integration_from_gundi(integration_id)
-        return integration_details.get_action_config(action_id)
+        config = integration_details.get_action_config(action_id)
+        if not config and self.local_cache.get(key) is not _MISSING_CONFIG:
+            await self._set_missing_action_configuration(integration_id, action_id)
+        return config
 
     async def set_action_configuration(self, integration_id: str, action_id: str, config: IntegrationActionConfiguration):
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.set(key, config.json())
+        self.local_cache.set(key, config)
 
     async def delete_action_configuration(self, integration_id: str, action_id: str):
         key = self._get_integration_config_key(integration_id, action_id)
+        self.local_cache.pop(key)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 return await self.db_client.delete(key)
 
+    async def get_webhook_configuration(self, integration_id: str) -> Optional[WebhookConfiguration]:
+        key = self._get_webhook_config_key(integration_id)
+        if config := self.local_cache.get(key):
+            return None if config is _MISSING_CONFIG else config
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                data = await self.db_client.get(key)
+        if _is_missing_config_marker(data):
+            self._cache_missing_config_locally(key)
+            return None
+        if data:
+            config = WebhookConfiguration.parse_raw(data)
+            self.local_cache.set(key, config)
+            return config
+        # If not found in the redis db, reload from Gundi. The webhook configuration is saved too
+        integration_details = await self._reload_integration_from_gundi(integration_id)
+        return integration_details.webhook_configuration
+
+    async def delete_webhook_configuration(self, integration_id: str):
+        """Removes the webhook configuration from the cache, so it's reloaded from Gundi when needed"""
+        key = self._get_webhook_config_key(integration_id)
+        self.local_cache.pop(key)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                await self.db_client.delete(key)
+
     async def get_integration(self, integration_id: str) -> IntegrationSummary:
         key = self._get_integration_key(integration_id)
+        if integration := self.local_cache.get(key):
+            return integration
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 integration_data = await self.db_client.get(key)
         if integration_data:
             # Looks for configurations
-            return IntegrationSummary.parse_raw(integration_data)
+            integration = IntegrationSummary.parse_raw(integration_data)
+            self.local_cache.set(key, integration)
+            return integration
         # If not found in cache, reload from Gundi
         integration_details = await self._reload_integration_from_gundi(integration_id)
         return IntegrationSummary.from_integration(integration_details)
@@ -76,20 +246,93 @@ class IntegrationConfigurationManager:
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.set(key, integration.json())
+        self.local_cache.set(key, integration)
 
     async def delete_integration(self, integration_id: str):
         key = self._get_integration_key(integration_id)
+        self.invalidate_local_cache(integration_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
-                await self.db_client.delete(key)
+                await self.db_client.delete(key, self._get_webhook_config_key(integration_id))
+
+    async def _get_many(self, keys: list) -> dict:
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                values = await self.db_client.mget(keys)
+        return dict(zip(keys, values))
+
+    async def get_integration_details(
+            self, integration_id: str, include_webhook_configuration: bool = False
+    ) -> Integration:
+        """
+        Returns the integration with the configurations of its actions.
+        The webhook configuration is only included if requested, since actions don't need it.
+        """
+        if integration := await self._get_integration_details_from_redis(
+                integration_id, include_webhook_configuration=include_webhook_configuration
+        ):
+            return integration
+        # Reload everything from Gundi once, instead of once per missing config
+        return await self._reload_integration_from_gundi(integration_id)
 
-    async def get_integration_details(self, integration_id: str) -> Integration:
-        integration_summary = await self.get_integration(integration_id)
-        configurations = []
+    async def _get_integration_details_from_redis(
+            self, integration_id: str, include_webhook_configuration: bool = False
+    ) -> Optional[Integration]:
+        """Builds the integration details from the local cache and redis. Returns None if anything is missing."""
+        integration_key = self._get_integration_key(integration_id)
+        integration_summary = self.local_cache.get(integration_key)
+        if integration_summary:
+            action_ids = [action.value for action in integration_summary.type.actions]
+        else:  # Guess the actions, so the integration and configs can be fetched together
+            action_ids = list(_known_action_ids)
+        configs = {}  # action_id -> config
+        keys_to_fetch = [] if integration_summary else [integration_key]
+        for action_id in action_ids:
+            config_key = self._get_integration_config_key(integration_id, action_id)
+            if config := self.local_cache.get(config_key):
+                configs[action_id] = config  # May be _MISSING_CONFIG
+            else:
+                keys_to_fetch.append(config_key)
+        webhook_config = None
+        if include_webhook_configuration:
+            webhook_config_key = self._get_webhook_config_key(integration_id)
+            if not (webhook_config := self.local_cache.get(webhook_config_key)):
+                keys_to_fetch.append(webhook_config_key)
+        # Fetch everything missing in the local cache in one round trip
+        values = await self._get_many(keys_to_fetch) if keys_to_fetch else {}
+        if not integration_summary:
+            if not (integration_data := values.get(integration_key)):
+                return None
+            integration_summary = IntegrationSummary.parse_raw(integration_data)
+            self.local_cache.set(integration_key, integration_summary)
+            _known_action_ids.update(action.value for action in integration_summary.type.actions)
+            # Fetch configs of actions that we couldn't guess
+            if missing_keys := [
+                key for action in integration_summary.type.actions
+                if (key := self._get_integration_config_key(integration_id, action.value)) not in values
+            ]:
+                values.update(await self._get_many(missing_keys))
         for action in integration_summary.type.actions:
-            config = await self.get_action_configuration(integration_id, action.value)
-            if config:
-                configurations.append(config)
+            if action.value in configs:
+                continue
+            config_key = self._get_integration_config_key(integration_id, action.value)
+            if not (config_data := values.get(config_key)):
+                return None
+            if _is_missing_config_marker(config_data):
+                configs[action.value] = _MISSING_CONFIG
+                self._cache_missing_config_locally(config_key)
+                continue
+            configs[action.value] = IntegrationActionConfiguration.parse_raw(config_data)
+            self.local_cache.set(config_key, configs[action.value])
+        if include_webhook_configuration and not webhook_config:
+            if not (webhook_config_data := values.get(webhook_config_key)):
+                return None
+            if _is_missing_config_marker(webhook_config_data):
+                webhook_config = _MISSING_CONFIG
+                self._cache_missing_config_locally(webhook_config_key)
+            else:
+                webhook_config = WebhookConfiguration.parse_raw(webhook_config_data)
+                self.local_cache.set(webhook_config_key, webhook_config)
         return Integration(
             id=integration_summary.id,
             name=integration_summary.name,
@@ -99,6 +342,9 @@ class IntegrationConfigurationManager:
             owner=integration_summary.owner,
             default_route=integration_summary.default_route,
             additional=integration_summary.additional,
-            configurations=configurations,
-            # ToDo: webhook_configuration
-        )
\ No newline at end of file
+            configurations=[
+                configs[action.value] for action in integration_summary.type.actions
+                if configs[action.value] is not _MISSING_CONFIG
+            ],
+            webhook_configuration=None if webhook_config is _MISSING_CONFIG else webhook_config,
+        )
@@ -0,0 +1,81 @@
+import logging
+from typing import Optional
+import redis.asyncio as redis
+from app import settings
+from app.services.redis_connections import get_connection_pool
+
+
+logger = logging.getLogger(__name__)
+
+
+MESSAGE_IN_PROGRESS = "in_progress"
+MESSAGE_DONE = "done"
+
+
+class MessageDeduplicator:
+    """
+    Remembers the ids of the PubSub messages being processed or already processed.
+    PubSub push delivers messages at least once, so redeliveries are detected without doing the work twice:
+    messages already processed are acknowledged, and messages still being processed are retried later,
+    so that they aren't lost if the original delivery fails.
+    """
+
+    def __init__(self, **kwargs):
+        host = kwargs.get("host", settings.REDIS_HOST)
+        port = kwargs.get("port", settings.REDIS_PORT)
+        db = kwargs.get("db", settings.REDIS_STATE_DB)
+        self.ttl = kwargs.get("ttl", settings.PUBSUB_DEDUP_TTL)
+        self.in_progress_ttl = kwargs.get("in_progress_ttl", settings.PUBSUB_DEDUP_IN_PROGRESS_TTL)
+        self._redis_params = {"host": host, "port": port, "db": db}
+        self._db_client = None
+
+    @property
+    def db_client(self) -> redis.Redis:
+        # The shared pool is looked up on each use, so the client follows it if it's closed and created again
+        pool = get_connection_pool(**self._redis_params)
+        if self._db_client is None or self._db_client.connection_pool is not pool:
+            self._db_client = redis.Redis(connection_pool=pool)
+        return self._db_client
+
+    def _get_message_key(self, message_id: str) -> str:
+        return f"pubsub_message.{message_id}"
+
+    async def claim(self, message_id: str) -> Optional[str]:
+        """
+        Marks the message as in progress. Returns None if it wasn't seen before, within the dedup window,
+        or the status of the earlier delivery otherwise (MESSAGE_IN_PROGRESS or MESSAGE_DONE).
+        """
+        if not message_id or not self.ttl:
+            return None
+        key = self._get_message_key(message_id)
+        try:
+            if await self.db_client.set(key, MESSAGE_IN_PROGRESS, nx=True, ex=self.in_progress_ttl):
+                return None
+            status = await self.db_client.get(key)
+        except redis.RedisError as e:  # Process the message anyway
+            logger.warning(f"Error checking for duplicate message {message_id}: {type(e).__name__}: {e}")
+            return None
+        if status is None:  # The earlier delivery failed and was forgotten in between
+            return None
+        return status.decode() if isinstance(status, bytes) else status
+
+    async def mark_done(self, message_id: str):
+        """Remembers a message processed successfully, so that redeliveries are acknowledged without doing work."""
+        if not message_id or not self.ttl:
+            return
+        try:
+            await self.db_client.set(self._get_message_key(message_id), MESSAGE_DONE, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Error marking message {message_id} as done: {type(e).__name__}: {e}")
+
+    async def forget(self, message_id: str):
+        """Forgets a message that wasn't processed successfully, so that it's processed again when redelivered."""
+        if not message_id or not self.ttl:
+            return
+        try:
+            await self.db_client.delete(self._get_message_key(message_id))
+        except redis.RedisError as e:
+            logger.warning(f"Error removing message {message_id} from the dedup window: {type(e).__name__}: {e}")
+
+
+message_deduplicator = MessageDeduplicator()
@@ -15,3 +15,6 @@ class ConfigurationValidationError(Exception):
 class ActionExecutionError(Exception):
     pass
 
+
+class BackgroundQueueFull(Exception):
+    pass
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from collections import deque
+from fastapi import BackgroundTasks
+from app import settings
+from app.services.errors import BackgroundQueueFull
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundExecutor:
+    """
+    Runs coroutine functions in a fixed number of async workers, with a bounded queue.
+    Pending work is queued per key (e.g. the integration id) and workers take work
+    from the keys in round-robin, so one busy integration can't starve the others.
+    """
+
+    def __init__(self, workers: int = None, max_queue_size: int = None):
+        self.workers = workers or settings.BACKGROUND_WORKERS
+        self.max_queue_size = max_queue_size or settings.BACKGROUND_QUEUE_SIZE
+        self._queues = {}  # key -> deque of (func, args, kwargs)
+        self._keys = deque()  # Keys with pending work, in round-robin order
+        self._queue_size = 0
+        self._in_progress = 0
+        self._work_available = None
+        self._idle = None
+        self._worker_tasks = []
+        self._shutting_down = False
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    @property
+    def is_shutting_down(self) -> bool:
+        return self._shutting_down
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue_size
+
+    @property
+    def in_progress(self) -> int:
+        return self._in_progress
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self._queue_size,
+            "max_queue_size": self.max_queue_size,
+            "in_progress": self._in_progress,
+        }
+
+    async def start(self):
+        self._shutting_down = False
+        self._work_available = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = None):
+        """Stops accepting work, and waits for queued and in-flight work to finish before stopping the workers."""
+        if not self.is_running:
+            return
+        self._shutting_down = True
+        worker_tasks, self._worker_tasks = self._worker_tasks, []
+        timeout = timeout if timeout is not None else settings.BACKGROUND_SHUTDOWN_TIMEOUT
+        logger.info(f"Stopping background executor. Waiting for pending work: {self.stats}")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Background work didn't finish in {timeout} seconds. "
+                f"Cancelling {self._in_progress} tasks in progress and {self._queue_size} queued."
+            )
+        for task in worker_tasks:
+            task.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        self._queues.clear()
+        self._keys.clear()
+        self._queue_size = 0
+        self._in_progress = 0
+
+    def submit(self, func, *args, key: str = None, **kwargs):
+        """
+        Queues a call to the coroutine function `func`.
+        Raises BackgroundQueueFull if the queue is full or the executor is shutting down.
+        """
+        if self._shutting_down:
+            raise BackgroundQueueFull("The background executor is shutting down")
+        if not self.is_running:
+            raise RuntimeError("The background executor is not running")
+        if self._queue_size >= self.max_queue_size:
+            raise BackgroundQueueFull(f"The background queue is full ({self._queue_size} tasks)")
+        if (queue := self._queues.get(key)) is None:
+            queue = self._queues[key] = deque()
+            self._keys.append(key)
+        queue.append((func, args, kwargs))
+        self._queue_size += 1
+        self._idle.clear()
+        self._work_available.release()
+
+    def _next(self):
+        key = self._keys.popleft()
+        queue = self._queues[key]
+        work = queue.popleft()
+        if queue:  # Go back to the end of the line
+            self._keys.append(key)
+        else:
+            del self._queues[key]
+        self._queue_size -= 1
+        return work
+
+    async def _worker(self):
+        while True:
+            await self._work_available.acquire()
+            func, args, kwargs = self._next()
+            self._in_progress += 1
+            try:
+                await func(*args, **kwargs)
+            except Exception as e:
+                logger.exception(f"Error in background task {func.__name__}: {type(e).__name__}: {e}")
+            finally:
+                self._in_progress -= 1
+                if not self._queue_size and not self._in_progress:
+                    self._idle.set()
+
+
+background_executor = BackgroundExecutor()
+
+
+def run_in_background(background_tasks: BackgroundTasks, func, *args, key: str = None, **kwargs):
+    """
+    Runs `func` in the background executor. Falls back to FastAPI's background tasks
+    when the executor isn't running (i.e. the app lifespan didn't start it).
+    Work is rejected with BackgroundQueueFull once the executor is shutting down.
+    """
+    if background_executor.is_running or background_executor.is_shutting_down:
+        background_executor.submit(func, *args, key=key, **kwargs)
+    else:
+        background_tasks.add_task(func, *args, **kwargs)
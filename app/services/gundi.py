@@ -1,8 +1,104 @@
 import datetime
+import json
+import logging
+from contextlib import asynccontextmanager
 from typing import List
 import httpx
 import stamina
 from gundi_client_v2.client import GundiClient, GundiDataSenderClient
+from app import settings
+from app.services.utils import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class PooledGundiDataSenderClient(GundiDataSenderClient):
+    """
+    GundiDataSenderClient that sends requests through a shared HTTP session,
+    so connections are reused across batches, actions and integrations.
+
+    The client opens a new session per request and takes no session argument, so this overrides
+    its private _post_data and _update_data. They mirror gundi-client-v2==2.4.1 (pinned in
+    requirements-base.in), including its logging. Review them when upgrading the client.
+    """
+
+    def __init__(self, integration_api_key: str = None, session: httpx.AsyncClient = None, **kwargs):
+        super().__init__(integration_api_key=integration_api_key, **kwargs)
+        self._session = session or _get_sensors_api_session()
+
+    async def _post_data(self, data: List[dict] = None, endpoint: str = None, attachments: List[tuple] = None) -> dict:
+        logger.info(
+            " -- Posting to routing services --",
+            extra={"integration_api_key": self._api_key}
+        )
+        url = f"{self.sensors_api_endpoint}/{endpoint}/"
+        request = dict(
+            url=url,
+            headers={"apikey": self._api_key}
+        )
+        if data:
+            request["json"] = [json.loads(json.dumps(r, default=str)) for r in data]
+        if attachments:
+            request["files"] = [
+                ('file', (filename, image_binary)) for filename, image_binary in attachments
+            ]
+        logger.debug(
+            f" -- sending {endpoint}. --",
+            extra={"length": len(data or attachments), "api": url}
+        )
+        response = await self._session.post(**request)
+        response.raise_for_status()
+        return response.json()
+
+    async def _update_data(self, data: dict = None, endpoint: str = None) -> dict:
+        logger.info(
+            " -- Updating data... --",
+            extra={"integration_api_key": self._api_key}
+        )
+        url = f"{self.sensors_api_endpoint}/{endpoint}/"
+        clean_data = json.loads(json.dumps(data, default=str))
+        logger.debug(
+            f" -- sending {endpoint}. --",
+            extra={"length": len(clean_data), "api": url}
+        )
+        response = await self._session.patch(
+            url=url,
+            headers={"apikey": self._api_key},
+            json=clean_data
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+_sensors_api_session = None
+# Sender clients are cached per integration to avoid requesting the API key on every batch
+_sensors_api_clients = TTLCache(
+    maxsize=settings.SENSORS_API_CLIENTS_CACHE_SIZE,
+    ttl=settings.SENSORS_API_CLIENTS_CACHE_TTL
+)
+
+
+def _get_sensors_api_session() -> httpx.AsyncClient:
+    global _sensors_api_session
+    if _sensors_api_session is None or _sensors_api_session.is_closed:
+        _sensors_api_session = httpx.AsyncClient(
+            timeout=120,
+            limits=httpx.Limits(
+                max_connections=settings.SENSORS_API_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SENSORS_API_MAX_CONNECTIONS
+            )
+        )
+    return _sensors_api_session
+
+
+async def close_sensors_api_clients():
+    """Closes the shared HTTP session used to send data to Gundi. Call this on shutdown."""
+    global _sensors_api_session
+    _sensors_api_clients.clear()
+    if _sensors_api_session is not None:
+        await _sensors_api_session.aclose()
+        _sensors_api_session = None
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
@@ -14,14 +110,28 @@ async def _get_gundi_api_key(integration_id):
 
 
 async def _get_sensors_api_client(integration_id):
+    if sensors_api_client := _sensors_api_clients.get(integration_id):
+        return sensors_api_client
     gundi_api_key = await _get_gundi_api_key(integration_id=integration_id)
     assert gundi_api_key, f"Cannot get a valid API Key for integration {integration_id}"
-    sensors_api_client = GundiDataSenderClient(
+    sensors_api_client = PooledGundiDataSenderClient(
         integration_api_key=gundi_api_key
     )
+    _sensors_api_clients.set(integration_id, sensors_api_client)
     return sensors_api_client
 
 
+@asynccontextmanager
+async def _sensors_api_client(integration_id):
+    sensors_api_client = await _get_sensors_api_client(integration_id=integration_id)
+    try:
+        yield sensors_api_client
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (401, 403):  # The API key might have been rotated
+            _sensors_api_clients.pop(integration_id)
+        raise e
+
+
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
 async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
     """
@@ -47,8 +157,8 @@ async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
-    sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_events(data=events)
+    async with _sensors_api_client(integration_id=str(integration_id)) as sensors_api_client:
+        return await sensors_api_client.post_events(data=events)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
@@ -65,8 +175,8 @@ async def send_event_attachments_to_gundi(event_id: str, attachments: List[tuple
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
-    sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_event_attachments(event_id=event_id, attachments=attachments)
+    async with _sensors_api_client(integration_id=str(integration_id)) as sensors_api_client:
+        return await sensors_api_client.post_event_attachments(event_id=event_id, attachments=attachments)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
@@ -95,8 +205,8 @@ async def send_observations_to_gundi(observations: List[dict], **kwargs) -> dict
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
-    sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_observations(data=observations)
+    async with _sensors_api_client(integration_id=str(integration_id)) as sensors_api_client:
+        return await sensors_api_client.post_observations(data=observations)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
@@ -133,5 +243,5 @@ async def send_messages_to_gundi(messages: List[dict], **kwargs) -> dict:
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
-    sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_messages(data=messages)
+    async with _sensors_api_client(integration_id=str(integration_id)) as sensors_api_client:
+        return await sensors_api_client.post_messages(data=messages)
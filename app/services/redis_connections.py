@@ -0,0 +1,38 @@
+import logging
+import redis.asyncio as redis
+from app import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Connection pools shared by all the redis clients in the process, by (host, port, db)
+_connection_pools = {}
+
+
+def get_connection_pool(host: str, port: int, db: int) -> redis.ConnectionPool:
+    """
+    Returns the process-wide connection pool for a redis database, creating it on first use.
+    Connections are opened lazily, and callers wait for a free connection when the pool is exhausted.
+    Clients should get the pool when they use it rather than keeping it, since pools are closed on shutdown.
+    """
+    key = (host, port, db)
+    if not (pool := _connection_pools.get(key)):
+        pool = redis.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        _connection_pools[key] = pool
+    return pool
+
+
+async def close_connection_pools():
+    for (host, port, db), pool in list(_connection_pools.items()):
+        try:
+            await pool.disconnect()
+        except Exception as e:
+            logger.warning(f"Error closing redis connections to {host}:{port}/{db}: {type(e).__name__}: {e}")
+    _connection_pools.clear()
@@ -1,7 +1,16 @@
+import asyncio
 import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List
 import stamina
 import redis.asyncio as redis
+import redis.exceptions as redis_exceptions
 from app import settings
+from app.services.redis_connections import get_connection_pool
+
+
+logger = logging.getLogger(__name__)
 
 
 class IntegrationStateManager:
@@ -10,7 +19,16 @@ class IntegrationStateManager:
         host = kwargs.get("host", settings.REDIS_HOST)
         port = kwargs.get("port", settings.REDIS_PORT)
         db = kwargs.get("db", settings.REDIS_STATE_DB)
-        self.db_client = redis.Redis(host=host, port=port, db=db)
+        self._redis_params = {"host": host, "port": port, "db": db}
+        self._db_client = None
+
+    @property
+    def db_client(self) -> redis.Redis:
+        # The shared pool is looked up on each use, so the client follows it if it's closed and created again
+        pool = get_connection_pool(**self._redis_params)
+        if self._db_client is None or self._db_client.connection_pool is not pool:
+            self._db_client = redis.Redis(connection_pool=pool)
+        return self._db_client
 
     async def get_state(self, integration_id: str, action_id: str, source_id: str = "no-source") -> dict:
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
@@ -19,14 +37,55 @@ class IntegrationStateManager:
         value = json.loads(json_value) if json_value else {}
         return value
 
-    async def set_state(self, integration_id: str, action_id: str, state: dict, source_id: str = "no-source"):
+    async def set_state(
+            self, integration_id: str, action_id: str, state: dict, source_id: str = "no-source", ttl: int = None
+    ):
+        """Saves the state of a source. The state expires after `ttl` seconds, if given."""
+        expiry = {"ex": ttl} if ttl else {}
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.set(
                     f"integration_state.{integration_id}.{action_id}.{source_id}",
-                    json.dumps(state, default=str)
+                    json.dumps(state, default=str),
+                    **expiry
                 )
 
+    async def get_states(self, integration_id: str, action_id: str, source_ids: List[str]) -> Dict[str, dict]:
+        """
+        Reads the state of many sources in one round trip (MGET).
+        :return: a dict with the state of each source. Sources without a saved state get an empty dict.
+        """
+        if not source_ids:
+            return {}
+        keys = [f"integration_state.{integration_id}.{action_id}.{source_id}" for source_id in source_ids]
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                json_values = await self.db_client.mget(keys)
+        return {
+            source_id: json.loads(json_value) if json_value else {}
+            for source_id, json_value in zip(source_ids, json_values)
+        }
+
+    async def set_states(self, integration_id: str, action_id: str, states: Dict[str, dict], ttl: int = None):
+        """
+        Saves the state of many sources in one round trip (pipelined SET).
+        :param states: a dict with the state of each source, keyed by source id
+        :param ttl: seconds after which the states expire, if given
+        """
+        if not states:
+            return
+        expiry = {"ex": ttl} if ttl else {}
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                async with self.db_client.pipeline(transaction=False) as pipe:
+                    for source_id, state in states.items():
+                        pipe.set(
+                            f"integration_state.{integration_id}.{action_id}.{source_id}",
+                            json.dumps(state, default=str),
+                            **expiry
+                        )
+                    await pipe.execute()
+
     async def delete_state(self, integration_id: str, action_id: str, source_id: str = "no-source"):
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
@@ -34,6 +93,39 @@ class IntegrationStateManager:
                     f"integration_state.{integration_id}.{action_id}.{source_id}"
                 )
 
+    @asynccontextmanager
+    async def lease(self, integration_id: str, action_id: str, source_id: str = "no-source", ttl: float = None):
+        """
+        Holds a distributed lease on an integration action (and optionally a source) while the context is active.
+        The lease expires after `ttl` seconds unless renewed, and it's renewed automatically while held,
+        so it's released even if the process dies.
+        Yields True if the lease was acquired, or False if it's held by someone else.
+        """
+        ttl = ttl or settings.ACTION_LEASE_TTL
+        lock = self.db_client.lock(f"integration_lease.{integration_id}.{action_id}.{source_id}", timeout=ttl)
+        if not await lock.acquire(blocking=False):
+            yield False
+            return
+
+        async def _renew():
+            while True:
+                await asyncio.sleep(ttl / 3)
+                try:
+                    await lock.reacquire()
+                except redis_exceptions.LockError as e:  # Expired and maybe taken by someone else
+                    logger.warning(f"Lost lease {lock.name}: {type(e).__name__}: {e}")
+                    return
+
+        renewal = asyncio.create_task(_renew())
+        try:
+            yield True
+        finally:
+            renewal.cancel()
+            try:
+                await lock.release()
+            except redis_exceptions.LockError:  # The lease expired
+                pass
+
     def __str__(self):
         return f"IntegrationStateManager(host={self.db_client.host}, port={self.db_client.port}, db={self.db_client.db})"
 
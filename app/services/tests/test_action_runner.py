@@ -11,7 +11,11 @@ from gundi_core.events.transformers import ObservationTransformedER
 from app import settings
 from app.conftest import MockSubActionConfiguration, MockPushActionConfiguration
 from app.main import app
-from app.services.action_scheduler import trigger_action
+from app.services.action_scheduler import trigger_action, trigger_actions
+from app.services.deduplication import MessageDeduplicator
+from app.services.action_runner import execute_action
+from app.services.utils import get_remaining_time
+from app.conftest import async_return
 
 api_client = TestClient(app)
 
@@ -239,6 +243,40 @@ async def test_trigger_subaction(
     assert topic == settings.INTEGRATION_COMMANDS_TOPIC
 
 
+
+@pytest.mark.asyncio
+async def test_trigger_subactions_in_bulk(
+        mocker, integration_v2, mock_pubsub_client, mock_action_handlers, gcp_pubsub_publish_response
+):
+    settings.TRIGGER_ACTIONS_ALWAYS_SYNC = False
+    settings.INTEGRATION_COMMANDS_TOPIC = "integration-actions-topic"
+    mocker.patch("app.services.activity_logger.pubsub", mock_pubsub_client)
+    mocker.patch.object(settings, "PUBSUB_MAX_MESSAGES_PER_REQUEST", 100)
+    integration_id = str(integration_v2.id)
+    action_id = "pull_observations_by_date"
+    commands = [
+        RunIntegrationAction(
+            integration_id=integration_id,
+            action_id=action_id,
+            config_overrides=MockSubActionConfiguration(
+                start_datetime=f"2024-12-{day:02}T00:00:00Z",
+                end_datetime=f"2024-12-{day + 1:02}T00:00:00Z"
+            ).dict()
+        )
+        for day in range(1, 31)
+    ] * 5
+
+    responses = await trigger_actions(commands)
+
+    # 150 commands are published in two requests, due to the max messages per request
+    mock_action_handler, mock_config, mock_datamodel = mock_action_handlers[action_id]
+    assert not mock_action_handler.called
+    publish_mock = mock_pubsub_client.PublisherClient.return_value.publish
+    assert publish_mock.call_count == 2
+    assert sorted(len(call.args[1]) for call in publish_mock.call_args_list) == [50, 100]
+    assert responses == [gcp_pubsub_publish_response, gcp_pubsub_publish_response]
+
+
 @pytest.mark.asyncio
 async def test_trigger_subaction_sync(
         mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
@@ -327,3 +365,135 @@ async def test_execute_action_with_handler_error(
     assert event.payload.server_response_status == expected_error.response.status_code
     assert event.payload.server_response_body == str(expected_error.response.text)
 
+
+@pytest.fixture
+def message_deduplicator(mocker, mock_redis):
+    messages = {}
+
+    def set_message_status(key, value, nx=False, ex=None):
+        if nx and key in messages:
+            return async_return(None)
+        messages[key] = value
+        return async_return(True)
+
+    mock_redis.Redis.return_value.set.side_effect = set_message_status
+    mock_redis.Redis.return_value.get.side_effect = lambda key: async_return(messages.get(key))
+    mock_redis.Redis.return_value.delete.side_effect = lambda key: async_return(messages.pop(key, None))
+    mocker.patch("app.services.deduplication.redis", mock_redis)
+    message_deduplicator = MessageDeduplicator()
+    mocker.patch("app.main.message_deduplicator", message_deduplicator)
+    return message_deduplicator
+
+
+@pytest.mark.asyncio
+async def test_execute_pull_action_from_pubsub_skips_redeliveries(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+        pubsub_message_request_headers, run_pull_action_pubsub_payload, message_deduplicator
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    for _ in range(2):  # Same message delivered twice
+        response = api_client.post(
+            "/",
+            headers=pubsub_message_request_headers,
+            json=run_pull_action_pubsub_payload,
+        )
+        assert response.status_code == 200
+
+    # The action runs only once
+    mock_action_handler, mock_config, mock_datamodel = mock_action_handlers["pull_observations"]
+    assert mock_action_handler.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_execute_push_action_from_pubsub_retries_redeliveries_in_progress(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+        pubsub_message_request_headers, run_push_action_pubsub_payload, mock_push_observations_handler,
+        message_deduplicator
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.actions.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    redeliveries = []
+
+    def push_observations_handler(**kwargs):
+        # The message is redelivered while the original delivery is being processed
+        redeliveries.append(
+            api_client.post(
+                "/push-data",
+                headers=pubsub_message_request_headers,
+                json=run_push_action_pubsub_payload,
+            )
+        )
+        raise Exception("Service unavailable")
+
+    mock_push_observations_handler.side_effect = push_observations_handler
+
+    response = api_client.post(
+        "/push-data",
+        headers=pubsub_message_request_headers,
+        json=run_push_action_pubsub_payload,
+    )
+
+    # The redelivery isn't acknowledged, so the message isn't lost when the original delivery fails
+    assert redeliveries[0].status_code == status.HTTP_409_CONFLICT
+    assert response.status_code == 500
+    assert mock_push_observations_handler.call_count == 1
+    message_id = run_push_action_pubsub_payload["message"]["messageId"]
+    assert await message_deduplicator.claim(message_id) is None
+
+
+@pytest.mark.asyncio
+async def test_execute_push_action_from_pubsub_runs_redeliveries_after_errors(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+        pubsub_message_request_headers, run_push_action_pubsub_payload, mock_push_observations_handler,
+        message_deduplicator
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.actions.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_push_observations_handler.side_effect = [Exception("Service unavailable"), {"observations_pushed": 1}]
+
+    responses = [
+        api_client.post(
+            "/push-data",
+            headers=pubsub_message_request_headers,
+            json=run_push_action_pubsub_payload,
+        )
+        for _ in range(2)
+    ]
+
+    # The message is processed again after a failure
+    assert [response.status_code for response in responses] == [500, 200]
+    assert mock_push_observations_handler.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_action_handler_sees_remaining_time(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_action_handler, mock_config, mock_datamodel = mock_action_handlers["pull_observations"]
+    remaining_times = []
+    mock_action_handler.side_effect = lambda **kwargs: remaining_times.append(get_remaining_time())
+
+    await execute_action(integration_id=str(integration_v2.id), action_id="pull_observations")
+
+    # The handler knows how much time it has left, and the deadline is cleared afterwards
+    assert 0 < remaining_times[0] <= settings.MAX_ACTION_EXECUTION_TIME
+    assert get_remaining_time() is None
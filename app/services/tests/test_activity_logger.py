@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from unittest.mock import ANY
 from gundi_core.events import (
@@ -11,7 +13,9 @@ from gundi_core.events import (
     IntegrationWebhookFailed
 )
 from app import settings
-from app.services.activity_logger import publish_event, activity_logger, webhook_activity_logger, log_activity
+from app.services.activity_logger import (
+    publish_event, activity_logger, webhook_activity_logger, log_activity, EventPublisher
+)
 from app.webhooks import GenericJsonPayload, GenericJsonTransformConfig
 
 
@@ -45,6 +49,56 @@ async def test_publish_event(
     )
 
 
+
+@pytest.mark.asyncio
+async def test_event_publisher_batches_events(
+        mocker, mock_pubsub_client, action_started_event, action_complete_event, custom_activity_log_event
+):
+    mocker.patch("app.services.activity_logger.pubsub", mock_pubsub_client)
+    mock_pubsub_client.PublisherClient.return_value.publish.return_value = asyncio.Future()
+    mock_pubsub_client.PublisherClient.return_value.publish.return_value.set_result(
+        {"messageIds": ["1", "2", "3"]}
+    )
+    publisher = EventPublisher(max_batch_size=10, max_latency=0.01)
+    mocker.patch("app.services.activity_logger.event_publisher", publisher)
+    await publisher.start()
+
+    responses = await asyncio.gather(
+        *[
+            publish_event(event=event, topic_name=settings.INTEGRATION_EVENTS_TOPIC)
+            for event in [action_started_event, action_complete_event, custom_activity_log_event]
+        ]
+    )
+    await publisher.stop()
+
+    # The three events are published in a single request, using the same client
+    assert mock_pubsub_client.PublisherClient.call_count == 1
+    publish_mock = mock_pubsub_client.PublisherClient.return_value.publish
+    assert publish_mock.call_count == 1
+    assert len(publish_mock.call_args.args[1]) == 3
+    assert responses == [{"messageIds": ["1"]}, {"messageIds": ["2"]}, {"messageIds": ["3"]}]
+
+
+@pytest.mark.asyncio
+async def test_event_publisher_flushes_when_batch_is_full(mocker, mock_pubsub_client, action_started_event):
+    mocker.patch("app.services.activity_logger.pubsub", mock_pubsub_client)
+    publisher = EventPublisher(max_batch_size=2, max_latency=60)
+    mocker.patch("app.services.activity_logger.event_publisher", publisher)
+    await publisher.start()
+
+    # Doesn't wait for the max latency when the batch is full
+    await asyncio.wait_for(
+        asyncio.gather(
+            publish_event(event=action_started_event, topic_name=settings.INTEGRATION_EVENTS_TOPIC),
+            publish_event(event=action_started_event, topic_name=settings.INTEGRATION_EVENTS_TOPIC),
+        ),
+        timeout=1
+    )
+    await publisher.stop()
+
+    assert mock_pubsub_client.PublisherClient.return_value.publish.call_count == 1
+
+
 @pytest.mark.asyncio
 async def test_activity_logger_decorator(
         mocker, mock_publish_event, integration_v2, pull_observations_config
@@ -42,6 +42,7 @@ async def test_process_event_integration_updated_from_pubsub(
     assert response.status_code == 200
     assert mock_config_manager.get_integration.called
     assert mock_config_manager.set_integration.called
+    assert mock_config_manager.delete_webhook_configuration.called
 
 
 @pytest.mark.asyncio
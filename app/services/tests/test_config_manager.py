@@ -1,7 +1,11 @@
+import asyncio
+
 import pytest
 
+from app import settings
+from app.conftest import async_return
 from gundi_core.schemas.v2 import IntegrationSummary, IntegrationActionConfiguration, Integration
-from app.services.config_manager import IntegrationConfigurationManager
+from app.services.config_manager import IntegrationConfigurationManager, _local_cache, MISSING_CONFIG_MARKER
 
 
 @pytest.mark.asyncio
@@ -106,8 +110,279 @@ async def test_get_integration_details_with_empty_redis_db(
     assert isinstance(integration, Integration)
     assert len(integration.configurations) == len(integration_v2.configurations)
     assert integration.id == integration_v2.id
-    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_with(integration_id)
-    for config in integration_v2.configurations:
-        action_id = config.action.value
-        mock_redis_empty.Redis.return_value.get.assert_any_call(f"integrationconfig.{integration_id}.{action_id}")
+    # Data is reloaded from Gundi only once
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+    mock_redis_empty.Redis.return_value.mget.assert_called_once_with([f"integration.{integration_id}"])
+
+
+
+@pytest.mark.asyncio
+async def test_get_integration_from_local_cache(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    integration = await config_manager.get_integration(integration_id)
+    cached_integration = await IntegrationConfigurationManager().get_integration(integration_id)
+
+    # The second call is served from the in-process cache, shared by all managers
+    assert cached_integration is integration
+    mock_redis_with_integration_config.Redis.return_value.get.assert_called_once_with(f"integration.{integration_id}")
+
+
+@pytest.mark.asyncio
+async def test_delete_action_configuration_invalidates_local_cache(
+        mocker, mock_redis_with_action_config, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_action_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+    action_id = integration_v2.configurations[0].action.value
+    await config_manager.get_action_configuration(integration_id, action_id)
+
+    await config_manager.delete_action_configuration(integration_id, action_id)
+    await config_manager.get_action_configuration(integration_id, action_id)
+
+    # The configuration is read again from redis after being deleted
+    assert mock_redis_with_action_config.Redis.return_value.get.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_with_one_round_trip(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2, integration_v2_as_json
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    integration_id = str(integration_v2.id)
+    redis_data = {f"integration.{integration_id}": integration_v2_as_json}
+    for action in integration_v2.type.actions:  # Save configs in redis, one per action
+        config = integration_v2.configurations[0].copy(update={"action": action})
+        redis_data[f"integrationconfig.{integration_id}.{action.value}"] = config.json()
+    mock_redis_empty.Redis.return_value.mget.side_effect = lambda keys: async_return(
+        [redis_data.get(key) for key in keys]
+    )
+    # The actions of the integration type are known after getting any integration from redis
+    await IntegrationConfigurationManager().get_integration_details(integration_id)
+    _local_cache.clear()
+    mock_redis_empty.Redis.return_value.mget.reset_mock()
+
+    integration = await IntegrationConfigurationManager().get_integration_details(integration_id)
+
+    # The integration and all the action configurations are fetched in a single MGET
+    assert integration.id == integration_v2.id
+    assert len(integration.configurations) == len(integration_v2.type.actions)
+    assert mock_redis_empty.Redis.return_value.mget.call_count == 1
+    keys_fetched = mock_redis_empty.Redis.return_value.mget.call_args.args[0]
+    assert set(keys_fetched) == set(redis_data.keys())
+    assert not mock_redis_empty.Redis.return_value.get.called
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reloads_are_coalesced(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    integration_id = str(integration_v2.id)
+    action_id = integration_v2.configurations[0].action.value
+
+    results = await asyncio.gather(
+        *[IntegrationConfigurationManager().get_action_configuration(integration_id, action_id) for _ in range(5)],
+        *[IntegrationConfigurationManager().get_integration(integration_id) for _ in range(5)],
+    )
+
+    # All the callers get the data from a single reload
+    assert all(results)
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+    mock_redis_empty.Redis.return_value.lock.assert_called_once_with(
+        f"integration_reload_lock.{integration_id}", timeout=settings.CONFIGS_RELOAD_LOCK_TIMEOUT
+    )
+
+
+@pytest.mark.asyncio
+async def test_reload_in_progress_in_another_replica(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2, integration_v2_as_json
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    integration_id = str(integration_v2.id)
+    redis_data = {}
+    mock_redis_empty.Redis.return_value.mget.side_effect = lambda keys: async_return(
+        [redis_data.get(key) for key in keys]
+    )
+
+    async def acquire_lock(blocking=None, blocking_timeout=None):
+        if blocking is False:  # The lock is held by another replica
+            return False
+        # The other replica saves the integration in redis before releasing the lock
+        redis_data[f"integration.{integration_id}"] = integration_v2_as_json
+        for action in integration_v2.type.actions:
+            config = integration_v2.configurations[0].copy(update={"action": action})
+            redis_data[f"integrationconfig.{integration_id}.{action.value}"] = config.json()
+        redis_data[f"integrationwebhookconfig.{integration_id}"] = MISSING_CONFIG_MARKER
+        return True
+
+    mock_redis_empty.Redis.return_value.lock.return_value.acquire.side_effect = acquire_lock
+
+    integration = await IntegrationConfigurationManager().get_integration_details(integration_id)
+
+    # The data saved by the other replica is used instead of calling Gundi again
+    assert integration.id == integration_v2.id
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+    assert mock_redis_empty.Redis.return_value.lock.return_value.release.called
+
+
+@pytest.mark.asyncio
+async def test_missing_action_configuration_is_cached(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+    action_id = "push_events"  # Action of the integration type without configuration
+
+    action_config = await config_manager.get_action_configuration(integration_id, action_id)
+    cached_action_config = await config_manager.get_action_configuration(integration_id, action_id)
+
+    assert action_config is None
+    assert cached_action_config is None
+    # Data is reloaded from Gundi only once, and the missing config is remembered for a while
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+    mock_redis_empty.Redis.return_value.set.assert_any_call(
+        f"integrationconfig.{integration_id}.{action_id}", MISSING_CONFIG_MARKER, ex=settings.CONFIGS_NEGATIVE_CACHE_TTL
+    )
+
+
+@pytest.mark.asyncio
+async def test_missing_action_configuration_from_redis(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    mock_redis_empty.Redis.return_value.get.return_value = async_return(MISSING_CONFIG_MARKER)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    action_config = await config_manager.get_action_configuration(integration_id, "push_events")
+
+    # A negative cache entry saved by another replica avoids calling Gundi
+    assert action_config is None
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_with_missing_action_configurations(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    integration = await config_manager.get_integration_details(integration_id)
+    cached_integration = await config_manager.get_integration_details(integration_id)
+
+    # Actions without configuration don't cause a reload on every call
+    assert len(integration.configurations) == len(cached_integration.configurations) == len(integration_v2.configurations)
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+
+
+@pytest.mark.asyncio
+async def test_action_config_created_clears_missing_configuration(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+    action_id = "push_events"
+    await config_manager.get_action_configuration(integration_id, action_id)
+    new_config = integration_v2.configurations[0].copy()
+
+    # Configuration saved on ActionConfigCreated
+    await config_manager.set_action_configuration(integration_id, action_id, new_config)
+    action_config = await config_manager.get_action_configuration(integration_id, action_id)
+
+    assert action_config == new_config
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_with_webhook_configuration(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2_with_webhook,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    mock_gundi_client_v2_class.return_value.get_integration_details.return_value = async_return(
+        integration_v2_with_webhook
+    )
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2_with_webhook.id)
+
+    integration = await config_manager.get_integration_details(integration_id, include_webhook_configuration=True)
+    cached_integration = await config_manager.get_integration_details(integration_id, include_webhook_configuration=True)
+
+    assert integration.webhook_configuration == integration_v2_with_webhook.webhook_configuration
+    assert cached_integration.webhook_configuration == integration_v2_with_webhook.webhook_configuration
+    # Webhook requests don't call Gundi every time
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+    mock_redis_empty.Redis.return_value.set.assert_any_call(
+        f"integrationwebhookconfig.{integration_id}",
+        integration_v2_with_webhook.webhook_configuration.json(),
+        ex=settings.WEBHOOK_CONFIGS_CACHE_TTL
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_with_webhook_configuration_from_redis(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2_with_webhook,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    integration_id = str(integration_v2_with_webhook.id)
+    integration_summary = IntegrationSummary.from_integration(integration_v2_with_webhook)
+    redis_data = {
+        f"integration.{integration_id}": integration_summary.json(),
+        f"integrationwebhookconfig.{integration_id}": integration_v2_with_webhook.webhook_configuration.json(),
+    }
+    for action in integration_summary.type.actions:
+        redis_data[f"integrationconfig.{integration_id}.{action.value}"] = MISSING_CONFIG_MARKER
+    for config in integration_v2_with_webhook.configurations:
+        redis_data[f"integrationconfig.{integration_id}.{config.action.value}"] = config.json()
+    mock_redis_empty.Redis.return_value.mget.side_effect = lambda keys: async_return(
+        [redis_data.get(key) for key in keys]
+    )
+
+    integration = await IntegrationConfigurationManager().get_integration_details(
+        integration_id, include_webhook_configuration=True
+    )
+
+    assert integration.webhook_configuration == integration_v2_with_webhook.webhook_configuration
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_webhook_configuration_is_reloaded_after_delete(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2_with_webhook,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    mock_gundi_client_v2_class.return_value.get_integration_details.return_value = async_return(
+        integration_v2_with_webhook
+    )
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2_with_webhook.id)
+    await config_manager.get_webhook_configuration(integration_id)
+
+    # Removed on IntegrationUpdated
+    await config_manager.delete_webhook_configuration(integration_id)
+    webhook_config = await config_manager.get_webhook_configuration(integration_id)
 
+    assert webhook_config == integration_v2_with_webhook.webhook_configuration
+    assert mock_gundi_client_v2_class.return_value.get_integration_details.call_count == 2
+    mock_redis_empty.Redis.return_value.delete.assert_called_once_with(f"integrationwebhookconfig.{integration_id}")
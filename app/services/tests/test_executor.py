@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.errors import BackgroundQueueFull
+from app.services.executor import BackgroundExecutor, run_in_background
+
+
+api_client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_background_executor_round_robin_across_integrations():
+    executor = BackgroundExecutor(workers=1, max_queue_size=10)
+    await executor.start()
+    executed = []
+
+    async def task(integration_id, i):
+        executed.append((integration_id, i))
+
+    for i in range(3):
+        executor.submit(task, "integration-a", i, key="integration-a")
+    executor.submit(task, "integration-b", 0, key="integration-b")
+    await executor.stop()
+
+    # Integration b doesn't wait for all the work of integration a
+    assert executed == [("integration-a", 0), ("integration-b", 0), ("integration-a", 1), ("integration-a", 2)]
+
+
+@pytest.mark.asyncio
+async def test_background_executor_rejects_work_when_full():
+    executor = BackgroundExecutor(workers=1, max_queue_size=2)
+    await executor.start()
+    release = asyncio.Event()
+
+    async def task():
+        await release.wait()
+
+    executor.submit(task, key="integration-a")
+    await asyncio.sleep(0)  # Let the worker take the first task
+    executor.submit(task, key="integration-a")
+    executor.submit(task, key="integration-b")
+    with pytest.raises(BackgroundQueueFull):
+        executor.submit(task, key="integration-b")
+    assert executor.queue_size == 2
+    assert executor.in_progress == 1
+    release.set()
+    await executor.stop()
+
+
+@pytest.mark.asyncio
+async def test_background_executor_drains_on_stop():
+    executor = BackgroundExecutor(workers=2, max_queue_size=10)
+    await executor.start()
+    executed = []
+
+    async def task(i):
+        await asyncio.sleep(0.01)
+        executed.append(i)
+
+    for i in range(5):
+        executor.submit(task, i, key=f"integration-{i % 2}")
+    await executor.stop()
+
+    assert sorted(executed) == list(range(5))
+    assert not executor.is_running
+
+
+@pytest.mark.asyncio
+async def test_execute_action_in_background_with_full_queue(mocker, integration_v2):
+    mock_executor = mocker.MagicMock()
+    mock_executor.is_running = True
+    mock_executor.submit.side_effect = BackgroundQueueFull("The background queue is full")
+    mocker.patch("app.services.executor.background_executor", mock_executor)
+
+    response = api_client.post(
+        "/v1/actions/execute/",
+        json={
+            "integration_id": str(integration_v2.id),
+            "action_id": "pull_observations",
+            "run_in_background": True
+        }
+    )
+
+    # The caller is asked to retry later
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_run_in_background_rejects_work_while_shutting_down(mocker):
+    executor = BackgroundExecutor(workers=1, max_queue_size=10)
+    mocker.patch("app.services.executor.background_executor", executor)
+    background_tasks = mocker.MagicMock()
+    await executor.start()
+    release = asyncio.Event()
+
+    async def task():
+        await release.wait()
+
+    run_in_background(background_tasks, task, key="integration-a")
+    await asyncio.sleep(0)  # Let the worker take the first task
+    stopping = asyncio.create_task(executor.stop())
+    await asyncio.sleep(0)  # Let stop() begin
+
+    # Work isn't handed to FastAPI's background tasks during the shutdown
+    with pytest.raises(BackgroundQueueFull):
+        run_in_background(background_tasks, task, key="integration-b")
+    assert not background_tasks.add_task.called
+    release.set()
+    await stopping
+
+
+@pytest.mark.asyncio
+async def test_health_check_exposes_background_executor_stats(mocker):
+    executor = BackgroundExecutor(workers=1, max_queue_size=2)
+    mocker.patch("app.main.background_executor", executor)
+    await executor.start()
+    release = asyncio.Event()
+
+    async def task():
+        await release.wait()
+
+    executor.submit(task, key="integration-a")
+    await asyncio.sleep(0)  # Let the worker take the first task
+    executor.submit(task, key="integration-a")
+
+    response = api_client.get("/")
+
+    assert response.status_code == 200
+    assert response.json()["background_executor"] == {
+        "workers": 1,
+        "queue_size": 1,
+        "max_queue_size": 2,
+        "in_progress": 1,
+    }
+    release.set()
+    await executor.stop()
@@ -1,5 +1,13 @@
+import logging
+
+import httpx
 import pytest
-from app.services.gundi import send_events_to_gundi, send_observations_to_gundi, send_event_attachments_to_gundi
+from app.services.gundi import (
+    PooledGundiDataSenderClient,
+    send_events_to_gundi,
+    send_observations_to_gundi,
+    send_event_attachments_to_gundi,
+)
 
 
 @pytest.mark.asyncio
@@ -8,7 +16,7 @@ async def test_send_events_to_gundi(
         mock_get_gundi_api_key, integration_v2
 ):
     mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
-    mocker.patch("app.services.gundi.GundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi.PooledGundiDataSenderClient", mock_gundi_sensors_client_class)
     mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
     events = [
         {
@@ -55,7 +63,7 @@ async def test_send_event_attachments_to_gundi(
         mock_get_gundi_api_key, integration_v2
 ):
     mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
-    mocker.patch("app.services.gundi.GundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi.PooledGundiDataSenderClient", mock_gundi_sensors_client_class)
     mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
     attachments = [
         ("file1.png", b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00x\x00x\x00\x00\xff\xdb\x00C\x00\x02\x01\x01\x02'),
@@ -82,7 +90,7 @@ async def test_send_observations_to_gundi(
         mock_get_gundi_api_key, integration_v2
 ):
     mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
-    mocker.patch("app.services.gundi.GundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi.PooledGundiDataSenderClient", mock_gundi_sensors_client_class)
     mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
     observations = [
         {
@@ -121,3 +129,69 @@ async def test_send_observations_to_gundi(
     assert len(response) == 2
     assert mock_gundi_sensors_client_class.called
     mock_gundi_sensors_client_class.return_value.post_observations.assert_called_once_with(data=observations)
+
+
+@pytest.mark.asyncio
+async def test_sensors_api_client_is_reused_across_batches(
+        mocker, mock_gundi_client_v2_class, mock_gundi_sensors_client_class,
+        mock_get_gundi_api_key, integration_v2
+):
+    mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
+    mocker.patch("app.services.gundi.PooledGundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
+    observations = [
+        {
+            "source": "device-xy123",
+            "type": "tracking-device",
+            "recorded_at": "2024-01-24 09:03:00-0300",
+            "location": {"lat": -51.748, "lon": -72.720}
+        }
+    ]
+
+    for _ in range(3):
+        await send_observations_to_gundi(observations=observations, integration_id=integration_v2.id)
+
+    # The API key is retrieved and the client is created only once
+    assert mock_get_gundi_api_key.call_count == 1
+    assert mock_gundi_sensors_client_class.call_count == 1
+    assert mock_gundi_sensors_client_class.return_value.post_observations.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_pooled_sensors_api_client_sends_through_the_shared_session(caplog):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201, json={"object_id": "1"})
+
+    session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = PooledGundiDataSenderClient(
+        integration_api_key="test-api-key", session=session, sensors_api_base_url="https://sensors.test"
+    )
+    observations = [
+        {
+            "source": "device-xy123",
+            "type": "tracking-device",
+            "recorded_at": "2024-01-24 09:03:00-0300",
+            "location": {"lat": -51.748, "lon": -72.720}
+        }
+    ]
+
+    with caplog.at_level(logging.DEBUG, logger="app.services.gundi"):
+        await client.post_observations(data=observations)
+        await client.update_event(event_id="1", data={"title": "Animal Sighting"})
+
+    assert [(request.method, str(request.url)) for request in requests] == [
+        ("POST", "https://sensors.test/v2/observations/"),
+        ("PATCH", "https://sensors.test/v2/events/1/"),
+    ]
+    assert all(request.headers["apikey"] == "test-api-key" for request in requests)
+    # Requests are logged like in the gundi client
+    assert [record.getMessage() for record in caplog.records if record.name == "app.services.gundi"] == [
+        " -- Posting to routing services --",
+        " -- sending observations. --",
+        " -- Updating data... --",
+        " -- sending events/1. --",
+    ]
+    await session.aclose()
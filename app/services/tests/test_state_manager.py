@@ -1,8 +1,13 @@
+import asyncio
 import datetime
 import json
 
 import pytest
+from app import settings
+from app.conftest import async_return
 from app.services.state import IntegrationStateManager
+from app.services.config_manager import IntegrationConfigurationManager
+from app.services.redis_connections import close_connection_pools
 
 
 @pytest.mark.asyncio
@@ -150,3 +155,140 @@ async def test_delete_state_source_state(mocker, mock_redis, integration_v2, moc
     mock_redis.Redis.return_value.delete.assert_called_once_with(
         f"integration_state.{integration_id}.pull_observations.{source_id}"
     )
+
+
+@pytest.mark.asyncio
+async def test_get_states_of_many_sources(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_redis.Redis.return_value.mget.side_effect = lambda keys: async_return(
+        [json.dumps(mock_integration_state), None]
+    )
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    states = await state_manager.get_states(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        source_ids=["device-123", "device-456"]
+    )
+
+    # All states are read in one round trip
+    assert states == {"device-123": mock_integration_state, "device-456": {}}
+    mock_redis.Redis.return_value.mget.assert_called_once_with(
+        [
+            f"integration_state.{integration_id}.pull_observations.device-123",
+            f"integration_state.{integration_id}.pull_observations.device-456",
+        ]
+    )
+    assert not mock_redis.Redis.return_value.get.called
+
+
+@pytest.mark.asyncio
+async def test_set_states_of_many_sources(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    await state_manager.set_states(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        states={"device-123": mock_integration_state, "device-456": mock_integration_state}
+    )
+
+    # All states are saved in a single pipeline
+    mock_pipeline = mock_redis.Redis.return_value.pipeline.return_value
+    assert mock_redis.Redis.return_value.pipeline.call_count == 1
+    mock_pipeline.set.assert_any_call(
+        f"integration_state.{integration_id}.pull_observations.device-123",
+        json.dumps(mock_integration_state, default=str)
+    )
+    mock_pipeline.set.assert_any_call(
+        f"integration_state.{integration_id}.pull_observations.device-456",
+        json.dumps(mock_integration_state, default=str)
+    )
+    assert mock_pipeline.execute.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_set_integration_state_with_ttl(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    await state_manager.set_state(
+        integration_id=integration_id,
+        action_id="backfill_observations",
+        state=mock_integration_state,
+        source_id="backfill-1",
+        ttl=3600
+    )
+
+    mock_redis.Redis.return_value.set.assert_called_once_with(
+        f"integration_state.{integration_id}.backfill_observations.backfill-1",
+        json.dumps(mock_integration_state, default=str),
+        ex=3600
+    )
+
+
+def test_redis_connection_pool_is_shared():
+    state_manager = IntegrationStateManager()
+    other_state_manager = IntegrationStateManager()
+    config_manager = IntegrationConfigurationManager()
+
+    # Managers using the same redis db share the connection pool
+    assert state_manager.db_client.connection_pool is other_state_manager.db_client.connection_pool
+    assert state_manager.db_client.connection_pool is not config_manager.db_client.connection_pool
+
+
+@pytest.mark.asyncio
+async def test_redis_connection_pool_is_replaced_after_close():
+    state_manager = IntegrationStateManager()
+    pool = state_manager.db_client.connection_pool
+
+    await close_connection_pools()
+
+    # The manager doesn't keep using the closed pool
+    assert state_manager.db_client.connection_pool is not pool
+    assert state_manager.db_client.connection_pool is IntegrationStateManager().db_client.connection_pool
+
+
+@pytest.mark.asyncio
+async def test_lease_is_acquired_and_released(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    async with state_manager.lease(integration_id=integration_id, action_id="pull_observations") as acquired:
+        assert acquired
+
+    mock_redis.Redis.return_value.lock.assert_called_once_with(
+        f"integration_lease.{integration_id}.pull_observations.no-source", timeout=settings.ACTION_LEASE_TTL
+    )
+    assert mock_redis.Redis.return_value.lock.return_value.release.called
+
+
+@pytest.mark.asyncio
+async def test_lease_held_by_another_run(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_redis.Redis.return_value.lock.return_value.acquire.return_value = async_return(False)
+    state_manager = IntegrationStateManager()
+
+    async with state_manager.lease(
+        integration_id=str(integration_v2.id), action_id="pull_observations", source_id="device-123"
+    ) as acquired:
+        assert not acquired
+
+    assert not mock_redis.Redis.return_value.lock.return_value.release.called
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_while_held(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_lock = mock_redis.Redis.return_value.lock.return_value
+    mock_lock.reacquire.side_effect = lambda: async_return(True)
+    state_manager = IntegrationStateManager()
+
+    async with state_manager.lease(integration_id=str(integration_v2.id), action_id="pull_observations", ttl=0.03):
+        await asyncio.sleep(0.05)
+
+    assert mock_lock.reacquire.called
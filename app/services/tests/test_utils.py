@@ -0,0 +1,127 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from enum import Enum
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app.services.utils import StructHexString, StructHexDecoder, TTLCache, get_struct_hex_decoder, to_primitive
+from app.webhooks.core import GenericJsonWithHexStrPayload
+
+
+@pytest.fixture
+def collar_hex_format():
+    return {
+        "byte_order": ">",
+        "fields": [
+            {"name": "start_bit", "format": "B", "output_type": "int"},
+            {"name": "v", "format": "I"},
+            {"name": "status", "format": "H", "output_type": "hex", "bit_fields": [
+                {"name": "gps_fix", "start_bit": 0, "end_bit": 0},
+                {"name": "battery", "start_bit": 1, "end_bit": 4, "output_type": "int"},
+            ]},
+        ]
+    }
+
+
+def test_struct_hex_string_decodes_fields_and_bit_fields(collar_hex_format):
+    hex_string = StructHexString.validate("01000000ff001b", {"hex_format": collar_hex_format}, None)
+
+    assert hex_string.format_spec == ">BIH"
+    assert hex_string.unpacked_data == {
+        "start_bit": 1, "v": 255, "status": "0x1b", "gps_fix": True, "battery": 13
+    }
+    assert jsonable_encoder(hex_string) == {
+        "value": "01000000ff001b",
+        "hex_format": collar_hex_format,
+        "format_spec": ">BIH",
+        "unpacked_data": hex_string.unpacked_data
+    }
+
+
+def test_struct_hex_string_rejects_wrong_length(collar_hex_format):
+    with pytest.raises(ValueError, match="expected length"):
+        StructHexString.validate("01000000ff", {"hex_format": collar_hex_format}, None)
+
+
+def test_struct_hex_decoder_is_compiled_once_per_format(mocker, collar_hex_format):
+    mocker.patch("app.services.utils._struct_hex_decoders", TTLCache(maxsize=10))
+
+    decoder = get_struct_hex_decoder(collar_hex_format)
+
+    assert get_struct_hex_decoder(collar_hex_format) is decoder
+    # Equal formats share the decoder, regardless of the order of their keys
+    assert get_struct_hex_decoder(dict(reversed(list(collar_hex_format.items())))) is decoder
+
+
+def test_struct_hex_decoder_is_found_by_format_identity(mocker, collar_hex_format):
+    decoder = get_struct_hex_decoder(collar_hex_format)
+    dumps_spy = mocker.spy(json, "dumps")
+
+    # The hex values of a payload share its format dict, so it isn't serialized for each one
+    for _ in range(3):
+        assert get_struct_hex_decoder(collar_hex_format) is decoder
+    assert not dumps_spy.called
+
+
+def test_struct_hex_decoder_follows_changes_in_the_format(mocker, collar_hex_format):
+    mocker.patch("app.services.utils._struct_hex_decoders", TTLCache(maxsize=10))
+    decoder = get_struct_hex_decoder(collar_hex_format)
+
+    collar_hex_format["byte_order"] = "<"
+
+    assert get_struct_hex_decoder(collar_hex_format).format_spec == "<BIH"
+    assert decoder.format_spec == ">BIH"
+
+
+@pytest.mark.parametrize("byte_order", [">", "@"])  # Native alignment isn't supported by numpy, so it's decoded with struct
+def test_struct_hex_decoder_bulk_decoding_matches_one_by_one(collar_hex_format, byte_order):
+    decoder = StructHexDecoder({**collar_hex_format, "byte_order": byte_order})
+    hex_strings = [bytes((i * k) % 256 for k in range(decoder.struct.size)).hex() for i in range(50)]
+
+    decoded = decoder.decode_many(hex_strings)
+
+    assert (decoder.dtype is not None) == (byte_order == ">")
+    assert decoded == [decoder.decode(hex_string) for hex_string in hex_strings]
+    assert decoder.decode_columns(hex_strings)["battery"] == [row["battery"] for row in decoded]
+    assert [s.unpacked_data for s in StructHexString.validate_many(hex_strings, decoder.hex_format)] == decoded
+
+
+class MockDeviceStatus(str, Enum):
+    ACTIVE = "active"
+
+
+class MockLocation(BaseModel):
+    lat: float
+    lon: float
+
+
+class MockHexPayload(GenericJsonWithHexStrPayload):
+    device_id: uuid.UUID
+    received_at: datetime
+    status: MockDeviceStatus
+    location: MockLocation
+    tags: set[str]
+    counters: dict[int, int]
+    hex_data: StructHexString
+
+
+def test_to_primitive_matches_json_round_trip(collar_hex_format):
+    payload = MockHexPayload.parse_obj({
+        "hex_format": collar_hex_format,
+        "hex_data_field": "hex_data",
+        "device_id": str(uuid.uuid4()),
+        "received_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "status": "active",
+        "location": {"lat": 1.5, "lon": -2.5},
+        "tags": ["collar"],
+        "counters": {1: 10},
+        "hex_data": "01000000ff001b",
+        "extra_field": [{"nested": None}],
+    })
+
+    assert to_primitive([payload]) == [json.loads(payload.json())]
+    assert payload.dict() == json.loads(payload.json())
+    assert to_primitive(payload)["hex_data"]["unpacked_data"]["battery"] == 13
@@ -2,24 +2,29 @@ import base64
 import json
 from unittest.mock import ANY
 
+import pyjq
 import pytest
 from fastapi.testclient import TestClient
 
 from app.conftest import MockWebhookPayloadModel, MockWebhookConfigModel
 from app.main import app
+from app.services.utils import StructHexDecoder, TTLCache
 from app.webhooks import GenericJsonTransformConfig
+from app.webhooks.core import (
+    GenericJsonTransformWithHexStrConfig, GenericJsonWithHexStrPayload, run_jq, run_jq_batch
+)
 
 api_client = TestClient(app)
 
 
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_fixed_schema(
-        mocker, integration_v2_with_webhook, mock_gundi_client_v2_for_webhooks, mock_publish_event,
+        mocker, integration_v2_with_webhook, mock_config_manager_for_webhooks, mock_publish_event,
         mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_fixed_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks)
 
     response = api_client.post(
         "/webhooks",
@@ -28,7 +33,7 @@ async def test_process_webhook_request_with_fixed_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks.get_integration_details.called
+    assert mock_config_manager_for_webhooks.get_integration_details.called
     assert mock_get_webhook_handler_for_fixed_json_payload.called
     expected_payload = MockWebhookPayloadModel.parse_obj(mock_webhook_request_payload_for_fixed_schema)
     expected_config = MockWebhookConfigModel.parse_obj(integration_v2_with_webhook.webhook_configuration.data)
@@ -41,12 +46,12 @@ async def test_process_webhook_request_with_fixed_schema(
 
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_dynamic_schema(
-        mocker, integration_v2_with_webhook_generic, mock_gundi_client_v2_for_webhooks_generic, mock_publish_event,
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
         mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks_generic)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
 
     response = api_client.post(
         "/webhooks",
@@ -55,7 +60,7 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks_generic.get_integration_details.called
+    assert mock_config_manager_for_webhooks_generic.get_integration_details.called
     assert mock_get_webhook_handler_for_generic_json_payload.called
     expected_config = GenericJsonTransformConfig.parse_obj(integration_v2_with_webhook_generic.webhook_configuration.data)
     mock_webhook_handler.assert_called_once_with(
@@ -65,3 +70,93 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
 
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_dynamic_schema_reuses_model(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    dynamic_models = TTLCache(maxsize=10)
+    mocker.patch("app.services.utils._dynamic_models", dynamic_models)
+
+    for _ in range(2):
+        response = api_client.post(
+            "/webhooks",
+            headers=mock_webhook_request_headers_onyesha,
+            json=mock_webhook_request_payload_for_dynamic_schema,
+        )
+        assert response.status_code == 200
+
+    # The model is built from the schema in the first request only
+    assert (dynamic_models.hits, dynamic_models.misses, len(dynamic_models)) == (1, 1, 1)
+    # The cache stats are exposed in the health check
+    assert api_client.get("/").json()["dynamic_models"] == {"size": 1, "max_size": 10, "hits": 1, "misses": 1}
+    assert mock_webhook_handler.call_count == 2
+    first_call, second_call = mock_webhook_handler.call_args_list
+    assert first_call.kwargs["payload"] == second_call.kwargs["payload"]
+
+
+def test_jq_programs_are_compiled_once(mocker):
+    mocker.patch("app.webhooks.core._jq_programs", TTLCache(maxsize=10))
+    compile_spy = mocker.spy(pyjq, "compile")
+
+    for i in range(3):
+        assert run_jq("{source: .id}", {"id": i}) == [{"source": i}]
+
+    compile_spy.assert_called_once_with("{source: .id}")
+
+
+def test_run_jq_batch_applies_the_filter_to_each_item(mocker):
+    mocker.patch("app.webhooks.core._jq_programs", TTLCache(maxsize=10))
+    items = [{"id": 1, "active": True}, {"id": 2, "active": False}, {"id": 3, "active": True}]
+
+    # Same results as filtering the list as a whole
+    assert run_jq_batch("select(.active) | {source: .id}", items) == [{"source": 1}, {"source": 3}]
+    assert run_jq("map(select(.active) | {source: .id})", items) == [[{"source": 1}, {"source": 3}]]
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_hex_strings_list_decodes_in_bulk(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
+        mock_webhook_handler, mock_webhook_request_headers_onyesha
+):
+    mock_get_webhook_handler = mocker.MagicMock(
+        return_value=(mock_webhook_handler, GenericJsonWithHexStrPayload, GenericJsonTransformWithHexStrConfig)
+    )
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    hex_format = {
+        "byte_order": ">",
+        "fields": [
+            {"name": "status", "format": "B", "output_type": "int"},
+            {"name": "battery", "format": "H", "output_type": "int"},
+        ]
+    }
+    integration_v2_with_webhook_generic.webhook_configuration.data = {
+        "jq_filter": ".",
+        "output_type": "obv",
+        "hex_format": hex_format,
+        "hex_data_field": "data",
+        "json_schema": {
+            "type": "object",
+            "properties": {"device": {"type": "string"}, "data": {"type": "hex_string"}},
+        },
+    }
+    decode_many = mocker.spy(StructHexDecoder, "decode_many")
+    decode = mocker.spy(StructHexDecoder, "decode")
+
+    response = api_client.post(
+        "/webhooks",
+        headers=mock_webhook_request_headers_onyesha,
+        json=[{"device": "lt10-1234", "data": "010E10"}, {"device": "lt10-5678", "data": "0007D0"}],
+    )
+
+    assert response.status_code == 200
+    assert decode_many.call_count == 1
+    assert not decode.called
+    payload = mock_webhook_handler.call_args.kwargs["payload"]
+    assert [item.data.unpacked_data for item in payload] == [
+        {"status": 1, "battery": 3600}, {"status": 0, "battery": 2000}
+    ]
@@ -1,8 +1,21 @@
+import contextvars
+import copy
+import hashlib
+import json
+import logging
 import struct
+import time
 import typing
+from collections import OrderedDict
+import numpy as np
 from pydantic import create_model, BaseModel
+from pydantic.json import pydantic_encoder
 from pydantic.fields import Field, FieldInfo, Undefined, NoArgAnyCallable
 from typing import Any, Dict, Optional, Union, List, Annotated
+from app import settings
+
+
+logger = logging.getLogger(__name__)
 
 
 def find_config_for_action(configurations, action_id):
@@ -15,12 +28,197 @@ def find_config_for_action(configurations, action_id):
     )
 
 
+class TTLCache:
+    """
+    Bounded in-memory cache. Entries expire after `ttl` seconds (never if ttl is None)
+    and the least recently used entries are evicted once `maxsize` is reached.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        expires_at, value = self._data.pop(key, (None, default))
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self) -> list:
+        return list(self._data.keys())
+
+    @property
+    def stats(self) -> dict:
+        return {"size": len(self._data), "max_size": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+    def __contains__(self, key):
+        return self.get(key, default=self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Numpy types of the struct format characters with a fixed size (standard sizes)
+_NUMPY_STRUCT_TYPES = {
+    "b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4", "I": "u4", "l": "i4", "L": "u4",
+    "q": "i8", "Q": "u8", "e": "f2", "f": "f4", "d": "f8",
+}
+
+
+def _cast_output(value, output_type="hex"):
+    if output_type == "bool":
+        return bool(value)
+    elif output_type == "int":
+        return int(value)
+    else:  # hex string by default
+        return hex(value)
+
+
+def _cast_output_column(column: np.ndarray, output_type="hex") -> list:
+    if output_type == "bool":
+        return (column != 0).tolist()
+    elif output_type == "int" and column.dtype.kind in "iu":
+        return column.tolist()
+    return [_cast_output(value, output_type) for value in column.tolist()]
+
+
+class StructHexDecoder:
+    """
+    Decodes hex strings with a hex format. The struct, bit masks and field positions are computed once,
+    so use get_struct_hex_decoder() to reuse the decoder of each format.
+    """
+
+    def __init__(self, hex_format: dict):
+        self.hex_format = hex_format
+        fields = hex_format["fields"]
+        byte_order = hex_format.get("byte_order", "<")
+        self.format_spec = byte_order + ''.join(f["format"] for f in fields)
+        self.struct = struct.Struct(self.format_spec)
+        self._fields = [(f["name"], f.get("output_type", "int")) for f in fields]
+        # (name, index of the field, start bit, mask, output type)
+        self._bit_fields = [
+            (
+                bit_field["name"],
+                index,
+                bit_field["start_bit"],
+                2 ** (bit_field["end_bit"] - bit_field["start_bit"] + 1) - 1,
+                bit_field.get("output_type", "bool")
+            )
+            for index, f in enumerate(fields) for bit_field in f.get("bit_fields", [])
+        ]
+        self.field_names = [name for name, _ in self._fields] + [name for name, *_ in self._bit_fields]
+        # Structured dtype for bulk decoding, if all the fields map to a numpy type
+        self.dtype = None
+        numpy_byte_order = {"<": "<", ">": ">", "!": ">"}.get(byte_order)
+        if numpy_byte_order and all(f["format"] in _NUMPY_STRUCT_TYPES for f in fields):
+            self.dtype = np.dtype([
+                (f"f{index}", numpy_byte_order + _NUMPY_STRUCT_TYPES[f["format"]])
+                for index, f in enumerate(fields)
+            ])
+
+    def _to_bytes(self, value: str) -> bytes:
+        try:
+            bytes_data = bytes.fromhex(value)
+            if len(bytes_data) != self.struct.size:
+                raise ValueError("Hex string does not match the expected length for format")
+        except (ValueError, struct.error) as e:
+            raise ValueError(f"Invalid hex string for format '{self.format_spec}': {str(e)}")
+        return bytes_data
+
+    def _decode_values(self, values: tuple) -> dict:
+        decoded = {
+            name: _cast_output(value=value, output_type=output_type)
+            for (name, output_type), value in zip(self._fields, values)
+        }
+        for name, index, start_bit, mask, output_type in self._bit_fields:
+            decoded[name] = _cast_output(value=(values[index] >> start_bit) & mask, output_type=output_type)
+        return decoded
+
+    def decode(self, value: str) -> dict:
+        """Decodes a hex string. Raises ValueError if it doesn't match the format."""
+        return self._decode_values(self.struct.unpack(self._to_bytes(value)))
+
+    def decode_columns(self, values: list) -> dict:
+        """
+        Decodes a list of hex strings at once, with numpy when the format allows it.
+        Returns the decoded values as columns: a list of values per field name.
+        """
+        data = b"".join(self._to_bytes(value) for value in values)
+        if self.dtype is None:
+            rows = [self._decode_values(row) for row in self.struct.iter_unpack(data)]
+            return {name: [row[name] for row in rows] for name in self.field_names}
+        array = np.frombuffer(data, dtype=self.dtype)
+        columns = {
+            name: _cast_output_column(array[f"f{index}"], output_type)
+            for index, (name, output_type) in enumerate(self._fields)
+        }
+        for name, index, start_bit, mask, output_type in self._bit_fields:
+            columns[name] = _cast_output_column((array[f"f{index}"] >> start_bit) & mask, output_type)
+        return columns
+
+    def decode_many(self, values: list) -> list:
+        """Decodes a list of hex strings at once. Returns a dict of decoded values per string, like decode()"""
+        if self.dtype is None:
+            data = b"".join(self._to_bytes(value) for value in values)
+            return [self._decode_values(row) for row in self.struct.iter_unpack(data)]
+        columns = self.decode_columns(values)
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+# Decoders by hex format content, so equal formats share a decoder
+_struct_hex_decoders = TTLCache(maxsize=settings.HEX_DECODERS_CACHE_SIZE)
+# Decoders by id() of the format dicts seen last, so the hex values of a payload, which share its format dict,
+# don't serialize the format each. Entries hold the dict, so its id isn't reused, and a copy to detect changes
+_struct_hex_decoders_by_id = TTLCache(maxsize=settings.HEX_DECODERS_CACHE_SIZE)
+
+
+def get_struct_hex_decoder(hex_format: dict) -> StructHexDecoder:
+    """Returns the decoder for the hex format, compiled only the first time it's requested"""
+    if (entry := _struct_hex_decoders_by_id.get(id(hex_format))) is not None:
+        _, format_copy, decoder = entry
+        if format_copy == hex_format:
+            return decoder
+    key = json.dumps(hex_format, sort_keys=True)
+    if (decoder := _struct_hex_decoders.get(key)) is None:
+        decoder = StructHexDecoder(hex_format)
+        _struct_hex_decoders.set(key, decoder)
+    _struct_hex_decoders_by_id.set(id(hex_format), (hex_format, copy.deepcopy(hex_format), decoder))
+    return decoder
+
+
 class StructHexString:
-    def __init__(self, value: str, hex_format):
+    def __init__(self, value: str, hex_format, unpacked_data: dict = None):
         self.value = value
         self.hex_format = hex_format
-        self.format_spec = hex_format.get("byte_order", "<") + ''.join(f["format"] for f in hex_format["fields"])
-        self.unpacked_data = self._unpack_data()
+        decoder = get_struct_hex_decoder(hex_format)
+        self.format_spec = decoder.format_spec
+        self.unpacked_data = unpacked_data if unpacked_data is not None else decoder.decode(value)
 
     @classmethod
     def __get_validators__(cls):
@@ -28,47 +226,21 @@ class StructHexString:
 
     @classmethod
     def validate(cls, v: str, values, field):
+        if isinstance(v, cls):  # Decoded already, e.g. in bulk with validate_many()
+            return v
         hex_format = values['hex_format']  # Assumes format is already set in the parent model
-        format_spec = hex_format.get("byte_order", "<") + ''.join(d["format"] for d in hex_format["fields"])
-        try:
-            bytes_data = bytes.fromhex(v)
-            if len(bytes_data) != struct.calcsize(format_spec):
-                raise ValueError("Hex string does not match the expected length for format")
-        except (ValueError, struct.error) as e:
-            raise ValueError(f"Invalid hex string for format '{format_spec}': {str(e)}")
-
         return cls(v, hex_format)
 
+    @classmethod
+    def validate_many(cls, values: list, hex_format: dict) -> list:
+        """Decodes many hex strings with the same format at once. Faster than validating them one by one."""
+        unpacked = get_struct_hex_decoder(hex_format).decode_many(values)
+        return [cls(v, hex_format, unpacked_data=data) for v, data in zip(values, unpacked)]
+
     @classmethod
     def __modify_schema__(cls, field_schema):
         field_schema.update(type="hex_string", example="123456789ABCDEF", description="Hex string data")
 
-    def _unpack_data(self):
-        field_values = []
-        unpacked_fields = struct.unpack(self.format_spec, bytes.fromhex(self.value))
-        for s, v in zip(self.hex_format["fields"], unpacked_fields):
-            field_values.append(self._cast_output(value=v, output_type=s.get("output_type", "int")))
-        field_names = [f["name"] for f in self.hex_format["fields"]]
-        fields_with_bitfields = [f for f in self.hex_format["fields"] if "bit_fields" in f]
-        for field in fields_with_bitfields:
-            bit_fields = field["bit_fields"]
-            for bit_field in bit_fields:
-                start_bit = bit_field["start_bit"]
-                end_bit = bit_field["end_bit"]
-                field_value = unpacked_fields[field_names.index(field["name"])]
-                bits_value = (field_value >> start_bit) & (2 ** (end_bit - start_bit + 1) - 1)
-                field_values.append(self._cast_output(value=bits_value, output_type=bit_field.get("output_type", "bool")))
-                field_names.append(bit_field["name"])
-        return dict(zip(field_names, field_values))
-
-    def _cast_output(self, value, output_type="hex"):
-        if output_type == "bool":
-            return bool(value)
-        elif output_type == "int":
-            return int(value)
-        else:  # hex string by default
-            return hex(value)
-
     def __repr__(self) -> str:
         return f"StructHexString(value={self.value}, hex_format={self.hex_format})"
 
@@ -80,6 +252,32 @@ class StructHexString:
         }
 
 
+_PRIMITIVE_TYPES = {str, int, float, bool, type(None)}
+
+
+def to_primitive(value):
+    """
+    Converts a value, like a pydantic model or a list of them, into JSON-compatible python values.
+    Equivalent to json.loads(model.json()), without serializing to text and parsing it back.
+    """
+    # Primitive items are checked inline, saving a call per item
+    if type(value) in _PRIMITIVE_TYPES:
+        return value
+    if isinstance(value, dict):  # Non-string keys are converted as in JSON, e.g. None -> "null"
+        return {
+            key if isinstance(key, str) else json.dumps(key):
+                item if type(item) in _PRIMITIVE_TYPES else to_primitive(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [item if type(item) in _PRIMITIVE_TYPES else to_primitive(item) for item in value]
+    if isinstance(value, BaseModel):  # Like model.json(), overrides of dict() aren't used
+        return to_primitive(BaseModel.dict(value))
+    if isinstance(value, StructHexString):
+        return to_primitive(vars(value))
+    # Models, datetimes, UUIDs, enums, etc. Raises TypeError for values that can't be serialized to JSON
+    return to_primitive(pydantic_encoder(value))
+
 Model = typing.TypeVar('Model', bound='BaseModel')
 
 
@@ -167,6 +365,36 @@ class DyntamicFactory:
             )
 
 
+# Models built by DyntamicFactory, by schema. Building a model is much slower than validating data with it
+_dynamic_models = TTLCache(maxsize=settings.WEBHOOK_MODELS_CACHE_SIZE)
+
+
+def _get_dynamic_model_key(json_schema: dict, base_model, ref_template: str) -> tuple:
+    # Equal schemas get the same hash regardless of the order of their keys
+    schema_hash = hashlib.sha256(json.dumps(json_schema, sort_keys=True, default=str).encode()).hexdigest()
+    return schema_hash, base_model, ref_template
+
+
+def get_dynamic_model(
+        json_schema: dict,
+        base_model: type[Model] | tuple[type[Model], ...] | None = None,
+        ref_template: str = "#/$defs/"
+) -> Model:
+    """Returns a pydantic model for the JSON schema, made with DyntamicFactory only the first time it's requested"""
+    key = _get_dynamic_model_key(json_schema, base_model, ref_template)
+    if (model := _dynamic_models.get(key)) is None:
+        model = DyntamicFactory(json_schema=json_schema, base_model=base_model, ref_template=ref_template).make()
+        _dynamic_models.set(key, model)
+        # Models are created rarely, unless the cache is too small for the schemas in use
+        logger.info(f"Dynamic model '{model.__name__}' created. Models cache: {_dynamic_models.stats}")
+    return model
+
+
+def get_dynamic_models_stats() -> dict:
+    """Size, hits and misses of the cache of dynamic models. Exposed in the health check."""
+    return _dynamic_models.stats
+
+
 class GlobalUISchemaOptions(BaseModel):
     order: Optional[List[str]]
     addable: Optional[bool]
@@ -402,3 +630,26 @@ def generate_batches(iterable, batch_size):
     for i in range(0, len(iterable), batch_size):
         yield iterable[i: i + batch_size]
 
+
+# Deadline (time.monotonic()) of the action being executed in the current context
+_action_deadline = contextvars.ContextVar("action_deadline", default=None)
+
+
+def set_action_deadline(timeout: float) -> contextvars.Token:
+    """Sets the deadline of the action in the current context. Nested actions never extend the deadline."""
+    deadline = time.monotonic() + timeout
+    if (current_deadline := _action_deadline.get()) is not None:
+        deadline = min(deadline, current_deadline)
+    return _action_deadline.set(deadline)
+
+
+def reset_action_deadline(token: contextvars.Token):
+    _action_deadline.reset(token)
+
+
+def get_remaining_time() -> Optional[float]:
+    """Returns the seconds left to finish the action in the current context, or None if it has no deadline."""
+    if (deadline := _action_deadline.get()) is None:
+        return None
+    return deadline - time.monotonic()
+
@@ -1,14 +1,15 @@
 import importlib
 import logging
+from collections import defaultdict
 from fastapi import Request
 from app import settings
 from app.services.activity_logger import log_activity, publish_event
-from gundi_client_v2 import GundiClient
 from gundi_core.events import IntegrationWebhookFailed, WebhookExecutionFailed
-from app.services.utils import DyntamicFactory
+from app.services.config_manager import IntegrationConfigurationManager
+from app.services.utils import StructHexString, get_dynamic_model
 from app.webhooks.core import get_webhook_handler, DynamicSchemaConfig, HexStringConfig, GenericJsonPayload
 
-_portal = GundiClient()
+config_manager = IntegrationConfigurationManager()
 logger = logging.getLogger(__name__)
 
 
@@ -19,12 +20,35 @@ async def get_integration(request):
     integration_id = consumer_integration or request.headers.get("x-gundi-integration-id") or request.query_params.get("integration_id")
     if integration_id:
         try:
-            integration = await _portal.get_integration_details(integration_id=integration_id)
+            # Served from the cache, which is reloaded from the portal only when needed
+            integration = await config_manager.get_integration_details(
+                integration_id=integration_id, include_webhook_configuration=True
+            )
         except Exception as e:
-            logger.warning(f"Error retrieving integration '{integration_id}' from the portal: {e}")
+            logger.warning(f"Error retrieving integration '{integration_id}': {e}")
     return integration
 
 
+def _decode_hex_strings(items: list, payload_model):
+    """
+    Decodes the hex strings of a list payload in bulk, grouped by hex format, and puts the decoded values
+    in place of the raw strings so parsing each item doesn't decode them one by one.
+    """
+    items_by_format = defaultdict(list)
+    for item in items:
+        field = payload_model.__fields__.get(item["hex_data_field"])
+        if field and field.type_ is StructHexString and isinstance(item.get(field.name), str):
+            items_by_format[(id(item["hex_format"]), field.name)].append(item)
+    for (_, field_name), format_items in items_by_format.items():
+        hex_format = format_items[0]["hex_format"]
+        try:
+            decoded = StructHexString.validate_many([item[field_name] for item in format_items], hex_format)
+        except ValueError:  # Leave them to be validated one by one, so errors point to the invalid items
+            continue
+        for item, value in zip(format_items, decoded):
+            item[field_name] = value
+
+
 async def process_webhook(request: Request):
     try:
         # Try to relate the request to an integration
@@ -36,20 +60,22 @@ async def process_webhook(request: Request):
         webhook_config_data = integration.webhook_configuration.data if integration and integration.webhook_configuration else {}
         parsed_config = config_model.parse_obj(webhook_config_data) if config_model else {}
         if parsed_config and issubclass(config_model, HexStringConfig):
-            json_content["hex_data_field"] = json_content.get("hex_data_field", parsed_config.hex_data_field)
-            json_content["hex_format"] = json_content.get("hex_format", parsed_config.hex_format)
+            for item in (json_content if isinstance(json_content, list) else [json_content]):
+                item.setdefault("hex_data_field", parsed_config.hex_data_field)
+                item.setdefault("hex_format", parsed_config.hex_format)
         # Parse payload if a model was defined in webhooks/configurations.py
         if payload_model:
             try:
                 if issubclass(payload_model, GenericJsonPayload) and issubclass(config_model, DynamicSchemaConfig):
-                    # Build the model from a json schema
-                    model_factory = DyntamicFactory(
+                    # Build the model from a json schema, or reuse the one built for a previous request
+                    dynamic_payload_model = get_dynamic_model(
                         json_schema=parsed_config.json_schema,
                         base_model=payload_model,
                         ref_template="definitions"
                     )
-                    dynamic_payload_model = model_factory.make()
                     if isinstance(json_content, list):
+                        if issubclass(config_model, HexStringConfig):
+                            _decode_hex_strings(json_content, dynamic_payload_model)
                         parsed_payload = [dynamic_payload_model.parse_obj(d) for d in json_content]
                     else:
                         parsed_payload = dynamic_payload_model.parse_obj(json_content)
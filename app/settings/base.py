@@ -40,6 +40,9 @@ PORTAL_INBOUND_INTEGRATIONS_ENDPOINT = (
 GUNDI_API_BASE_URL = env.str("GUNDI_API_BASE_URL", None)
 GUNDI_API_SSL_VERIFY = env.bool("GUNDI_API_SSL_VERIFY", True)
 SENSORS_API_BASE_URL = env.str("SENSORS_API_BASE_URL", None)
+SENSORS_API_MAX_CONNECTIONS = env.int("SENSORS_API_MAX_CONNECTIONS", 50)
+SENSORS_API_CLIENTS_CACHE_SIZE = env.int("SENSORS_API_CLIENTS_CACHE_SIZE", 256)
+SENSORS_API_CLIENTS_CACHE_TTL = env.int("SENSORS_API_CLIENTS_CACHE_TTL", 60 * 60)  # Seconds
 
 # Used in OTel traces/spans to set the 'environment' attribute, used on metrics calculation
 TRACE_ENVIRONMENT = env.str("TRACE_ENVIRONMENT", "dev")
@@ -60,6 +63,21 @@ REDIS_HOST = env.str("REDIS_HOST", "localhost")
 REDIS_PORT = env.int("REDIS_PORT", 6379)
 REDIS_STATE_DB = env.int("REDIS_STATE_DB", 0)
 REDIS_CONFIGS_DB = env.int("REDIS_CONFIGS_DB", 1)  # ToDo: define a convention for DB numbers across services
+# Connections are shared by all the managers in the process, per redis db
+REDIS_MAX_CONNECTIONS = env.int("REDIS_MAX_CONNECTIONS", 50)  # Per db
+REDIS_POOL_TIMEOUT = env.int("REDIS_POOL_TIMEOUT", 20)  # Seconds waiting for a free connection
+REDIS_HEALTH_CHECK_INTERVAL = env.int("REDIS_HEALTH_CHECK_INTERVAL", 30)  # Seconds
+# In-process cache for configurations. Config events from other replicas only expire after the TTL
+CONFIGS_LOCAL_CACHE_SIZE = env.int("CONFIGS_LOCAL_CACHE_SIZE", 1000)
+CONFIGS_LOCAL_CACHE_TTL = env.int("CONFIGS_LOCAL_CACHE_TTL", 60)  # Seconds
+# Max time a replica holds the lock to reload an integration from Gundi, and others wait for it
+CONFIGS_RELOAD_LOCK_TIMEOUT = env.int("CONFIGS_RELOAD_LOCK_TIMEOUT", 30)  # Seconds
+# How long to remember that an action has no configuration, before asking Gundi again
+CONFIGS_NEGATIVE_CACHE_TTL = env.int("CONFIGS_NEGATIVE_CACHE_TTL", 300)  # Seconds
+# Webhook configurations have no config events of their own, so they are also reloaded from Gundi after this time
+WEBHOOK_CONFIGS_CACHE_TTL = env.int("WEBHOOK_CONFIGS_CACHE_TTL", 60 * 60)  # Seconds
+# Leases prevent overlapping runs of an action. They are renewed while held and expire if the holder dies
+ACTION_LEASE_TTL = env.int("ACTION_LEASE_TTL", 60)  # Seconds
 
 
 REGISTER_ON_START = env.bool("REGISTER_ON_START", False)
@@ -67,10 +85,33 @@ INTEGRATION_TYPE_SLUG = env.str("INTEGRATION_TYPE_SLUG", None)  # Define a strin
 INTEGRATION_SERVICE_URL = env.str("INTEGRATION_SERVICE_URL", None)  # Define a string id here e.g. "my_tracker"
 PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND = env.bool("PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND", False)
 PROCESS_WEBHOOKS_IN_BACKGROUND = env.bool("PROCESS_WEBHOOKS_IN_BACKGROUND", True)
+# Max number of pydantic models built from webhook JSON schemas kept in memory, for reuse across requests
+WEBHOOK_MODELS_CACHE_SIZE = env.int("WEBHOOK_MODELS_CACHE_SIZE", 128)
+# Max number of compiled JQ programs kept in memory, for reuse across webhook requests
+JQ_PROGRAMS_CACHE_SIZE = env.int("JQ_PROGRAMS_CACHE_SIZE", 128)
+# Max number of compiled hex string decoders (one per hex format) kept in memory
+HEX_DECODERS_CACHE_SIZE = env.int("HEX_DECODERS_CACHE_SIZE", 128)
+# Redeliveries of a PubSub message within this time are acknowledged without running the action again. 0 disables it
+PUBSUB_DEDUP_TTL = env.int("PUBSUB_DEDUP_TTL", 3600)  # Seconds
+# Redeliveries of a message still being processed are retried later, until the original delivery finishes or this expires
+PUBSUB_DEDUP_IN_PROGRESS_TTL = env.int("PUBSUB_DEDUP_IN_PROGRESS_TTL", 600)  # Seconds. The max PubSub ack deadline
+# Actions executed in the background run in a fixed number of workers. Requests are rejected (503) when the queue is full
+BACKGROUND_WORKERS = env.int("BACKGROUND_WORKERS", 10)
+BACKGROUND_QUEUE_SIZE = env.int("BACKGROUND_QUEUE_SIZE", 100)
+BACKGROUND_SHUTDOWN_TIMEOUT = env.int("BACKGROUND_SHUTDOWN_TIMEOUT", 60)  # Seconds to finish pending work on shutdown
 MAX_ACTION_EXECUTION_TIME = env.int("MAX_ACTION_EXECUTION_TIME", 60 * 9)  # 10 minutes is the maximum ack timeout
+# Time reserved at the end of an action to save progress and schedule the remaining work as a new action
+ACTION_TIME_BUDGET_MARGIN = env.int("ACTION_TIME_BUDGET_MARGIN", 60)  # Seconds
 
 # Settings for system events & commands (EDA)
 INTEGRATION_EVENTS_TOPIC = env.str("INTEGRATION_EVENTS_TOPIC", "integration-events")
 default_commands_topic = f"{INTEGRATION_TYPE_SLUG}-actions-topic" if INTEGRATION_TYPE_SLUG else None
 INTEGRATION_COMMANDS_TOPIC = env.str("INTEGRATION_COMMANDS_TOPIC", default_commands_topic)
 TRIGGER_ACTIONS_ALWAYS_SYNC = env.bool("TRIGGER_ACTIONS_ALWAYS_SYNC", False)
+# Events are buffered per topic and published in batches when any of these limits is reached
+PUBSUB_PUBLISH_MAX_BATCH_SIZE = env.int("PUBSUB_PUBLISH_MAX_BATCH_SIZE", 100)  # Messages. PubSub allows up to 1000
+PUBSUB_PUBLISH_MAX_BATCH_BYTES = env.int("PUBSUB_PUBLISH_MAX_BATCH_BYTES", 1024 * 1024)
+PUBSUB_PUBLISH_MAX_LATENCY = env.float("PUBSUB_PUBLISH_MAX_LATENCY", 0.05)  # Seconds
+# PubSub limits for a single publish request
+PUBSUB_MAX_MESSAGES_PER_REQUEST = env.int("PUBSUB_MAX_MESSAGES_PER_REQUEST", 1000)
+PUBSUB_MAX_REQUEST_BYTES = env.int("PUBSUB_MAX_REQUEST_BYTES", 9 * 1024 * 1024)  # 10MB max, with some margin
@@ -1,3 +1,28 @@
+from .base import env
+
 # Add your integration-specific settings here
 DEVICES_BATCH_SIZE=2
-OBSERVATIONS_BATCH_SIZE=2
\ No newline at end of file
+OBSERVATIONS_BATCH_SIZE=2
+# Max number of devices pulled concurrently within a device batch sub-action
+DEVICES_MAX_CONCURRENCY = env.int("DEVICES_MAX_CONCURRENCY", 5)
+# Fetch positions of all the devices in one request per time window, and pull all the devices in one sub-action
+PULL_FLEET_WIDE_FETCH = env.bool("PULL_FLEET_WIDE_FETCH", False)
+# Max number of items (position windows or observation batches) buffered between pull pipeline stages
+PIPELINE_QUEUE_SIZE = env.int("PIPELINE_QUEUE_SIZE", 2)
+# Max days of positions pulled for a device that is behind. Older positions are skipped
+PULL_MAX_LOOKBACK_DAYS = env.int("PULL_MAX_LOOKBACK_DAYS", 7)
+# Time windows requested to Onyesha are sized to have about WINDOW_TARGET_POSITIONS positions each,
+# based on the density seen in the last run, and several windows of a device are fetched at the same time
+WINDOW_TARGET_POSITIONS = env.int("WINDOW_TARGET_POSITIONS", 500)
+WINDOW_MIN_HOURS = env.int("WINDOW_MIN_HOURS", 1)
+WINDOW_MAX_DAYS = env.int("WINDOW_MAX_DAYS", 7)
+WINDOWS_MAX_CONCURRENCY = env.int("WINDOWS_MAX_CONCURRENCY", 3)
+# Backfills are split in shards pulled by chained sub-actions, and run with their own, lower, throughput limits
+BACKFILL_SHARD_DAYS = env.int("BACKFILL_SHARD_DAYS", 7)
+BACKFILL_MAX_CONCURRENT_SHARDS = env.int("BACKFILL_MAX_CONCURRENT_SHARDS", 2)
+BACKFILL_DEVICES_MAX_CONCURRENCY = env.int("BACKFILL_DEVICES_MAX_CONCURRENCY", 2)  # Per shard
+BACKFILL_WINDOWS_MAX_CONCURRENCY = env.int("BACKFILL_WINDOWS_MAX_CONCURRENCY", 1)  # Per device
+BACKFILL_DEVICE_MAX_RETRIES = env.int("BACKFILL_DEVICE_MAX_RETRIES", 3)  # Per device and shard, after errors
+BACKFILL_STATE_TTL = env.int("BACKFILL_STATE_TTL", 60 * 60 * 24 * 30)  # Seconds the progress of a backfill is kept
+# Positions with a PDOP above this are dropped by default, as too inaccurate to be useful
+POSITIONS_MAX_PDOP = env.float("POSITIONS_MAX_PDOP", 10.0)
@@ -1,10 +1,13 @@
 import importlib
 import inspect
-import json
 from typing import Optional, Union
+import pyjq
 from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
-from app.services.utils import StructHexString, UISchemaModelMixin, FieldWithUIOptions, UIOptions
+from app import settings
+from app.services.utils import (
+    StructHexString, UISchemaModelMixin, FieldWithUIOptions, UIOptions, TTLCache, to_primitive
+)
 
 
 class WebhookConfiguration(UISchemaModelMixin, BaseModel):
@@ -36,6 +39,13 @@ class JQTransformConfig(UISchemaModelMixin, BaseModel):
             widget="textarea",  # ToDo: Use a better (custom) widget to render the JQ filter
         )
     )
+    jq_batch_mode: bool = FieldWithUIOptions(
+        default=False,
+        description="Apply the JQ filter to each item of a list payload, instead of to the whole list.",
+        ui_options=UIOptions(
+            widget="checkbox",
+        )
+    )
 
 
 class GenericJsonTransformConfig(JQTransformConfig, DynamicSchemaConfig):
@@ -76,7 +86,15 @@ class HexStringPayload(WebhookPayload):
         Generate a dictionary representation of the model.
         This is overriden to be able to serialize StructHexString objects.
         """
-        return json.loads(self.json())
+        return to_primitive(super().dict(
+            include=include,
+            exclude=exclude,
+            by_alias=by_alias,
+            skip_defaults=skip_defaults,
+            exclude_unset=exclude_unset,
+            exclude_defaults=exclude_defaults,
+            exclude_none=exclude_none,
+        ))
 
     class Config:
         arbitrary_types_allowed = True
@@ -93,6 +111,29 @@ class GenericJsonWithHexStrPayload(HexStringPayload, GenericJsonPayload):
     pass
 
 
+# Compiled JQ programs, by filter. Compiling a filter is much slower than running it
+_jq_programs = TTLCache(maxsize=settings.JQ_PROGRAMS_CACHE_SIZE)
+
+
+def get_jq_program(jq_filter: str):
+    """Returns the compiled JQ program for the filter, compiling it only the first time it's requested"""
+    if (program := _jq_programs.get(jq_filter)) is None:
+        program = pyjq.compile(jq_filter)
+        _jq_programs.set(jq_filter, program)
+    return program
+
+
+def run_jq(jq_filter: str, data) -> list:
+    """Transforms the data with a JQ filter, returning all the results"""
+    return get_jq_program(jq_filter).all(data)
+
+
+def run_jq_batch(jq_filter: str, items: list) -> list:
+    """Transforms each item with the same compiled JQ filter, returning the results of all the items"""
+    program = get_jq_program(jq_filter)
+    return [result for item in items for result in program.all(item)]
+
+
 def get_webhook_handler():
 
     # Import the module using importlib
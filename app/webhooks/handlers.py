@@ -1,19 +1,18 @@
-import json
-import pyjq
 from app.services.gundi import send_observations_to_gundi, send_events_to_gundi
 from app.services.activity_logger import webhook_activity_logger
-from .core import GenericJsonPayload,  GenericJsonTransformConfig
+from app.services.utils import to_primitive
+from .core import GenericJsonPayload,  GenericJsonTransformConfig, run_jq, run_jq_batch
 
 
 @webhook_activity_logger()
 async def webhook_handler(payload: GenericJsonPayload, integration=None, webhook_config: GenericJsonTransformConfig = None):
     print(f"Webhook handler executed with integration: {integration}. \nPayload: {payload}. \nConfig: {webhook_config}")
-    if isinstance(payload, list):
-        input_data = [json.loads(i.json()) for i in payload]
-    else:
-        input_data = json.loads(payload.json())
+    input_data = to_primitive(payload)  # A list of payloads becomes a list too
     filter_expression = webhook_config.jq_filter.replace("\n", ""). replace(" ", "")
-    transformed_data = pyjq.all(filter_expression, input_data)
+    if isinstance(input_data, list) and webhook_config.jq_batch_mode:
+        transformed_data = run_jq_batch(filter_expression, input_data)
+    else:
+        transformed_data = run_jq(filter_expression, input_data)
     print(f"Transformed Data:\n: {transformed_data}")
     if webhook_config.output_type == "obv":  # ToDo: Use an enum?
         response = await send_observations_to_gundi(
@@ -0,0 +1,95 @@
+"""
+Compares the per-record transform of Onyesha positions, used before, with the columnar (bulk) transform.
+
+Usage (from the repository root):
+    python -m benchmarks.transform_positions [number of positions]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app.actions.client import OnyeshaPosition
+from app.actions.configurations import PositionFilters
+from app.actions.handlers import ensure_timezone_aware
+from app.actions.transformers import transform_positions
+
+
+def transform(position: OnyeshaPosition) -> dict:
+    return {
+        "source": position.DeviceID,
+        "source_name": position.DeviceID,
+        "type": "tracking-device",
+        "recorded_at": ensure_timezone_aware(position.RecDateTime).isoformat(),
+        "location": {
+            "lat": position.Latitude,
+            "lon": position.Longitude
+        },
+        "additional": position.dict(exclude={"DeviceID", "Latitude", "Longitude", "RecDateTime"})
+    }
+
+
+def make_positions(count: int) -> list:
+    start = datetime(2024, 1, 1)
+    return [
+        OnyeshaPosition(
+            ChannelStatus="ok",
+            UploadTimeStamp=start + timedelta(minutes=i, seconds=30),
+            Latitude=random.uniform(-90, 90),
+            Longitude=random.uniform(-180, 180),
+            Altitude=random.uniform(0, 3000),
+            ECEFx=random.randint(-6_000_000, 6_000_000),
+            ECEFy=random.randint(-6_000_000, 6_000_000),
+            ECEFz=random.randint(-6_000_000, 6_000_000),
+            RxStatus=0,
+            PDOP=random.uniform(0.5, 10),
+            MainV=3.6,
+            BkUpV=3.0,
+            Temperature=random.uniform(-10, 45),
+            FixDuration=random.randint(1, 120),
+            bHasTempVoltage=True,
+            DevName="collar",
+            DeltaTime=0,
+            FixType=3,
+            CEPRadius=random.randint(1, 50),
+            CRC=0,
+            DeviceID=random.randint(1000, 1100),
+            RecDateTime=start + timedelta(minutes=i, microseconds=random.randint(1, 999_999)),
+        )
+        for i in range(count)
+    ]
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count: int):
+    positions = make_positions(count)
+
+    # Both paths must produce the same observations. recorded_at is formatted differently (always in UTC, with
+    # microseconds, in the bulk transform), so the timestamps are compared instead
+    per_record = [transform(position) for position in positions]
+    bulk, _ = transform_positions(positions)
+    assert len(per_record) == len(bulk)
+    for expected, observation in zip(per_record, bulk):
+        assert datetime.fromisoformat(expected.pop("recorded_at")) == datetime.fromisoformat(observation.pop("recorded_at"))
+        assert expected == observation
+
+    per_record_time = timeit(lambda items: [transform(item) for item in items], positions)
+    bulk_time = timeit(transform_positions, positions)
+    filtered_time = timeit(transform_positions, positions, PositionFilters())
+    print(f"Positions: {count}")
+    print(f"Per record: {per_record_time:.3f}s ({count / per_record_time:,.0f} positions/s)")
+    print(f"Bulk:       {bulk_time:.3f}s ({count / bulk_time:,.0f} positions/s)")
+    print(f"Speedup:    {per_record_time / bulk_time:.1f}x")
+    print(f"Bulk with quality filters: {filtered_time:.3f}s ({count / filtered_time:,.0f} positions/s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
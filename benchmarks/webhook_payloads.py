@@ -0,0 +1,109 @@
+"""
+Compares converting parsed webhook payloads to python primitives with a JSON round trip
+(json.loads(model.json())) against to_primitive(), for large list payloads.
+
+Usage (from the repository root):
+    python -m benchmarks.webhook_payloads [number of payloads]
+"""
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.services.utils import StructHexString, get_dynamic_model, to_primitive
+from app.webhooks.core import GenericJsonPayload, GenericJsonWithHexStrPayload
+
+
+HEX_FORMAT = {
+    "byte_order": ">",
+    "fields": [
+        {"name": "start_bit", "format": "B", "output_type": "int"},
+        {"name": "latitude", "format": "i"},
+        {"name": "longitude", "format": "i"},
+        {"name": "status", "format": "H", "output_type": "hex", "bit_fields": [
+            {"name": "gps_fix", "start_bit": 0, "end_bit": 0},
+            {"name": "battery", "start_bit": 1, "end_bit": 4, "output_type": "int"},
+        ]},
+    ]
+}
+
+JSON_SCHEMA = {
+    "title": "DevicePayload",
+    "type": "object",
+    "properties": {
+        "device_id": {"type": "string"},
+        "received_at": {"type": "string"},
+        "battery": {"type": "number"},
+        "active": {"type": "boolean"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "location": {"type": "object"},
+    },
+    "required": ["device_id"]
+}
+
+
+class CollarPayload(GenericJsonWithHexStrPayload):
+    device_id: uuid.UUID
+    received_at: datetime
+    hex_data: StructHexString
+
+
+def make_json_payloads(count: int) -> list:
+    model = get_dynamic_model(json_schema=JSON_SCHEMA, base_model=GenericJsonPayload, ref_template="definitions")
+    return [
+        model.parse_obj({
+            "device_id": f"device-{i % 100}",
+            "received_at": (datetime(2024, 1, 1) + timedelta(seconds=i)).isoformat(),
+            "battery": random.uniform(0, 100),
+            "active": bool(i % 2),
+            "tags": ["collar", "gps"],
+            "location": {"lat": random.uniform(-90, 90), "lon": random.uniform(-180, 180)},
+            "extra": {"rssi": -random.randint(40, 120)},
+        })
+        for i in range(count)
+    ]
+
+
+def make_hex_payloads(count: int) -> list:
+    return [
+        CollarPayload.parse_obj({
+            "hex_format": HEX_FORMAT,
+            "hex_data_field": "hex_data",
+            "device_id": str(uuid.uuid4()),
+            "received_at": datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=i),
+            "hex_data": bytes(random.getrandbits(8) for _ in range(11)).hex(),
+        })
+        for i in range(count)
+    ]
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def round_trip(payloads: list) -> list:
+    return [json.loads(payload.json()) for payload in payloads]
+
+
+def main(count: int):
+    for name, payloads in [("JSON", make_json_payloads(count)), ("Hex string", make_hex_payloads(count))]:
+        # Both paths must produce the same data
+        assert to_primitive(payloads) == round_trip(payloads)
+
+        round_trip_time = timeit(round_trip, payloads)
+        primitive_time = timeit(to_primitive, payloads)
+        print(f"{name} payloads: {count}")
+        print(f"  JSON round trip: {round_trip_time:.3f}s ({count / round_trip_time:,.0f} payloads/s)")
+        print(f"  to_primitive:    {primitive_time:.3f}s ({count / primitive_time:,.0f} payloads/s)")
+        print(f"  Speedup:         {round_trip_time / primitive_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)